@@ -0,0 +1,604 @@
+"""Офлайн-бенчмарк этапов тика бота.
+
+Binance и Telegram подменяются заглушками: локальный HTTP-сервер FakeBinanceServer отдаёт
+детерминированные синтетические свечи, FakeBot только запоминает отправленные сообщения. Замеряются загрузка и обновление
+истории, расчёт индикаторов, распознавание свечных паттернов, полный тик send_signal,
+анализ разного числа символов панелью и по одному, рассылка на разное число подписчиков и её же стоимость
+с включённым журналом (синхронным и через очередь). Результат пишется в JSON и может сравниваться
+с сохранённым эталоном:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import websockets
+from telegram.error import Forbidden
+
+REPORT_VERSION = 1
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_SUBSCRIBERS = [1, 100, 10_000, 100_000]
+DEFAULT_PANEL_SYMBOLS = [7, 50, 500]
+# Цены символов панели по кругу — разного порядка, как у BTC, TON, PEPE, SOL, NEAR, ETH и DOGE:
+# символ с ценой около 1e-5 рядом с дорогими проверяет, что ошибки округления не переходят между символами
+PANEL_PRICE_SCALES = [65_000, 5, 1e-5, 150, 5, 3_000, 0.15]
+NOISE_FLOOR = 0.005  # Разница меньше этой (в секундах) не считается регрессией
+
+# ======================= Синтетические свечи =======================
+
+def _uniform(indices, salt, stream):
+    """Детерминированные псевдослучайные числа в [0, 1) для номеров свечей (splitmix64)."""
+    with np.errstate(over='ignore'):
+        x = indices.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64((salt * 8 + stream) & 0xFFFFFFFF)
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+def _price(indices, salt):
+    """Цена закрытия свечи с номером indices: две волны тренда и шум."""
+    base = 50 + salt % 1000
+    return base * (1 + 0.1 * np.sin(indices / 97) + 0.05 * np.sin(indices / 613 + salt % 7)
+                   + 0.004 * (_uniform(indices, salt, 0) - 0.5))
+
+def synthetic_candles(symbol, timeframe, first_open_ms, count):
+    """Строит count синтетических свечей в формате klines_to_dataframe, начиная с first_open_ms.
+
+    Свеча зависит только от символа, таймфрейма и времени открытия, поэтому один и тот же
+    интервал всегда выглядит одинаково, сколько бы раз и какими кусками его ни запрашивали.
+    """
+    step = interval_ms(timeframe)
+    indices = first_open_ms // step + np.arange(count, dtype=np.int64)
+    salt = zlib.crc32(f"{symbol}:{timeframe}".encode())
+    close = _price(indices, salt)
+    open_ = _price(indices - 1, salt)
+    high = np.maximum(open_, close) * (1 + 0.002 * _uniform(indices, salt, 1))
+    low = np.minimum(open_, close) * (1 - 0.002 * _uniform(indices, salt, 2))
+    volume = 1 + 100 * _uniform(indices, salt, 3)
+    timestamps = indices * step
+    df = pd.DataFrame({
+        'open': open_,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': volume,
+        'close_time': timestamps + step - 1,
+        'quote_asset_volume': volume * close,
+        'number_of_trades': (10 + 500 * _uniform(indices, salt, 4)).astype(np.int64),
+        'taker_buy_base_asset_volume': volume / 2,
+        'taker_buy_quote_asset_volume': volume * close / 2,
+    }, index=pd.DatetimeIndex(pd.to_datetime(timestamps, unit='ms', utc=True), name='timestamp'))
+    return df
+
+def interval_ms(timeframe):
+    """Длительность свечи таймфрейма в миллисекундах."""
+    units = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 604_800_000}
+    return int(timeframe[:-1]) * units[timeframe[-1]]
+
+def candles_to_klines(df):
+    """Преобразует DataFrame свечей в ответ Binance (списки со строковыми ценами)."""
+    timestamps = df.index.as_unit('ms').asi8
+    columns = [df[col].to_numpy() for col in ('open', 'high', 'low', 'close', 'volume', 'close_time',
+                                               'quote_asset_volume', 'number_of_trades',
+                                               'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume')]
+    return [
+        [int(ts), str(o), str(h), str(l), str(c), str(v), int(ct), str(q), int(n), str(tb), str(tq), '0']
+        for ts, o, h, l, c, v, ct, q, n, tb, tq in zip(timestamps, *columns)
+    ]
+
+def candles_to_kline_events(df, symbol, timeframe, closed=True):
+    """Преобразует DataFrame свечей в события kline комбинированного потока Binance (x — свеча закрыта)."""
+    timestamps = df.index.as_unit('ms').asi8
+    return [
+        {'e': 'kline', 'E': int(row.close_time), 's': symbol, 'k': {
+            't': int(ts), 'T': int(row.close_time), 's': symbol, 'i': timeframe,
+            'o': str(row.open), 'c': str(row.close), 'h': str(row.high), 'l': str(row.low), 'v': str(row.volume),
+            'n': int(row.number_of_trades), 'x': closed, 'q': str(row.quote_asset_volume),
+            'V': str(row.taker_buy_base_asset_volume), 'Q': str(row.taker_buy_quote_asset_volume), 'B': '0',
+        }}
+        for ts, row in zip(timestamps, df.itertuples())
+    ]
+
+# ======================= Заглушки Binance и Telegram =======================
+
+class FakeBinanceHandler(BaseHTTPRequestHandler):
+    """Обработчик /api/v3/klines: синтетические свечи вплоть до текущей формирующейся.
+
+    Ответы из injected (статус, заголовки, JSON) отдаются по одному вместо свечей — так имитируются
+    ошибки 5xx, 429/418 с Retry-After и 4xx. used_weight подменяет значение X-MBX-USED-WEIGHT-1M.
+    """
+
+    latency = 0.0  # Имитация сетевой задержки одного запроса (в секундах)
+    calls = 0
+    injected = []
+    used_weight = None
+    request_times = []  # Время (monotonic) каждого запроса
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/api/v3/klines':
+            self.send_error(404)
+            return
+        FakeBinanceHandler.calls += 1
+        FakeBinanceHandler.request_times.append(time.monotonic())
+        if FakeBinanceHandler.latency:
+            time.sleep(FakeBinanceHandler.latency)
+        if FakeBinanceHandler.injected:
+            status, headers, payload = FakeBinanceHandler.injected.pop(0)
+            self.reply(status, json.dumps(payload).encode(), headers)
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        interval = params['interval']
+        step = interval_ms(interval)
+        now_ms = int(time.time() * 1000)
+        end_ms = min(int(params.get('endTime', now_ms)), now_ms)
+        first_open = (int(params.get('startTime', 0)) + step - 1) // step * step
+        count = min(max(0, (end_ms - first_open) // step + 1), int(params.get('limit', 500)))
+        body = json.dumps(candles_to_klines(synthetic_candles(params['symbol'], interval, first_open, count))).encode()
+        self.reply(200, body)
+
+    def reply(self, status, body, headers=None):
+        used_weight = FakeBinanceHandler.used_weight
+        headers = {'X-MBX-USED-WEIGHT-1M': str(FakeBinanceHandler.calls * 2 if used_weight is None else used_weight),
+                   **(headers or {})}
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeBinanceServer:
+    """Локальный мок REST API Binance в фоновом потоке."""
+
+    def __init__(self, latency=0.0):
+        FakeBinanceHandler.latency = latency
+        FakeBinanceHandler.calls = 0
+        FakeBinanceHandler.injected = []
+        FakeBinanceHandler.used_weight = None
+        FakeBinanceHandler.request_times = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBinanceHandler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def inject(self, status, payload=None, **headers):
+        """Ставит в очередь ответ со статусом status вместо очередной порции свечей."""
+        FakeBinanceHandler.injected.append((status, {name.replace('_', '-'): value for name, value in headers.items()},
+                                            payload if payload is not None else {'code': -1000, 'msg': 'error'}))
+
+    @property
+    def request_times(self):
+        return FakeBinanceHandler.request_times
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeBinanceStream:
+    """Локальный мок комбинированного потока свечей Binance (WebSocket) в текущем цикле событий.
+
+    Каждое подключение воспроизводит следующую сессию из sessions — список событий kline. После всех
+    сессий, кроме последней, ожидается on_disconnect(номер сессии) и соединение закрывается сервером,
+    как при обрыве; последняя сессия остаётся открытой, пока клиент не отключится.
+    """
+
+    def __init__(self, sessions, on_disconnect=None):
+        self.sessions = list(sessions)
+        self.on_disconnect = on_disconnect
+        self.connections = []  # Запрошенные потоки каждого подключения
+        self.replayed = asyncio.Event()  # Последняя сессия отправлена
+        self.server = None
+        self.url = None
+
+    async def start(self):
+        self.server = await websockets.serve(self.handle, '127.0.0.1', 0)
+        self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/stream"
+        return self
+
+    async def handle(self, websocket):
+        number = len(self.connections)
+        self.connections.append(parse_qs(urlparse(websocket.request.path).query).get('streams', [''])[0].split('/'))
+        for event in self.sessions[number] if number < len(self.sessions) else []:
+            stream = f"{event['s'].lower()}@kline_{event['k']['i']}"
+            await websocket.send(json.dumps({'stream': stream, 'data': event}))
+        if number < len(self.sessions) - 1:
+            if self.on_disconnect is not None:
+                await self.on_disconnect(number)
+            return
+        self.replayed.set()
+        await websocket.wait_closed()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Обработчик Bot API: на любой метод отвечает успехом и запоминает отправленные сообщения.
+
+    Первая попытка отправки в каждый чат с номером, кратным rate_limit_every, получает 429 с retry_after.
+    """
+
+    protocol_version = 'HTTP/1.1'  # Соединения переиспользуются, как у api.telegram.org
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'fake_bot'}
+        elif method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            every = self.server.rate_limit_every
+            if every and chat_id % every == 0 and chat_id not in self.server.limited_chats:
+                self.server.limited.append((time.monotonic(), chat_id))
+                self.server.limited_chats.add(chat_id)
+                retry_after = self.server.retry_after
+                self.reply({'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {retry_after}',
+                            'parameters': {'retry_after': retry_after}}, status=429)
+                return
+            self.server.sent.append((time.monotonic(), chat_id, params.get('text')))
+            result = {'message_id': len(self.server.sent), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        self.reply({'ok': True, 'result': result})
+
+    do_GET = do_POST
+
+    def reply(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeTelegramServer:
+    """Локальный мок Bot API в фоновом потоке; url подставляется в TELEGRAM_API_URL.
+
+    sent — список (время monotonic, chat_id, текст) принятых sendMessage, limited — (время, chat_id) ответов 429.
+    """
+
+    def __init__(self, rate_limit_every=0, retry_after=1):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTelegramHandler)
+        self.server.daemon_threads = True
+        self.server.rate_limit_every = rate_limit_every
+        self.server.retry_after = retry_after
+        self.server.sent = []
+        self.server.limited = []
+        self.server.limited_chats = set()
+        self.sent = self.server.sent
+        self.limited = self.server.limited
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/bot'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeBot:
+    """Заглушка telegram.Bot: запоминает отправленные сообщения.
+
+    fail_every — каждый такой чат «заблокировал бота» и получает Forbidden.
+    """
+
+    def __init__(self, latency=0.0, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_every and chat_id % self.fail_every == 0:
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        self.sent.append((chat_id, text))
+
+class FakeContext:
+    """Заглушка контекста задачи JobQueue для вызова send_signal."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.job = None
+
+# ======================= Замеры =======================
+
+def timed(func, *args):
+    """Выполняет функцию и возвращает (время в секундах, результат)."""
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+def reset_bot_state(bot):
+    """Сбрасывает кэши бота, чтобы следующий замер начинался с холодного старта."""
+    bot.candle_cache.clear()
+    bot.candle_cache_dirty.clear()
+    bot.indicator_states.clear()
+    bot.market_trends.clear()
+    bot._fetch_results.clear()
+    bot.signal_evaluations.clear()
+    bot.sent_signals.clear()
+
+def seed_history(bot, symbol, timeframe, rows):
+    """Записывает в хранилище rows закрытых свечей, заканчивающихся за две свечи до текущей."""
+    step = interval_ms(timeframe)
+    last_open = (int(time.time() * 1000) // step - 2) * step
+    df = synthetic_candles(symbol, timeframe, last_open - (rows - 1) * step, rows)
+    bot.append_candles(symbol, timeframe, df)
+    return df
+
+class Recorder:
+    """Накапливает замеры по ключам вида 'этап/параметр=значение'."""
+
+    def __init__(self):
+        self.runs = {}
+
+    def add(self, key, seconds):
+        self.runs.setdefault(key, []).append(seconds)
+
+    def results(self):
+        return {key: {'median': statistics.median(runs), 'runs': runs} for key, runs in self.runs.items()}
+
+def bench_history_size(bot, recorder, data_root, symbol, timeframe, rows, repeat):
+    """Замеряет этапы обработки одной пары на истории длиной rows."""
+    bot.DATA_DIR = os.path.join(data_root, f'rows_{rows}')
+    # Окно хранения расширяется до замеряемой длины истории, иначе в памяти окажется не больше окна
+    bot.RETENTION_BARS = {**bot.RETENTION_BARS, timeframe: rows}
+    seed_history(bot, symbol, timeframe, rows)
+    for _ in range(repeat):
+        reset_bot_state(bot)
+        elapsed, df = timed(bot.load_historical_data, symbol, timeframe)
+        recorder.add(f'load_historical_data/rows={rows}', elapsed)
+
+        elapsed, df = timed(bot.update_historical_data, df, symbol, timeframe)
+        recorder.add(f'update_historical_data/rows={rows}', elapsed)
+
+        # Холодный расчёт строит состояние индикаторов по всей истории, тёплый добавляет одну свечу
+        df = bot.drop_forming_candle(df, timeframe)
+        elapsed, _ = timed(bot.analyze_data, df.iloc[:-1], symbol, timeframe, 'uptrend')
+        recorder.add(f'analyze_data_cold/rows={rows}', elapsed)
+        elapsed, _ = timed(bot.analyze_data, df, symbol, timeframe, 'uptrend')
+        recorder.add(f'analyze_data/rows={rows}', elapsed)
+
+        elapsed, _ = timed(bot.detect_candlestick_patterns, df)
+        recorder.add(f'detect_candlestick_patterns/rows={rows}', elapsed)
+        elapsed, _ = timed(bot.detect_candlestick_pattern, df.iloc[-1])
+        recorder.add(f'detect_candlestick_pattern/rows={rows}', elapsed)
+
+    # Полный тик: первый — с холодными кэшами, следующие — как в установившемся режиме
+    reset_bot_state(bot)
+    context = FakeContext(FakeBot())
+    for run in range(repeat + 1):
+        bot._fetch_results.clear()
+        # В установившемся режиме к каждому тику закрывается новая свеча, поэтому анализ не пропускается
+        bot.signal_evaluations.clear()
+        started = time.perf_counter()
+        asyncio.run(bot.send_signal(context))
+        recorder.add(f'send_signal_cold/rows={rows}' if run == 0 else f'send_signal/rows={rows}',
+                     time.perf_counter() - started)
+        bot.shutdown_executors()
+
+def scale_prices(df, scale):
+    """Переводит синтетические свечи (цены около 50–1050) в масштаб цены scale."""
+    df = df.copy()
+    factor = scale / 500
+    for column in ('open', 'high', 'low', 'close'):
+        df[column] *= factor
+    return df
+
+def bench_panel(bot, recorder, symbols, timeframe, repeat):
+    """Замеряет анализ последней свечи symbols символов одной панелью и по одному символу.
+
+    Сигналы панели должны в точности совпадать с сигналами analyze_data по каждому символу.
+    """
+    step = interval_ms(timeframe)
+    first_open = (int(time.time() * 1000) // step - bot.PANEL_HISTORY_BARS) * step
+    names = [f'SYM{number}USDT' for number in range(symbols)]
+    frames = [
+        scale_prices(synthetic_candles(name, timeframe, first_open, bot.PANEL_HISTORY_BARS),
+                     PANEL_PRICE_SCALES[number % len(PANEL_PRICE_SCALES)])
+        for number, name in enumerate(names)
+    ]
+    times = [df.index[-1] for df in frames]
+    trends = ['uptrend'] * symbols
+
+    # По одному символу — потоковый расчёт в установившемся режиме: состояние уже построено
+    reset_bot_state(bot)
+    for name, df in zip(names, frames):
+        bot.analyze_data(df.iloc[:-1], name, timeframe, 'uptrend')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        expected = [bot.analyze_data(df, name, timeframe, 'uptrend') for name, df in zip(names, frames)]
+        recorder.add(f'analyze_per_symbol/symbols={symbols}', time.perf_counter() - started)
+        # Тёплое состояние уже включает последнюю свечу: откатываем его к предыдущему замеру
+        for name, df in zip(names, frames):
+            bot.indicator_states.pop((name, timeframe))
+            bot.analyze_data(df.iloc[:-1], name, timeframe, 'uptrend')
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        candles = bot.stack_panel(frames)
+        signals = bot.analyze_panel(names, timeframe, candles, times, trends)
+        recorder.add(f'analyze_panel/symbols={symbols}', time.perf_counter() - started)
+    assert signals == expected, 'сигналы панели расходятся с analyze_data'
+    # Индикаторы панели совпадают с расчётом по одному символу и у самых дешёвых символов
+    panel = bot.compute_indicator_panel(candles)
+    for row, df in enumerate(frames):
+        reference = bot.compute_indicators(df)
+        for name in ('SMA5', 'RSI', 'MACD', 'ADX', 'MFI', 'Stochastic', 'Bollinger_High'):
+            assert np.allclose(panel[name][row], reference[name].to_numpy(), rtol=1e-9, atol=0, equal_nan=True), (names[row], name)
+
+def bench_dispatch(bot, recorder, subscribers, repeat, send_latency):
+    """Замеряет рассылку одного сигнала subscribers подписчикам."""
+    for _ in range(repeat):
+        fake_bot = FakeBot(send_latency)
+        dispatcher = bot.SignalDispatcher()
+
+        async def dispatch():
+            dispatcher.queue_signal('🔔 **Сигнал для BTCUSDT на таймфрейме 15m:**\nбенчмарк', range(subscribers))
+            await dispatcher.flush(fake_bot)
+
+        started = time.perf_counter()
+        asyncio.run(dispatch())
+        recorder.add(f'dispatch/subscribers={subscribers}', time.perf_counter() - started)
+        assert len(fake_bot.sent) == subscribers
+
+def bench_logging(bot, recorder, log_root, subscribers, repeat):
+    """Замеряет рассылку subscribers подписчикам (каждый второй заблокировал бота) с журналом уровня INFO в файл.
+
+    logging_off — журнал выключен, logging_sync — запись в вызывающем потоке, logging_queue — через очередь.
+    Разница с logging_off — время цикла событий, потраченное на журнал.
+    """
+    bot_logger = logging.getLogger(bot.__name__)
+    pipelines = [('logging_off', None), ('logging_sync', 0), ('logging_queue', bot.LOG_QUEUE_SIZE)]
+    try:
+        for name, queue_size in pipelines:
+            bot.setup_logging(log_file=os.path.join(log_root, f'{name}.log'), queue_size=queue_size or 0)
+            bot_logger.setLevel(logging.CRITICAL if queue_size is None else logging.INFO)
+            for _ in range(repeat):
+                fake_bot = FakeBot(fail_every=2)
+                dispatcher = bot.SignalDispatcher()
+
+                async def dispatch():
+                    dispatcher.queue_signal('🔔 **Сигнал для BTCUSDT на таймфрейме 15m:**\nбенчмарк', range(subscribers))
+                    await dispatcher.flush(fake_bot)
+
+                started = time.perf_counter()
+                asyncio.run(dispatch())
+                recorder.add(f'{name}/subscribers={subscribers}', time.perf_counter() - started)
+                assert len(fake_bot.sent) == subscribers // 2
+    finally:
+        # Остальные замеры снова пишут журнал синхронно в stderr
+        bot.setup_logging(log_file='', queue_size=0)
+        bot_logger.setLevel(logging.WARNING)
+
+# ======================= Отчёт и сравнение с эталоном =======================
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Печатает сравнение с эталоном и возвращает список регрессировавших замеров."""
+    regressions = []
+    print(f"{'замер':<48} {'эталон, с':>12} {'сейчас, с':>12} {'отношение':>10}")
+    for key, result in results.items():
+        reference = baseline.get('results', {}).get(key)
+        if reference is None:
+            print(f"{key:<48} {'—':>12} {result['median']:>12.4f} {'новый':>10}")
+            continue
+        ratio = result['median'] / reference['median'] if reference['median'] else float('inf')
+        regressed = ratio > 1 + tolerance and result['median'] - reference['median'] > NOISE_FLOOR
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<48} {reference['median']:>12.4f} {result['median']:>12.4f} {ratio:>9.2f}x{' ⚠️' if regressed else ''}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк этапов тика бота.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Длины истории в свечах')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=DEFAULT_SUBSCRIBERS, help='Количество подписчиков')
+    parser.add_argument('--panel-symbols', type=int, nargs='+', default=DEFAULT_PANEL_SYMBOLS, help='Количество символов в панели')
+    parser.add_argument('--symbol', default='BTCUSDT', help='Символ для замеров')
+    parser.add_argument('--timeframe', default='15m', help='Таймфрейм для замеров')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов каждого замера')
+    parser.add_argument('--binance-latency', type=float, default=0.0, help='Задержка запроса к заглушке Binance (с)')
+    parser.add_argument('--send-latency', type=float, default=0.0, help='Задержка отправки сообщения заглушкой Telegram (с)')
+    parser.add_argument('--output', default='benchmark.json', help='Файл отчёта JSON')
+    parser.add_argument('--baseline', help='Отчёт-эталон для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимое замедление относительно эталона (доля)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    binance_server = FakeBinanceServer(args.binance_latency)
+
+    # Бот пишет хранилище и базу подписчиков в текущую директорию: работаем во временной
+    bot_root = tempfile.mkdtemp(prefix='bot-benchmark-')
+    os.chdir(bot_root)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+
+    logging.getLogger(bot.__name__).setLevel(logging.WARNING)
+    bot.BINANCE_API_URL = binance_server.url
+    # Лимиты Telegram сняты: замеряется собственная стоимость рассылки, а не ожидание лимитов
+    bot.TELEGRAM_GLOBAL_RATE = 1e9
+    bot.TELEGRAM_PER_CHAT_RATE = 1e9
+    bot.signal_dispatcher = bot.SignalDispatcher()
+    # Каждый тик анализирует одну пару, свеча которой «только что закрылась»
+    bot.CRYPTO_SYMBOLS = [args.symbol]
+    bot.TIMEFRAMES = [args.timeframe]
+    bot.get_due_timeframes = lambda moment: list(bot.TIMEFRAMES)
+    bot.add_subscriber(0)
+
+    recorder = Recorder()
+    for rows in args.sizes:
+        print(f"⏱️ История {rows} свечей...", flush=True)
+        bench_history_size(bot, recorder, bot_root, args.symbol, args.timeframe, rows, args.repeat)
+    for symbols in args.panel_symbols:
+        print(f"⏱️ Анализ {symbols} символов...", flush=True)
+        bench_panel(bot, recorder, symbols, args.timeframe, args.repeat)
+    for subscribers in args.subscribers:
+        print(f"⏱️ Рассылка {subscribers} подписчикам...", flush=True)
+        bench_dispatch(bot, recorder, subscribers, args.repeat, args.send_latency)
+        print(f"⏱️ Журнал рассылки {subscribers} подписчикам...", flush=True)
+        bench_logging(bot, recorder, bot_root, subscribers, args.repeat)
+    bot.close_subscribers_db()
+    bot.close_binance_client()
+    binance_server.close()
+
+    report = {
+        'version': REPORT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': recorder.results(),
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"📁 Отчёт записан в {output}.")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report['results'], baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Замедление больше {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print("✅ Регрессий относительно эталона нет.")
+    else:
+        for key, result in report['results'].items():
+            print(f"{key:<48} {result['median']:>12.4f} с")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,38 +1,87 @@
+import argparse
+import bisect
 import json
 import os
+import sqlite3
+import shutil
+import math
+import functools
+import hashlib
+import importlib
+import multiprocessing
+import pickle
+import random
+import socket
 import asyncio
 import logging
-from ta.trend import ADXIndicator, SMAIndicator, EMAIndicator, MACD
-from ta.volatility import BollingerBands, AverageTrueRange
-from ta.momentum import RSIIndicator, StochasticOscillator
-from ta.volume import OnBalanceVolumeIndicator, MFIIndicator
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from datetime import datetime, timedelta, timezone
+
+# Момент запуска процесса: от него отсчитывается время до первого ответа на команду и до первого тика
+PROCESS_STARTED = time.monotonic()
+
 from telegram import Update
+from telegram.error import RetryAfter, TimedOut, NetworkError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     ContextTypes,
+    MessageHandler,
+    filters,
 )
-from datetime import datetime, timedelta, timezone
-from binance import Client
-from binance.exceptions import BinanceAPIException
-import pandas as pd
+
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к его атрибуту.
+
+    pandas, numpy, aiohttp и websockets не нужны для ответа на команды, поэтому их импорт
+    не задерживает запуск бота. После импорта глобальное имя указывает уже на сам модуль.
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+aiohttp = LazyModule('aiohttp', 'aiohttp')
+websockets = LazyModule('websockets', 'websockets')
+np = LazyModule('numpy', 'np')
+pd = LazyModule('pandas', 'pd')
 
 # ======================= Конфигурация =======================
 
 # Замените на ваш реальный Telegram API токен
 API_TOKEN = '7564004976:AAF2YlriNyPWFh964GYoy__Wepcp-2RZNDI'
 
-# Замените на ваши Binance API ключ и секрет (если требуется)
+# Замените на ваш Binance API ключ (если требуется; для рыночных данных он не нужен)
 BINANCE_API_KEY = 'YOUR_BINANCE_API_KEY'
-BINANCE_API_SECRET = 'YOUR_BINANCE_API_SECRET'
 
 # Настройка логирования
+LOG_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_TEXT_FORMAT,
     level=logging.INFO  # Уровень логирования: DEBUG, INFO, WARNING, ERROR, CRITICAL
 )
 logger = logging.getLogger(__name__)
 
+# Журнал бота (см. setup_logging): записи ставятся в очередь, а форматирует и пишет их фоновый поток
+LOG_FORMAT = 'text'  # 'text' — строки, 'json' — объект JSON на запись с полями symbol, timeframe и stage
+LOG_FILE = ''  # Файл журнала (пусто — stderr)
+LOG_QUEUE_SIZE = 100_000  # Размер очереди записей; при переполнении записи отбрасываются (0 — писать синхронно)
+# Выборка повторяющихся сообщений горячего пути: этап -> в журнал попадает каждое N-е сообщение шаблона.
+# Предупреждения и ошибки пишутся всегда, а итоги тика сводятся в одну строку
+LOG_SAMPLE_EVERY = {'fetch': 10, 'trend': 10, 'analysis': 10}
+
 # Настройка уровней логирования для внешних библиотек
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
@@ -42,7 +91,8 @@ logging.getLogger("binance").setLevel(logging.WARNING)
 
 # Конфигурация
 CRYPTO_SYMBOLS = ['BTCUSDT', 'TONUSDT', 'PEPEUSDT', 'SOLUSDT', 'NEARUSDT', 'ETHUSDT', 'DOGEUSDT']
-SUBSCRIBERS_FILE = 'subscribers.json'
+SUBSCRIBERS_FILE = 'subscribers.json'  # Файл подписчиков прежнего формата (переносится в базу)
+SUBSCRIBERS_DB = 'subscribers.db'  # База подписчиков
 DATA_DIR = 'historical_data'  # Директория для хранения исторических данных
 
 # Таймфреймы для мультивременного анализа
@@ -51,72 +101,1292 @@ TIMEFRAMES = ['15m', '30m', '1h', '1d']  # 5 минут, 15 минут, 1 час
 # Словарь для кэширования трендов
 market_trends = {}
 
-# ======================= Инициализация Binance Client =======================
-
-try:
-    client = Client(BINANCE_API_KEY, BINANCE_API_SECRET)
-    client.ping()  # Проверяем соединение
-    logger.info("✅ Успешно подключились к Binance API.")
-except BinanceAPIException as e:
-    logger.error(f"❌ Ошибка подключения к Binance API: {e}")
-    exit(1)
-except Exception as e:
-    logger.error(f"❌ Неизвестная ошибка при подключении к Binance API: {e}")
-    exit(1)
+# Кэш свечей в памяти: (symbol, timeframe) -> DataFrame
+candle_cache = {}
+
+# Время открытия самой ранней свечи, изменённой в кэше после записи на диск: (symbol, timeframe) -> Timestamp
+candle_cache_dirty = {}
+
+# Блокировки кэша свечей, чтобы одна пара не обновлялась из нескольких потоков одновременно
+candle_cache_locks = {}
+
+# Объединение одинаковых запросов свечей: выполняющиеся запросы и свежие результаты по (symbol, timeframe)
+FETCH_FRESHNESS_WINDOW = 10  # Сколько секунд результат запроса считается свежим
+KLINES_REQUEST_WEIGHT = 2  # Вес запроса свечей в лимитах Binance
+_fetch_inflight = {}
+_fetch_results = {}
+_fetch_lock = threading.Lock()
+fetch_stats = {'hits': 0, 'coalesced': 0, 'upstream': 0, 'derived': 0}
+
+# Период фоновой записи кэша свечей на диск (в секундах)
+CANDLE_CACHE_FLUSH_INTERVAL = 300
+
+# Снимок состояния (кэш свечей, тренды, состояние индикаторов) для быстрого перезапуска
+SNAPSHOT_FILE = 'snapshot.pkl'
+SNAPSHOT_VERSION = 1  # Версия формата снимка; снимок другой версии не восстанавливается
+SNAPSHOT_INTERVAL = 300  # Период записи снимка (в секундах)
+
+# Старшие таймфреймы строятся из свечей самого младшего таймфрейма, а не запрашиваются у Binance отдельно
+DERIVE_TIMEFRAMES = True
+
+# Анализ запускается вскоре после закрытия свечи каждого таймфрейма
+SIGNAL_GRACE_DELAY = 5  # Пауза после закрытия свечи, чтобы биржа успела её финализировать (в секундах)
+
+# Сигнал того же направления не рассылается повторно, пока с предыдущей отправки не прошло
+# SIGNAL_COOLDOWN_BARS свечей таймфрейма, если только к нему не присоединились новые индикаторы
+SIGNAL_COOLDOWN_BARS = 4
+
+# Источник свежих свечей: 'rest' — запрос REST API после закрытия свечей (с паузой SIGNAL_GRACE_DELAY),
+# 'websocket' — комбинированный поток свечей Binance
+INGESTION_MODE = 'rest'
+BINANCE_WS_URL = 'wss://stream.binance.com:9443/stream'  # Адрес комбинированных потоков Binance
+WS_RECONNECT_MAX_DELAY = 60  # Максимальная пауза между переподключениями к потоку (в секундах)
+
+# Рассылка сигналов с учётом лимитов Telegram
+TELEGRAM_API_URL = 'https://api.telegram.org/bot'  # Адрес Bot API (можно указать локальный сервер)
+TELEGRAM_GLOBAL_RATE = 30  # Глобальный лимит сообщений в секунду
+TELEGRAM_PER_CHAT_RATE = 1  # Лимит сообщений в секунду для одного чата
+TELEGRAM_SEND_CONCURRENCY = 30  # Количество одновременных отправок
+TELEGRAM_SEND_RETRIES = 3  # Количество повторов при RetryAfter и сетевых ошибках
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+TELEGRAM_COALESCE_DELAY = 2  # Окно объединения сигналов в режиме WebSocket (в секундах)
+
+# Параллельное выполнение тика: потоки для запросов к Binance и процессы для тяжёлых расчётов индикаторов
+FETCH_WORKERS = 8  # Размер пула потоков для загрузки данных
+ANALYSIS_WORKERS = 2  # Размер пула процессов для расчёта индикаторов (0 — считать в основном процессе)
+TICK_CONCURRENCY = 8  # Максимум пар (symbol, timeframe), обрабатываемых одновременно
+
+# Движок анализа тика: 'panel' — все символы таймфрейма одной матрицей (символы × свечи),
+# 'streaming' — каждая пара отдельно с потоковым обновлением индикаторов
+ANALYSIS_ENGINE = 'panel'
+PANEL_HISTORY_BARS = 300  # Последние свечи символа, входящие в панель (не меньше 200 для SMA200)
+TICK_DEADLINE = 50  # Предельное время одного тика в секундах
+
+# Параллельная загрузка истории при холодном старте
+BACKFILL_WORKERS = 8  # Количество одновременных запросов фрагментов истории
+
+# Приём обновлений Telegram: 'polling' — опрос getUpdates, 'webhook' — локальный HTTP-сервер,
+# на который Telegram (или балансировщик перед репликами) присылает обновления
+UPDATE_MODE = 'polling'
+WEBHOOK_LISTEN = '0.0.0.0'  # Адрес HTTP-сервера вебхука
+WEBHOOK_PORT = 8443  # Порт HTTP-сервера вебхука
+WEBHOOK_PATH = 'telegram'  # Путь, по которому принимаются обновления
+WEBHOOK_URL = ''  # Публичный адрес вебхука для регистрации в Telegram (пусто — не регистрировать)
+WEBHOOK_SECRET_TOKEN = ''  # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (пусто — не проверять)
+
+# Несколько реплик бота: задачи по расписанию (тики, запись кэша и снимка) выполняет только ведущая реплика
+LEADER_ELECTION = False  # Включить, если запущено несколько реплик с общими базами
+LEADER_LEASE_DB = 'leader.db'  # База SQLite с арендой ведущей реплики (общая для всех реплик)
+LEADER_LEASE_TTL = 6  # Срок аренды: через столько секунд после падения ведущей реплики её заменит другая
+LEADER_RENEW_INTERVAL = 2  # Период продления аренды (в секундах)
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}"  # Имя реплики в аренде
+
+# Метрики и администрирование
+METRICS_HOST = '127.0.0.1'  # Адрес HTTP-сервера метрик Prometheus (только локальный доступ)
+METRICS_PORT = 9108  # Порт сервера метрик (0 — не запускать)
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Границы корзин гистограмм (в секундах)
+ADMIN_CHAT_IDS = set()  # chat_id администраторов, которым доступна команда /stats
+
+# Источник списка символов: 'static' — CRYPTO_SYMBOLS, 'exchange' — спотовые пары Binance по объёму, 'file' — UNIVERSE_FILE
+UNIVERSE_SOURCE = 'static'
+UNIVERSE_FILE = 'symbols.txt'  # Файл со списком символов, по одному в строке
+UNIVERSE_QUOTE_ASSET = 'USDT'  # Котируемая валюта пар при загрузке с биржи
+UNIVERSE_MIN_QUOTE_VOLUME = 10_000_000  # Минимальный суточный объём пары в котируемой валюте
+UNIVERSE_MAX_SYMBOLS = 0  # Максимум символов при загрузке с биржи (0 — без ограничения)
+
+# Распределение символов по процессам-воркерам (только для режима 'rest')
+SHARD_WORKERS = 0  # Количество процессов-шардов (0 — всё выполняется в процессе бота)
+SHARD_VIRTUAL_NODES = 64  # Виртуальных узлов на шард в кольце консистентного хеширования
+
+# Версия формата колоночного хранилища свечей
+CANDLE_STORAGE_VERSION = 2
+
+# Колонки свечей и их типы фиксированной ширины — одинаковые в памяти и в хранилище (timestamp и close_time — epoch в мс).
+# Цены и объём остаются float64: у float32 всего ~7 значащих цифр, этого мало для цен вроде 65000.12,
+# а объём участвует в OBV и MFI. Колонки, не используемые в расчётах, хранятся в компактных типах.
+CANDLE_STORAGE_COLUMNS = {
+    'timestamp': 'int64',
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'volume': 'float64',
+    'close_time': 'int64',
+    'quote_asset_volume': 'float32',
+    'number_of_trades': 'int32',
+    'taker_buy_base_asset_volume': 'float32',
+    'taker_buy_quote_asset_volume': 'float32',
+}
+
+# Окно хранения: сколько последних свечей держится в памяти и в рабочем хранилище, более старые уходят в архив
+RETENTION_BARS = {'15m': 3000, '30m': 3000, '1h': 3000, '1d': 1000}
+DEFAULT_RETENTION_BARS = 3000  # Окно хранения для таймфреймов, не указанных в RETENTION_BARS
+RETENTION_ARCHIVE_SLACK = 0.1  # Архивация запускается, когда хранилище превышает окно на эту долю
+CANDLE_ARCHIVE_DIR = 'historical_data_archive'  # Директория холодного архива старых свечей
+
+# REST API Binance
+BINANCE_API_URL = 'https://api.binance.com'  # Адрес REST API (можно указать локальный мок-сервер)
+BINANCE_REQUEST_TIMEOUT = 10  # Таймаут одного запроса (в секундах)
+BINANCE_POOL_SIZE = 20  # Максимум одновременных HTTP-соединений
+BINANCE_MAX_RETRIES = 5  # Количество повторов при сетевых ошибках, 5xx и 429
+BINANCE_RETRY_BASE_DELAY = 0.5  # Базовая пауза экспоненциального повтора (в секундах)
+BINANCE_RETRY_MAX_DELAY = 30  # Максимальная пауза между повторами (в секундах)
+BINANCE_WEIGHT_PER_MINUTE = 4800  # Клиентский бюджет веса в минуту (лимит Binance — 6000 на IP)
+
+# Колонки свечей Binance
+KLINE_COLUMNS = [
+    'timestamp', 'open', 'high', 'low', 'close', 'volume',
+    'close_time', 'quote_asset_volume', 'number_of_trades',
+    'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
+]
+
+# ======================= REST API Binance =======================
+
+class BinanceRequestError(Exception):
+    """Ошибка запроса к REST API Binance."""
+
+    def __init__(self, message, status=None, code=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+class BinanceWeightLimiter:
+    """Клиентский ограничитель веса запросов к Binance.
+
+    Биржа считает вес по IP за календарную минуту и сообщает его в заголовке X-MBX-USED-WEIGHT-1M,
+    поэтому учитываются и собственные запросы, и значение из ответов (в него входят запросы других
+    процессов с того же IP). После 429/418 выдача приостанавливается на время из Retry-After.
+    """
+
+    def __init__(self, weight_per_minute):
+        self.weight_per_minute = weight_per_minute
+        self.minute = None
+        self.used = 0
+        self.paused_until = 0.0
+
+    def _roll(self, now):
+        minute = int(now // 60)
+        if minute != self.minute:
+            self.minute = minute
+            self.used = 0
+
+    async def acquire(self, weight):
+        """Ждёт, пока в бюджете текущей минуты найдётся weight единиц, и резервирует их."""
+        while True:
+            now = time.time()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._roll(now)
+            if self.used + weight <= self.weight_per_minute:
+                self.used += weight
+                return
+            await asyncio.sleep((self.minute + 1) * 60 - now)
+
+    def update(self, used_weight):
+        """Учитывает вес, сообщённый биржей."""
+        self._roll(time.time())
+        self.used = max(self.used, used_weight)
+        metrics.set('binance_used_weight', used_weight)
+
+    def pause(self, seconds):
+        """Приостанавливает запросы на seconds секунд."""
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+class BinanceRestClient:
+    """Асинхронный клиент REST API Binance на общем пуле HTTP-соединений.
+
+    Соединение открывается при первом запросе. Сетевые ошибки, 5xx и 429/418 повторяются
+    с экспоненциальной паузой со случайным разбросом, вес запросов ограничивается BinanceWeightLimiter.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = (base_url or BINANCE_API_URL).rstrip('/')
+        self.limiter = BinanceWeightLimiter(BINANCE_WEIGHT_PER_MINUTE)
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            headers = {}
+            if BINANCE_API_KEY and not BINANCE_API_KEY.startswith('YOUR_'):
+                headers['X-MBX-APIKEY'] = BINANCE_API_KEY
+            self.session = aiohttp.ClientSession(
+                headers=headers,
+                connector=aiohttp.TCPConnector(limit=BINANCE_POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(total=BINANCE_REQUEST_TIMEOUT),
+            )
+        return self.session
+
+    async def request(self, path, params=None, weight=1):
+        """Выполняет GET-запрос и возвращает разобранный JSON-ответ."""
+        session = self._get_session()
+        error = None
+        for attempt in range(BINANCE_MAX_RETRIES + 1):
+            await self.limiter.acquire(weight)
+            metrics.inc('binance_requests_total')
+            metrics.inc('binance_request_weight_total', weight)
+            retry_after = None
+            try:
+                async with session.get(self.base_url + path, params=params) as response:
+                    used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+                    if used_weight is not None:
+                        self.limiter.update(int(used_weight))
+                    if response.status in (418, 429):
+                        retry_after = float(response.headers.get('Retry-After', 60))
+                        self.limiter.pause(retry_after)
+                        error = BinanceRequestError(f"превышен лимит запросов (HTTP {response.status})", response.status)
+                    elif response.status >= 500:
+                        error = BinanceRequestError(f"ошибка сервера (HTTP {response.status})", response.status)
+                    else:
+                        payload = await response.json(content_type=None)
+                        if response.status >= 400:
+                            raise BinanceRequestError(
+                                f"{payload.get('msg', 'ошибка запроса')} (HTTP {response.status})", response.status, payload.get('code'))
+                        return payload
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt < BINANCE_MAX_RETRIES:
+                # Полный случайный разброс паузы, чтобы повторы параллельных запросов не совпадали
+                delay = retry_after if retry_after is not None else random.uniform(
+                    0, min(BINANCE_RETRY_MAX_DELAY, BINANCE_RETRY_BASE_DELAY * 2 ** attempt))
+                metrics.inc('binance_retries_total')
+                logger.warning(f"⚠️ Запрос {path} к Binance не удался ({error}). Повтор через {delay:.1f} с.")
+                await asyncio.sleep(delay)
+        raise BinanceRequestError(f"запрос {path} не удался после {BINANCE_MAX_RETRIES} повторов: {error}")
+
+    async def get_klines(self, symbol, interval, start_time=None, end_time=None, limit=1000):
+        """Возвращает до limit свечей, открытых в интервале [start_time, end_time] (epoch в мс)."""
+        params = {'symbol': symbol, 'interval': interval, 'limit': limit}
+        if start_time is not None:
+            params['startTime'] = int(start_time)
+        if end_time is not None:
+            params['endTime'] = int(end_time)
+        return await self.request('/api/v3/klines', params, weight=KLINES_REQUEST_WEIGHT)
+
+    async def get_historical_klines(self, symbol, interval, start_time, end_time=None):
+        """Возвращает все свечи начиная с start_time, проходя по страницам по 1000 свечей."""
+        klines = []
+        while True:
+            page = await self.get_klines(symbol, interval, start_time, end_time)
+            klines.extend(page)
+            if len(page) < 1000:
+                return klines
+            start_time = page[-1][0] + 1
+
+    async def get_exchange_info(self):
+        return await self.request('/api/v3/exchangeInfo', weight=20)
+
+    async def get_ticker(self):
+        """Суточная статистика по всем парам."""
+        return await self.request('/api/v3/ticker/24hr', weight=80)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+# Клиент работает в собственном цикле событий в фоновом потоке: запросы из пулов потоков
+# и из основного цикла идут через один пул соединений и один ограничитель веса
+_binance_client = None
+_binance_loop = None
+_binance_lock = threading.Lock()
+
+def get_binance_client():
+    """Возвращает клиент Binance и его цикл событий, создавая их при первом обращении."""
+    global _binance_client, _binance_loop
+    with _binance_lock:
+        if _binance_client is None:
+            _binance_loop = asyncio.new_event_loop()
+            threading.Thread(target=_binance_loop.run_forever, name='binance', daemon=True).start()
+            _binance_client = BinanceRestClient()
+        return _binance_client, _binance_loop
+
+def binance_request(method, *args):
+    """Синхронно выполняет метод BinanceRestClient (по имени) в цикле клиента; вызывается из рабочих потоков."""
+    rest_client, loop = get_binance_client()
+    return asyncio.run_coroutine_threadsafe(getattr(rest_client, method)(*args), loop).result()
+
+def close_binance_client():
+    """Закрывает пул соединений и останавливает цикл клиента Binance."""
+    global _binance_client, _binance_loop
+    with _binance_lock:
+        if _binance_client is None:
+            return
+        asyncio.run_coroutine_threadsafe(_binance_client.close(), _binance_loop).result(timeout=10)
+        _binance_loop.call_soon_threadsafe(_binance_loop.stop)
+        _binance_client = _binance_loop = None
+
+def reset_binance_client():
+    """Забывает клиент, унаследованный от родительского процесса (его цикл событий остался в родителе)."""
+    global _binance_client, _binance_loop
+    _binance_client = _binance_loop = None
 
 # Создаём директорию для хранения данных, если её нет
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
     logger.info(f"📁 Создана директория для хранения данных: {DATA_DIR}")
 
+# ======================= Пулы выполнения =======================
+
+_fetch_executor = None
+_analysis_executor = None
+
+def get_fetch_executor():
+    """Возвращает пул потоков для блокирующих запросов к Binance и работы с хранилищем."""
+    global _fetch_executor
+    if _fetch_executor is None:
+        _fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch')
+    return _fetch_executor
+
+def get_analysis_executor():
+    """Возвращает пул процессов для расчёта индикаторов (None, если пул отключён).
+
+    Пул создаётся, когда в процессе уже работают потоки (загрузка, клиент Binance, журнал, метрики),
+    поэтому рабочие процессы запускаются через forkserver, а не копированием процесса с чужими блокировками.
+    """
+    global _analysis_executor
+    if _analysis_executor is None and ANALYSIS_WORKERS > 0:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _analysis_executor = ProcessPoolExecutor(
+            max_workers=ANALYSIS_WORKERS, mp_context=multiprocessing.get_context(method), initializer=stop_logging)
+    return _analysis_executor
+
+async def run_fetch(func, *args):
+    """Выполняет блокирующую функцию загрузки данных в пуле потоков."""
+    return await asyncio.get_running_loop().run_in_executor(get_fetch_executor(), func, *args)
+
+async def run_analysis(func, *args):
+    """Выполняет ресурсоёмкую функцию расчёта в пуле процессов."""
+    executor = get_analysis_executor()
+    if executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+def shutdown_executors():
+    """Останавливает пулы выполнения."""
+    global _fetch_executor, _analysis_executor, _backfill_executor
+    if _backfill_executor is not None:
+        _backfill_executor.shutdown(wait=False, cancel_futures=True)
+        _backfill_executor = None
+    if _fetch_executor is not None:
+        _fetch_executor.shutdown(wait=False, cancel_futures=True)
+        _fetch_executor = None
+    if _analysis_executor is not None:
+        _analysis_executor.shutdown(wait=False, cancel_futures=True)
+        _analysis_executor = None
+
+# ======================= Метрики =======================
+
+# Метрики бота: имя -> (тип Prometheus, описание)
+METRIC_DEFINITIONS = {
+    'signal_stage_seconds': ('histogram', 'Длительность этапов обработки пары (fetch, parse, storage, indicators, evaluate)'),
+    'tick_duration_seconds': ('histogram', 'Длительность тика анализа'),
+    'tick_overruns_total': ('counter', 'Тики, не уложившиеся в TICK_DEADLINE'),
+    'tick_overlaps_total': ('counter', 'Тики, запущенные до завершения предыдущего'),
+    'binance_requests_total': ('counter', 'Запросы к REST API Binance'),
+    'binance_retries_total': ('counter', 'Повторные запросы к Binance после ошибок'),
+    'binance_request_weight_total': ('counter', 'Суммарный вес запросов к Binance'),
+    'binance_used_weight': ('gauge', 'Использованный вес за минуту по заголовку X-MBX-USED-WEIGHT-1M'),
+    'candle_requests_total': ('counter', 'Запросы свечей по результату: hits, coalesced, upstream, derived'),
+    'candle_loads_total': ('counter', 'Загрузки истории по источнику: memory, store, binance'),
+    'telegram_send_seconds': ('histogram', 'Длительность отправки одного сообщения Telegram'),
+    'signal_delivery_seconds': ('histogram', 'Задержка от постановки сигнала в очередь до доставки'),
+    'telegram_messages_total': ('counter', 'Сообщения Telegram по результату: sent, failed'),
+    'telegram_retries_total': ('counter', 'Повторные попытки отправки в Telegram'),
+    'signal_evaluations_skipped_total': ('counter', 'Пропущенные анализы пар без новых свечей'),
+    'signals_total': ('counter', 'Сигналы по результату: sent, suppressed'),
+    'startup_first_reply_seconds': ('gauge', 'Время от запуска до первого ответа на команду'),
+    'startup_first_tick_seconds': ('gauge', 'Время от запуска до первого завершённого тика'),
+    'log_records_sampled_total': ('counter', 'Записи журнала, отброшенные выборкой горячего пути'),
+    'log_records_dropped_total': ('counter', 'Записи журнала, отброшенные из-за переполнения очереди'),
+}
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин в формате Prometheus."""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for position, count in enumerate(other.counts):
+            self.counts[position] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Оценивает квантиль линейной интерполяцией внутри корзины."""
+        if not self.count:
+            return np.nan
+        rank = q * self.count
+        cumulative = 0
+        for position, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if position == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[position - 1] if position > 0 else 0.0
+                return lower + (self.buckets[position] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """Потокобезопасное хранилище гистограмм, счётчиков и показателей с метками."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.values = {}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        """Добавляет наблюдение в гистограмму."""
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(self._labels(labels))
+            if histogram is None:
+                histogram = series[self._labels(labels)] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает счётчик."""
+        key = self._labels(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Устанавливает значение показателя."""
+        with self.lock:
+            self.values.setdefault(name, {})[self._labels(labels)] = value
+
+    def get(self, name, **labels):
+        return self.values.get(name, {}).get(self._labels(labels), 0)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Замеряет время выполнения блока и добавляет его в гистограмму."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def merged(self, name, **filters):
+        """Объединяет гистограммы метрики по всем меткам, совпадающим с filters."""
+        total = Histogram()
+        with self.lock:
+            for labels, histogram in self.histograms.get(name, {}).items():
+                if all(dict(labels).get(key) == value for key, value in filters.items()):
+                    total.merge(histogram)
+        return total
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        def format_labels(labels, extra=()):
+            pairs = [f'{key}="{_escape_label(value)}"' for key, value in (*labels, *extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.lock:
+            for name, (kind, description) in METRIC_DEFINITIONS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == 'histogram':
+                    for labels, histogram in self.histograms.get(name, {}).items():
+                        cumulative = 0
+                        for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+                else:
+                    for labels, value in self.values.get(name, {}).items():
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = MetricsRegistry()
+_metrics_server = None
+
+def collect_metrics():
+    """Переносит в реестр счётчики, которые ведутся в других частях бота."""
+    for result, count in fetch_stats.items():
+        metrics.set('candle_requests_total', count, result=result)
+    metrics.set('telegram_messages_total', signal_dispatcher.sent, result='sent')
+    metrics.set('telegram_messages_total', signal_dispatcher.failed, result='failed')
+    metrics.set('telegram_retries_total', signal_dispatcher.retries)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Отдаёт метрики по адресу /metrics."""
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        collect_metrics()
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server():
+    """Запускает HTTP-сервер метрик в фоновом потоке."""
+    global _metrics_server
+    if not METRICS_PORT or _metrics_server is not None:
+        return
+    try:
+        _metrics_server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsRequestHandler)
+    except OSError as e:
+        logger.error(f"❌ Не удалось запустить сервер метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return
+    threading.Thread(target=_metrics_server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"📈 Метрики доступны по адресу http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+def stop_metrics_server():
+    """Останавливает HTTP-сервер метрик."""
+    global _metrics_server
+    if _metrics_server is not None:
+        _metrics_server.shutdown()
+        _metrics_server.server_close()
+        _metrics_server = None
+
+def format_stats():
+    """Сводка метрик для команды /stats."""
+    collect_metrics()
+    ticks = metrics.merged('tick_duration_seconds')
+    lines = [
+        "📊 Статистика бота",
+        "",
+        f"Тики: {ticks.count}, p50 {ticks.quantile(0.5):.2f} с, p99 {ticks.quantile(0.99):.2f} с, "
+        f"превышений дедлайна: {metrics.get('tick_overruns_total')}, наложений: {metrics.get('tick_overlaps_total')}",
+        "",
+        "Этапы (p50 / p95, с):",
+    ]
+    for stage in ('fetch', 'parse', 'storage', 'indicators', 'evaluate'):
+        histogram = metrics.merged('signal_stage_seconds', stage=stage)
+        if histogram.count:
+            lines.append(f"  {stage}: {histogram.quantile(0.5):.4f} / {histogram.quantile(0.95):.4f} ({histogram.count})")
+
+    requests = sum(fetch_stats.values())
+    hit_rate = (fetch_stats['hits'] + fetch_stats['coalesced']) / requests if requests else 0.0
+    delivery = metrics.merged('signal_delivery_seconds')
+    lines += [
+        "",
+        f"Запросы свечей: {requests}, из кэша и объединённых: {hit_rate:.0%}",
+        f"Binance: запросов {metrics.get('binance_requests_total')}, повторов {metrics.get('binance_retries_total')}, "
+        f"вес {metrics.get('binance_request_weight_total')}, "
+        f"использовано за минуту: {metrics.get('binance_used_weight')}",
+        f"Telegram: отправлено {signal_dispatcher.sent}, ошибок {signal_dispatcher.failed}, повторов {signal_dispatcher.retries}, "
+        f"доставка p50 {delivery.quantile(0.5):.2f} с, p99 {delivery.quantile(0.99):.2f} с",
+        f"Сигналы: отправлено {metrics.get('signals_total', result='sent')}, "
+        f"подавлено повторов {metrics.get('signals_total', result='suppressed')}, "
+        f"анализов без новых свечей пропущено {metrics.get('signal_evaluations_skipped_total')}",
+        f"Запуск: первый ответ через {metrics.get('startup_first_reply_seconds'):.2f} с, "
+        f"первый тик через {metrics.get('startup_first_tick_seconds'):.2f} с",
+        f"Журнал: отброшено выборкой {metrics.get('log_records_sampled_total')}, "
+        f"при переполнении очереди {metrics.get('log_records_dropped_total')}",
+    ]
+    return '\n'.join(lines)
+
+# ======================= Журналирование =======================
+
+# Поля структурированной записи, передаваемые через extra (см. log_fields)
+LOG_FIELDS = ('symbol', 'timeframe', 'stage')
+
+def log_fields(stage, symbol=None, timeframe=None):
+    """Возвращает extra для записи журнала с этапом обработки и парой."""
+    return {'stage': stage, 'symbol': symbol, 'timeframe': timeframe}
+
+class JsonLogFormatter(logging.Formatter):
+    """Форматирует запись как объект JSON в одну строку с полями symbol, timeframe и stage."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogSampler(logging.Filter):
+    """Пропускает только каждое N-е сообщение этапа из LOG_SAMPLE_EVERY; предупреждения и ошибки не отбрасываются.
+
+    Счётчик ведётся по шаблону сообщения, поэтому редкие сообщения этапа не вытесняются частыми.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counters = {}
+
+    def filter(self, record):
+        every = self.every.get(getattr(record, 'stage', None), 1)
+        if every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        count = self.counters.get(record.msg, 0)
+        self.counters[record.msg] = count + 1
+        if count % every:
+            metrics.inc('log_records_sampled_total')
+            return False
+        return True
+
+class LogQueueHandler(QueueHandler):
+    """Ставит запись в очередь без форматирования: сообщение собирается из шаблона и аргументов в потоке записи.
+
+    При переполнении очереди запись отбрасывается, чтобы журнал не блокировал цикл событий.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            metrics.inc('log_records_dropped_total')
+
+_log_listener = None
+
+def setup_logging(log_format=None, log_file=None, queue_size=None):
+    """Настраивает корневой журнал: выборку сообщений горячего пути и запись через очередь в фоновом потоке.
+
+    Параметры по умолчанию берутся из LOG_FORMAT, LOG_FILE и LOG_QUEUE_SIZE.
+    """
+    global _log_listener
+    stop_logging()
+    log_format = log_format or LOG_FORMAT
+    log_file = LOG_FILE if log_file is None else log_file
+    queue_size = LOG_QUEUE_SIZE if queue_size is None else queue_size
+
+    target = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    target.setFormatter(JsonLogFormatter() if log_format == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    if queue_size > 0:
+        log_queue = Queue(queue_size)
+        handler = LogQueueHandler(log_queue)
+        _log_listener = QueueListener(log_queue, target)
+        _log_listener.start()
+    else:
+        handler = target
+    handler.addFilter(LogSampler(LOG_SAMPLE_EVERY))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+        existing.close()
+    root.addHandler(handler)
+
+def stop_logging():
+    """Дописывает записи из очереди и останавливает фоновый поток; дальше журнал пишется синхронно.
+
+    Вызывается и в дочерних процессах пула: поток записи родителя в них не существует.
+    """
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, LogQueueHandler):
+            root.removeHandler(handler)
+    for handler in _log_listener.handlers:
+        root.addHandler(handler)
+    _log_listener = None
+
 # ======================= Функции для работы с подписчиками =======================
 
+# Подписчики хранятся в памяти, а изменения сразу пишутся в SQLite (журнал WAL).
+# Подписка чата — набор фильтров (symbol, timeframe), где '*' означает любой символ или таймфрейм
+SUBSCRIPTION_WILDCARD = '*'
+_subscribers = None
+_subscription_index = None
+_subscribers_db = None
+_subscribers_version = None
+_subscribers_lock = threading.Lock()
+
+class SubscriptionIndex:
+    """Инвертированный индекс подписок: (symbol, timeframe) -> чаты.
+
+    Фильтры с '*' хранятся под собственными ключами, поэтому получатели пары собираются
+    из четырёх корзин за время, пропорциональное числу подходящих чатов.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.filters = {}
+
+    def add(self, chat_id, symbol, timeframe):
+        self.routes.setdefault((symbol, timeframe), set()).add(chat_id)
+        self.filters.setdefault(chat_id, set()).add((symbol, timeframe))
+
+    def remove(self, chat_id, symbol, timeframe):
+        chats = self.routes.get((symbol, timeframe))
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                del self.routes[(symbol, timeframe)]
+        filters = self.filters.get(chat_id)
+        if filters is not None:
+            filters.discard((symbol, timeframe))
+            if not filters:
+                del self.filters[chat_id]
+
+    def _buckets(self, symbol, timeframe):
+        wildcard = SUBSCRIPTION_WILDCARD
+        for key in ((symbol, timeframe), (symbol, wildcard), (wildcard, timeframe), (wildcard, wildcard)):
+            chats = self.routes.get(key)
+            if chats:
+                yield chats
+
+    def match(self, symbol, timeframe):
+        """Возвращает чаты, подписанные на пару."""
+        return set().union(*self._buckets(symbol, timeframe))
+
+    def wants(self, symbol, timeframe):
+        """Проверяет, подписан ли на пару хотя бы один чат."""
+        return next(self._buckets(symbol, timeframe), None) is not None
+
+def get_subscribers_db():
+    """Открывает базу подписчиков и при первом запуске переносит в неё подписчиков из JSON-файла."""
+    global _subscribers_db
+    if _subscribers_db is None:
+        db = sqlite3.connect(SUBSCRIBERS_DB, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS subscribers (chat_id INTEGER PRIMARY KEY)')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS subscriptions ('
+            'chat_id INTEGER NOT NULL, symbol TEXT NOT NULL, timeframe TEXT NOT NULL, '
+            'PRIMARY KEY (chat_id, symbol, timeframe))'
+        )
+        if os.path.exists(SUBSCRIBERS_FILE):
+            try:
+                with open(SUBSCRIBERS_FILE, 'r') as f:
+                    data = f.read().strip()
+                chat_ids = json.loads(data) if data else []
+                db.execute('BEGIN')
+                db.executemany('INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)', ((chat_id,) for chat_id in chat_ids))
+                db.execute('COMMIT')
+                os.replace(SUBSCRIBERS_FILE, SUBSCRIBERS_FILE + '.migrated')
+                logger.info(f"📄 {len(chat_ids)} подписчиков перенесены из {SUBSCRIBERS_FILE} в {SUBSCRIBERS_DB}.")
+            except json.JSONDecodeError:
+                logger.error(f"❌ Некорректный формат JSON в файле {SUBSCRIBERS_FILE}. Файл не перенесён.")
+        # Подписчики, появившиеся до фильтров, получают все сигналы
+        migrated = db.execute(
+            'INSERT OR IGNORE INTO subscriptions (chat_id, symbol, timeframe) '
+            'SELECT chat_id, ?, ? FROM subscribers WHERE chat_id NOT IN (SELECT chat_id FROM subscriptions)',
+            (SUBSCRIPTION_WILDCARD, SUBSCRIPTION_WILDCARD),
+        ).rowcount
+        if migrated > 0:
+            logger.info(f"📄 {migrated} подписчиков без фильтров подписаны на все сигналы.")
+        _subscribers_db = db
+    return _subscribers_db
+
 def load_subscribers():
-    """Загружает список подписчиков из файла."""
-    if not os.path.exists(SUBSCRIBERS_FILE):
-        with open(SUBSCRIBERS_FILE, 'w') as f:
-            json.dump([], f)
-        logger.info(f"📄 Создан новый файл {SUBSCRIBERS_FILE} для хранения подписчиков.")
-        return set()
+    """Возвращает множество подписчиков; база читается только при первом вызове."""
+    global _subscribers, _subscription_index, _subscribers_version
+    if _subscribers is None:
+        with _subscribers_lock:
+            if _subscribers is None:
+                try:
+                    db = get_subscribers_db()
+                    _subscribers_version = db.execute('PRAGMA data_version').fetchone()[0]
+                    index = SubscriptionIndex()
+                    for chat_id, symbol, timeframe in db.execute('SELECT chat_id, symbol, timeframe FROM subscriptions'):
+                        index.add(chat_id, symbol, timeframe)
+                    rows = db.execute('SELECT chat_id FROM subscribers').fetchall()
+                    _subscription_index = index
+                    _subscribers = {chat_id for (chat_id,) in rows}
+                    logger.info(f"👥 Загружено {len(_subscribers)} подписчиков, маршрутов в индексе: {len(index.routes)}.")
+                except Exception as e:
+                    logger.error(f"❌ Ошибка при загрузке подписчиков: {e}")
+                    return set()
+    return _subscribers
+
+def refresh_subscribers():
+    """Перечитывает подписки, если базу изменило другое соединение (другая реплика бота).
+
+    PRAGMA data_version меняется только после чужих транзакций, поэтому проверка почти ничего не стоит.
+    """
+    global _subscribers
+    if _subscribers is None:
+        return
+    with _subscribers_lock:
+        if get_subscribers_db().execute('PRAGMA data_version').fetchone()[0] == _subscribers_version:
+            return
+        _subscribers = None
+    logger.info("👥 Подписки изменены другой репликой. Перечитываю базу.")
+    load_subscribers()
+
+def get_subscription_index():
+    """Возвращает индекс подписок, загружая подписчиков при первом вызове."""
+    load_subscribers()
+    return _subscription_index if _subscription_index is not None else SubscriptionIndex()
+
+def add_subscriber(chat_id, filters=((SUBSCRIPTION_WILDCARD, SUBSCRIPTION_WILDCARD),)):
+    """Подписывает чат на пары filters ((symbol, timeframe), '*' — любой); возвращает фильтры, которых у него ещё не было."""
+    # Команды могут приходить на разные реплики: подписку могли изменить через другую
+    refresh_subscribers()
+    subscribers = load_subscribers()
+    index = get_subscription_index()
+    with _subscribers_lock:
+        current = index.filters.get(chat_id, set())
+        added = [pair for pair in dict.fromkeys(filters) if pair not in current]
+        if not added:
+            return []
+        db = get_subscribers_db()
+        db.execute('BEGIN')
+        db.execute('INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)', (chat_id,))
+        db.executemany(
+            'INSERT OR IGNORE INTO subscriptions (chat_id, symbol, timeframe) VALUES (?, ?, ?)',
+            ((chat_id, symbol, timeframe) for symbol, timeframe in added),
+        )
+        db.execute('COMMIT')
+        subscribers.add(chat_id)
+        for symbol, timeframe in added:
+            index.add(chat_id, symbol, timeframe)
+    logger.info(f"💾 Подписка {chat_id} сохранена ({len(added)} фильтров), всего подписчиков: {len(subscribers)}.")
+    return added
+
+def intersect_filters(first, second):
+    """Возвращает фильтр из пар, подходящих под оба фильтра, или None, если общих пар нет."""
+    common = []
+    for first_value, second_value in zip(first, second):
+        if first_value == SUBSCRIPTION_WILDCARD:
+            common.append(second_value)
+        elif second_value in (SUBSCRIPTION_WILDCARD, first_value):
+            common.append(first_value)
+        else:
+            return None
+    return tuple(common)
+
+def subtract_filter(subscription, excluded):
+    """Раскрывает фильтр subscription в конкретные фильтры без пар excluded (excluded входит в subscription).
+
+    '*' заменяется символами CRYPTO_SYMBOLS или таймфреймами TIMEFRAMES, поэтому символы,
+    добавленные в список позже, в оставшуюся подписку не попадут.
+    """
+    (symbol, timeframe), (excluded_symbol, excluded_timeframe) = subscription, excluded
+    remaining = []
+    if symbol == SUBSCRIPTION_WILDCARD and excluded_symbol != SUBSCRIPTION_WILDCARD:
+        remaining += [(other, timeframe) for other in CRYPTO_SYMBOLS if other != excluded_symbol]
+    if timeframe == SUBSCRIPTION_WILDCARD and excluded_timeframe != SUBSCRIPTION_WILDCARD:
+        remaining += [(excluded_symbol, other) for other in TIMEFRAMES if other != excluded_timeframe]
+    return remaining
+
+def remove_subscriber(chat_id, filters=None):
+    """Отписывает чат от пар filters (None — от всех); возвращает фильтры, от которых он действительно отписан.
+
+    Фильтры, пересекающиеся с отписываемыми, заменяются оставшимися парами: например, '*' при /stop PEPEUSDT
+    раскрывается в фильтры остальных символов. Чат без оставшихся фильтров перестаёт быть подписчиком.
+    """
+    refresh_subscribers()
+    subscribers = load_subscribers()
+    index = get_subscription_index()
+    with _subscribers_lock:
+        current = index.filters.get(chat_id, set())
+        remaining = set() if filters is None else set(current)
+        unsubscribed_from = list(current) if filters is None else []
+        for excluded in dict.fromkeys(filters or ()):
+            overlapping = [(pair, intersect_filters(pair, excluded)) for pair in remaining]
+            overlapping = [(pair, common) for pair, common in overlapping if common is not None]
+            if not overlapping:
+                continue
+            unsubscribed_from.append(excluded)
+            for pair, common in overlapping:
+                remaining.discard(pair)
+                remaining.update(subtract_filter(pair, common))
+        removed, added = current - remaining, remaining - current
+        if not removed:
+            return []
+        unsubscribed = not remaining
+        db = get_subscribers_db()
+        db.execute('BEGIN')
+        db.executemany(
+            'DELETE FROM subscriptions WHERE chat_id = ? AND symbol = ? AND timeframe = ?',
+            ((chat_id, symbol, timeframe) for symbol, timeframe in removed),
+        )
+        db.executemany(
+            'INSERT OR IGNORE INTO subscriptions (chat_id, symbol, timeframe) VALUES (?, ?, ?)',
+            ((chat_id, symbol, timeframe) for symbol, timeframe in added),
+        )
+        if unsubscribed:
+            db.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+        db.execute('COMMIT')
+        for symbol, timeframe in removed:
+            index.remove(chat_id, symbol, timeframe)
+        for symbol, timeframe in added:
+            index.add(chat_id, symbol, timeframe)
+        if unsubscribed:
+            subscribers.discard(chat_id)
+    logger.info(
+        f"💾 Подписка {chat_id} изменена ({len(removed)} фильтров удалено, {len(added)} добавлено), "
+        f"всего подписчиков: {len(subscribers)}."
+    )
+    return unsubscribed_from
+
+def get_wanted_pairs(symbols, timeframes):
+    """Возвращает {symbol: [timeframe, ...]} только для пар, на которые подписан хотя бы один чат."""
+    index = get_subscription_index()
+    pairs = {}
+    for symbol in symbols:
+        wanted = [timeframe for timeframe in timeframes if index.wants(symbol, timeframe)]
+        if wanted:
+            pairs[symbol] = wanted
+    return pairs
+
+def close_subscribers_db():
+    """Переносит журнал WAL в основной файл базы и закрывает её."""
+    global _subscribers_db
+    if _subscribers_db is not None:
+        _subscribers_db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        _subscribers_db.close()
+        _subscribers_db = None
 
-    try:
-        with open(SUBSCRIBERS_FILE, 'r') as f:
-            data = f.read().strip()
-            if not data:
-                logger.info(f"📄 Файл {SUBSCRIBERS_FILE} пуст.")
-                return set()
-            subscribers = set(json.loads(data))
-            logger.info(f"👥 Загружено {len(subscribers)} подписчиков.")
-            return subscribers
-    except json.JSONDecodeError:
-        logger.error(f"❌ Некорректный формат JSON в файле {SUBSCRIBERS_FILE}. Сброс файла.")
-        with open(SUBSCRIBERS_FILE, 'w') as f:
-            json.dump([], f)
-        return set()
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке подписчиков: {e}")
-        return set()
+def get_historical_data_file(symbol, timeframe):
+    """Возвращает имя CSV-файла исторических данных (формат до перехода на колоночное хранилище)."""
+    return os.path.join(DATA_DIR, f"{symbol}_{timeframe}_historical_data.csv")
 
-def save_subscribers(subscribers):
-    """Сохраняет список подписчиков в файл."""
-    try:
-        with open(SUBSCRIBERS_FILE, 'w') as f:
-            json.dump(list(subscribers), f)
-        logger.info(f"💾 Сохранено {len(subscribers)} подписчиков.")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при сохранении подписчиков: {e}")
+# ======================= Колоночное хранилище свечей =======================
+
+def get_candle_store_dir(symbol, timeframe, archive=False):
+    """Возвращает директорию колоночного хранилища свечей для криптовалюты и таймфрейма (или её архива)."""
+    return os.path.join(CANDLE_ARCHIVE_DIR if archive else DATA_DIR, f"{symbol}_{timeframe}")
+
+def get_retention_bars(timeframe):
+    """Возвращает окно хранения таймфрейма в свечах."""
+    return RETENTION_BARS.get(timeframe, DEFAULT_RETENTION_BARS)
+
+def _read_candle_store_meta(store_dir):
+    """Читает метаданные хранилища (версию и типы колонок)."""
+    with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+def _write_candle_store_meta(store_dir, meta):
+    """Атомарно записывает метаданные хранилища."""
+    path = os.path.join(store_dir, 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+def candle_store_exists(symbol, timeframe, archive=False):
+    """Проверяет, создано ли колоночное хранилище для криптовалюты и таймфрейма."""
+    return os.path.exists(os.path.join(get_candle_store_dir(symbol, timeframe, archive), 'meta.json'))
+
+def _open_candle_columns(store_dir):
+    """Отображает файлы колонок в память и возвращает их, обрезанные до общей длины."""
+    meta = _read_candle_store_meta(store_dir)
+    columns = {}
+    for col, dtype in meta['columns'].items():
+        path = os.path.join(store_dir, f"{col}.bin")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < np.dtype(dtype).itemsize:
+            columns[col] = np.empty(0, dtype=dtype)
+        else:
+            columns[col] = np.memmap(path, dtype=dtype, mode='r', shape=(size // np.dtype(dtype).itemsize,))
+    # После аварийной остановки колонки могут иметь разную длину: берём общую часть
+    length = min(len(values) for values in columns.values())
+    return {col: values[:length] for col, values in columns.items()}
+
+def read_candles(symbol, timeframe, last_n=None, since=None, archive=False):
+    """Читает свечи из хранилища без копирования колонок.
+
+    last_n — вернуть только последние N свечей, since — только свечи, открытые не раньше указанного момента,
+    archive — читать холодный архив вместо рабочего хранилища.
+    """
+    store_dir = get_candle_store_dir(symbol, timeframe, archive)
+    if not candle_store_exists(symbol, timeframe, archive):
+        return pd.DataFrame()
+
+    columns = _open_candle_columns(store_dir)
+    timestamps = columns.pop('timestamp')
+    start = 0
+    if since is not None:
+        since_ms = int(pd.Timestamp(since).timestamp() * 1000)
+        start = int(np.searchsorted(timestamps, since_ms, side='left'))
+    if last_n is not None:
+        start = max(start, len(timestamps) - last_n)
+
+    index = pd.DatetimeIndex(pd.to_datetime(timestamps[start:], unit='ms', utc=True), name='timestamp')
+    return pd.DataFrame({col: values[start:] for col, values in columns.items()}, index=index, copy=False)
+
+def append_candles(symbol, timeframe, df, archive=False):
+    """Дописывает свечи в конец хранилища (archive — в холодный архив).
+
+    Свечи, время открытия которых не новее последней сохранённой, перезаписывают хвост хранилища.
+    Если новый хвост короче перезаписываемого, файл колонки собирается заново и подменяется целиком:
+    обрезка файла, отображённого в память другим читателем, обрушила бы процесс (SIGBUS).
+    """
+    if df.empty:
+        return
+    store_dir = get_candle_store_dir(symbol, timeframe, archive)
+    if not candle_store_exists(symbol, timeframe, archive):
+        os.makedirs(store_dir, exist_ok=True)
+        _write_candle_store_meta(store_dir, {'version': CANDLE_STORAGE_VERSION, 'columns': CANDLE_STORAGE_COLUMNS})
+
+    dtypes = _read_candle_store_meta(store_dir)['columns']
+    new_timestamps = df.index.as_unit('ms').asi8
+    stored = _open_candle_columns(store_dir)
+    # Позиция, с которой начинаются перезаписываемые строки
+    position = int(np.searchsorted(stored['timestamp'], new_timestamps[0], side='left'))
+    del stored
+
+    for col, dtype in dtypes.items():
+        if col == 'timestamp':
+            values = new_timestamps.astype(dtype)
+        else:
+            values = df[col].to_numpy().astype(dtype)
+        path = os.path.join(store_dir, f"{col}.bin")
+        offset = position * np.dtype(dtype).itemsize
+        if os.path.exists(path) and offset + values.nbytes < os.path.getsize(path):
+            with open(path, 'rb') as src, open(path + '.tmp', 'wb') as f:
+                f.write(src.read(offset))
+                f.write(values.tobytes())
+            os.replace(path + '.tmp', path)
+            continue
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.seek(offset)
+            f.write(values.tobytes())
+
+def archive_candles(symbol, timeframe):
+    """Переносит в холодный архив свечи старше окна хранения, если рабочее хранилище заметно его превысило.
+
+    Архив дописывается первым, а рабочее хранилище пересобирается во временной директории
+    и подменяется целиком, поэтому прерванная архивация безопасно повторяется. Возвращает число перенесённых свечей.
+    """
+    if not candle_store_exists(symbol, timeframe):
+        return 0
+    store_dir = get_candle_store_dir(symbol, timeframe)
+    retention = get_retention_bars(timeframe)
+    columns = _open_candle_columns(store_dir)
+    excess = len(columns['timestamp']) - retention
+    if excess <= retention * RETENTION_ARCHIVE_SLACK:
+        return 0
+
+    append_candles(symbol, timeframe, read_candles(symbol, timeframe).iloc[:excess], archive=True)
+
+    new_dir, old_dir = store_dir + '.tmp', store_dir + '.old'
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
+    for col, values in columns.items():
+        values[excess:].tofile(os.path.join(new_dir, f"{col}.bin"))
+    _write_candle_store_meta(new_dir, _read_candle_store_meta(store_dir))
+    del columns
+    os.replace(store_dir, old_dir)
+    os.replace(new_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"🗄️ {excess} старых свечей для {symbol} на таймфрейме {timeframe} перенесены в архив {get_candle_store_dir(symbol, timeframe, archive=True)}.")
+    return excess
+
+def read_full_history(symbol, timeframe):
+    """Читает всю сохранённую историю пары: холодный архив и рабочее хранилище."""
+    df = read_candles(symbol, timeframe)
+    archived = read_candles(symbol, timeframe, archive=True)
+    if archived.empty:
+        return df
+    if df.empty:
+        return archived
+    return pd.concat([archived.iloc[:archived.index.searchsorted(df.index[0])], df])
+
+def migrate_candle_storage():
+    """Приводит хранилища прежних версий к текущим типам колонок и восстанавливает хранилища после прерванной архивации."""
+    for base_dir in (DATA_DIR, CANDLE_ARCHIVE_DIR):
+        if not os.path.isdir(base_dir):
+            continue
+        for name in sorted(os.listdir(base_dir)):
+            store_dir = os.path.join(base_dir, name)
+            # Архивация прервалась между подменой директорий: возвращаем прежнее хранилище
+            if name.endswith('.old') and not os.path.exists(store_dir[:-len('.old')]):
+                os.replace(store_dir, store_dir[:-len('.old')])
+                store_dir = store_dir[:-len('.old')]
+            if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+                continue
+            meta = _read_candle_store_meta(store_dir)
+            if meta['version'] >= CANDLE_STORAGE_VERSION:
+                continue
+            try:
+                # Колонки переводятся по одной, а метаданные обновляются после каждой, поэтому перенос можно прервать
+                for col, dtype in CANDLE_STORAGE_COLUMNS.items():
+                    if meta['columns'].get(col) == dtype:
+                        continue
+                    path = os.path.join(store_dir, f"{col}.bin")
+                    values = np.fromfile(path, dtype=meta['columns'][col]) if os.path.exists(path) else np.empty(0)
+                    values.astype(dtype).tofile(path + '.tmp')
+                    os.replace(path + '.tmp', path)
+                    meta['columns'][col] = dtype
+                    _write_candle_store_meta(store_dir, meta)
+                meta['version'] = CANDLE_STORAGE_VERSION
+                _write_candle_store_meta(store_dir, meta)
+                logger.info(f"📦 Хранилище {store_dir} переведено на формат версии {CANDLE_STORAGE_VERSION}.")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при переводе хранилища {store_dir} на новый формат: {e}")
+
+def migrate_csv_storage():
+    """Однократно переносит CSV-файлы исторических данных в колоночное хранилище."""
+    for filename in os.listdir(DATA_DIR):
+        if not filename.endswith('_historical_data.csv'):
+            continue
+        symbol, timeframe = filename[:-len('_historical_data.csv')].rsplit('_', 1)
+        csv_path = os.path.join(DATA_DIR, filename)
+        try:
+            if not candle_store_exists(symbol, timeframe):
+                df = pd.read_csv(csv_path, index_col='timestamp', parse_dates=True)
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+                append_candles(symbol, timeframe, df)
+                logger.info(f"📦 {len(df)} свечей для {symbol} на таймфрейме {timeframe} перенесены из {csv_path} в колоночное хранилище.")
+            os.replace(csv_path, csv_path + '.migrated')
+        except Exception as e:
+            logger.error(f"❌ Ошибка при переносе {csv_path} в колоночное хранилище: {e}")
+
+# ======================= Параллельная загрузка истории =======================
+
+_backfill_executor = None
+
+def get_backfill_executor():
+    """Возвращает пул потоков для параллельной загрузки фрагментов истории."""
+    global _backfill_executor
+    if _backfill_executor is None:
+        _backfill_executor = ThreadPoolExecutor(max_workers=BACKFILL_WORKERS, thread_name_prefix='backfill')
+    return _backfill_executor
+
+def _fetch_backfill_chunk(symbol, timeframe, chunk_start, chunk_end, checkpoint_dir):
+    """Загружает один фрагмент истории (до 1000 свечей) и сохраняет его как контрольную точку."""
+    with metrics.timer('signal_stage_seconds', stage='fetch', symbol=symbol, timeframe=timeframe):
+        klines = binance_request('get_klines', symbol, timeframe, chunk_start, chunk_end)
+    checkpoint_file = os.path.join(checkpoint_dir, f"{chunk_start}.json")
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(klines, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+    return klines
+
+def backfill_klines(symbol, timeframe, start_time, end_time=None):
+    """Загружает свечи за период параллельными фрагментами по 1000 свечей.
+
+    Загруженные фрагменты сохраняются в контрольных точках, поэтому прерванная загрузка
+    продолжается с того же места. Фрагменты склеиваются и очищаются от дублей по времени открытия.
+    Вес запросов ограничивает лимитер клиента Binance, сверяющийся с весом из ответов биржи.
+    """
+    checkpoint_dir = os.path.join(DATA_DIR, '.backfill', f"{symbol}_{timeframe}")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    plan_file = os.path.join(checkpoint_dir, 'plan.json')
+    if os.path.exists(plan_file):
+        with open(plan_file, 'r') as f:
+            plan = json.load(f)
+        logger.info(f"♻️ Продолжаю прерванную загрузку истории для {symbol} на таймфрейме {timeframe}.")
+    else:
+        if end_time is None:
+            end_time = int(datetime.now(timezone.utc).timestamp() * 1000)
+        plan = {'start': start_time, 'end': end_time}
+        with open(plan_file, 'w') as f:
+            json.dump(plan, f)
+
+    chunk_span = int(get_timeframe_delta(timeframe).total_seconds() * 1000) * 1000
+    chunks = [(chunk_start, min(chunk_start + chunk_span - 1, plan['end'])) for chunk_start in range(plan['start'], plan['end'] + 1, chunk_span)]
+
+    started = time.monotonic()
+    klines_by_chunk = {}
+    pending = {}
+    for chunk_start, chunk_end in chunks:
+        checkpoint_file = os.path.join(checkpoint_dir, f"{chunk_start}.json")
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file, 'r') as f:
+                klines_by_chunk[chunk_start] = json.load(f)
+        else:
+            pending[chunk_start] = get_backfill_executor().submit(
+                _fetch_backfill_chunk, symbol, timeframe, chunk_start, chunk_end, checkpoint_dir)
+    for chunk_start, future in pending.items():
+        klines_by_chunk[chunk_start] = future.result()
+
+    # Склейка фрагментов с удалением дублей по времени открытия
+    klines = list({kline[0]: kline for chunk_start in sorted(klines_by_chunk) for kline in klines_by_chunk[chunk_start]}.values())
+    klines.sort(key=lambda kline: kline[0])
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"📥 Загружено {len(klines)} свечей для {symbol} на таймфрейме {timeframe}: {len(pending)} запросов "
+        f"({len(chunks) - len(pending)} фрагментов из контрольных точек) за {elapsed:.2f} с, {len(klines) / max(elapsed, 1e-9):.0f} свечей/с."
+    )
+    for filename in os.listdir(checkpoint_dir):
+        os.remove(os.path.join(checkpoint_dir, filename))
+    os.rmdir(checkpoint_dir)
+    return klines
+
+def backfill_universe(symbols, timeframes):
+    """Параллельно прогревает кэш свечей для всех пар при холодном старте."""
+    started = time.monotonic()
+    list(get_fetch_executor().map(lambda pair: fetch_candles(*pair), [(symbol, timeframe) for symbol in symbols for timeframe in timeframes]))
+    logger.info(f"📥 История для {len(symbols)} криптовалют и {len(timeframes)} таймфреймов загружена за {time.monotonic() - started:.2f} с.")
 
 # ======================= Функции для загрузки и обновления исторических данных =======================
 
-def get_historical_data_file(symbol, timeframe):
-    """Возвращает имя файла для хранения исторических данных конкретной криптовалюты и таймфрейма."""
-    return os.path.join(DATA_DIR, f"{symbol}_{timeframe}_historical_data.csv")
+def klines_to_dataframe(klines):
+    """Преобразует список свечей Binance в DataFrame с индексом по времени открытия.
+
+    Колонки приводятся к типам CANDLE_STORAGE_COLUMNS, неиспользуемая колонка ignore отбрасывается.
+    """
+    df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+    # Временные метки — индекс с временной зоной UTC
+    index = pd.DatetimeIndex(pd.to_datetime(df['timestamp'].astype('int64'), unit='ms', utc=True), name='timestamp')
+    # Цены и объёмы приходят строками
+    return pd.DataFrame({
+        col: pd.to_numeric(df[col]).to_numpy().astype(dtype)
+        for col, dtype in CANDLE_STORAGE_COLUMNS.items() if col != 'timestamp'
+    }, index=index)
+
+def get_timeframe_delta(timeframe):
+    """Возвращает длительность одной свечи таймфрейма."""
+    if timeframe.endswith('m'):
+        interval_minutes = int(timeframe.replace('m', ''))
+        return timedelta(minutes=interval_minutes)
+    elif timeframe.endswith('h'):
+        interval_hours = int(timeframe.replace('h', ''))
+        return timedelta(hours=interval_hours)
+    elif timeframe.endswith('d'):
+        interval_days = int(timeframe.replace('d', ''))
+        return timedelta(days=interval_days)
+    else:
+        return timedelta(minutes=1)  # По умолчанию 1 минута
+
+def drop_forming_candle(df, timeframe):
+    """Отбрасывает последнюю свечу, если она ещё не закрылась."""
+    if not df.empty and df.index[-1] + get_timeframe_delta(timeframe) > datetime.now(timezone.utc):
+        return df.iloc[:-1]
+    return df
 
 def load_historical_data(symbol, timeframe):
-    """Загружает исторические данные из файла или Binance API."""
-    HISTORICAL_DATA_FILE = get_historical_data_file(symbol, timeframe)
-    if not os.path.exists(HISTORICAL_DATA_FILE):
-        logger.info(f"📊 Файл {HISTORICAL_DATA_FILE} не найден. Загружаю данные с Binance для {symbol} на таймфрейме {timeframe}...")
+    """Возвращает исторические данные из кэша, а при холодном старте загружает их из файла или Binance API."""
+    key = (symbol, timeframe)
+    if key in candle_cache:
+        metrics.inc('candle_loads_total', source='memory')
+        return candle_cache[key]
+
+    if not candle_store_exists(symbol, timeframe):
+        metrics.inc('candle_loads_total', source='binance')
+        logger.info(f"📊 Хранилище свечей для {symbol} на таймфрейме {timeframe} не найдено. Загружаю данные с Binance...")
         try:
             # Определяем количество дней для исторических данных в зависимости от таймфрейма
             if timeframe == '1d':
@@ -131,488 +1401,2167 @@ def load_historical_data(symbol, timeframe):
                 days = 200  # По умолчанию 30 дней
 
             start_time = int((datetime.now(timezone.utc) - timedelta(days=days)).timestamp() * 1000)
-            klines = client.get_historical_klines(
-                symbol,
-                timeframe,
-                start_str=start_time,
-                limit=1000
-            )
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_asset_volume', 'number_of_trades',
-                'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            # Конвертация временных меток и установка индекса с временной зоной UTC
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
-            df.set_index('timestamp', inplace=True)
-            # Конвертация цен в числовые значения
-            for col in ['open', 'high', 'low', 'close', 'volume']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            df.to_csv(HISTORICAL_DATA_FILE)
-            logger.info(f"📁 Исторические данные для {symbol} на таймфрейме {timeframe} сохранены в {HISTORICAL_DATA_FILE}.")
-            return df
-        except BinanceAPIException as e:
+            klines = backfill_klines(symbol, timeframe, start_time)
+            df = klines_to_dataframe(klines)
+            append_candles(symbol, timeframe, df)
+            logger.info(f"📁 Исторические данные для {symbol} на таймфрейме {timeframe} сохранены в {get_candle_store_dir(symbol, timeframe)}.")
+            # В памяти держим только окно хранения, остальное уйдёт в архив при записи кэша
+            df = df.iloc[-get_retention_bars(timeframe):]
+        except BinanceRequestError as e:
             logger.error(f"❌ Ошибка при запросе к Binance API для {symbol} на таймфрейме {timeframe}: {e}")
             return pd.DataFrame()
         except Exception as e:
             logger.error(f"❌ Неизвестная ошибка при загрузке данных для {symbol} на таймфрейме {timeframe}: {e}")
             return pd.DataFrame()
     else:
-        logger.info(f"📊 Загружаю исторические данные из {HISTORICAL_DATA_FILE} для {symbol} на таймфрейме {timeframe}...")
+        logger.info(f"📊 Загружаю исторические данные из хранилища для {symbol} на таймфрейме {timeframe}...")
         try:
-            df = pd.read_csv(
-                HISTORICAL_DATA_FILE,
-                index_col='timestamp',
-                parse_dates=True
-            )
-            logger.info(f"📁 Исторические данные для {symbol} на таймфрейме {timeframe} успешно загружены из {HISTORICAL_DATA_FILE}.")
-            return df
+            with metrics.timer('signal_stage_seconds', stage='storage', symbol=symbol, timeframe=timeframe):
+                # Кэш живёт долго, а файлы колонок перезаписываются при записи кэша: копируем свечи из отображения в память
+                df = read_candles(symbol, timeframe, last_n=get_retention_bars(timeframe)).copy()
+            metrics.inc('candle_loads_total', source='store')
+            logger.info(f"📁 Исторические данные для {symbol} на таймфрейме {timeframe} успешно загружены ({len(df)} свечей).")
         except Exception as e:
             logger.error(f"❌ Ошибка при загрузке исторических данных для {symbol} на таймфрейме {timeframe}: {e}")
             return pd.DataFrame()
 
+    if not df.empty:
+        candle_cache[key] = df
+    return df
+
 def update_historical_data(df, symbol, timeframe):
-    """Обновляет исторические данные, загружая новые записи с Binance API."""
-    HISTORICAL_DATA_FILE = get_historical_data_file(symbol, timeframe)
+    """Обновляет исторические данные в кэше, дозагружая новые записи с Binance API."""
     if df.empty:
         logger.info(f"📉 DataFrame пуст для {symbol} на таймфрейме {timeframe}. Загружаю данные заново.")
         return load_historical_data(symbol, timeframe)
     
     last_timestamp = df.index[-1]
-    now = datetime.now(timezone.utc)
-    delta = now - last_timestamp
-    # Определяем интервал обновления в зависимости от таймфрейма
-    if timeframe.endswith('m'):
-        interval_minutes = int(timeframe.replace('m', ''))
-        interval_delta = timedelta(minutes=interval_minutes)
-    elif timeframe.endswith('h'):
-        interval_hours = int(timeframe.replace('h', ''))
-        interval_delta = timedelta(hours=interval_hours)
-    elif timeframe.endswith('d'):
-        interval_days = int(timeframe.replace('d', ''))
-        interval_delta = timedelta(days=interval_days)
-    else:
-        interval_delta = timedelta(minutes=1)  # По умолчанию 1 минута
 
     # Обновляем данные независимо от формирования новой свечи
-    logger.info(f"📈 Обновляю исторические данные для {symbol} на таймфрейме {timeframe}...")
+    logger.info("📈 Обновляю исторические данные для %s на таймфрейме %s...", symbol, timeframe, extra=log_fields('fetch', symbol, timeframe))
     try:
-        # Преобразуем last_timestamp в миллисекунды
-        start_time = int(last_timestamp.timestamp() * 1000) + 1  # Добавляем 1 мс, чтобы не дублировать последнюю запись
-        klines = client.get_historical_klines(
-            symbol,
-            timeframe,
-            start_str=start_time,
-            limit=1000
-        )
+        # Запрашиваем, начиная с последней свечи, чтобы обновить её, пока она ещё формируется
+        start_time = int(last_timestamp.timestamp() * 1000)
+        with metrics.timer('signal_stage_seconds', stage='fetch', symbol=symbol, timeframe=timeframe):
+            klines = binance_request('get_historical_klines', symbol, timeframe, start_time)
         if not klines:
-            logger.info(f"🔄 Нет новых данных для обновления {symbol} на таймфрейме {timeframe}.")
+            logger.info("🔄 Нет новых данных для обновления %s на таймфрейме %s.", symbol, timeframe, extra=log_fields('fetch', symbol, timeframe))
             return df
-        new_df = pd.DataFrame(klines, columns=[
-            'timestamp', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_asset_volume', 'number_of_trades',
-            'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-        ])
-        # Конвертация временных меток и установка индекса с временной зоной UTC
-        new_df['timestamp'] = pd.to_datetime(new_df['timestamp'], unit='ms', utc=True)
-        new_df.set_index('timestamp', inplace=True)
-        # Конвертация цен в числовые значения
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            new_df[col] = pd.to_numeric(new_df[col], errors='coerce')
-        # Объединяем существующие данные с новыми
-        df = pd.concat([df, new_df]).drop_duplicates().sort_index()
-        df.to_csv(HISTORICAL_DATA_FILE)
-        logger.info(f"📁 Исторические данные для {symbol} на таймфрейме {timeframe} обновлены.")
-    except BinanceAPIException as e:
+        with metrics.timer('signal_stage_seconds', stage='parse', symbol=symbol, timeframe=timeframe):
+            new_df = klines_to_dataframe(klines)
+        df = merge_candles(df, new_df, symbol, timeframe)
+        logger.info("📁 Исторические данные для %s на таймфрейме %s обновлены.", symbol, timeframe, extra=log_fields('fetch', symbol, timeframe))
+    except BinanceRequestError as e:
         logger.error(f"❌ Ошибка при обновлении данных с Binance API для {symbol} на таймфрейме {timeframe}: {e}")
     except Exception as e:
         logger.error(f"❌ Неизвестная ошибка при обновлении данных для {symbol} на таймфрейме {timeframe}: {e}")
     return df
 
+def merge_candles(df, new_df, symbol, timeframe):
+    """Заменяет в кэше свечи, начиная с первой из new_df: на диск они попадут при следующей записи кэша.
+
+    Дубликаты отсекаются по индексу, а в кэше остаётся не больше окна хранения.
+    """
+    first_new = new_df.index[0]
+    df = pd.concat([df.iloc[:df.index.searchsorted(first_new)], new_df])
+    df = df.iloc[-get_retention_bars(timeframe):]
+    key = (symbol, timeframe)
+    candle_cache[key] = df
+    candle_cache_dirty[key] = min(candle_cache_dirty.get(key, first_new), first_new)
+    return df
+
+def flush_candle_cache():
+    """Дописывает в хранилище только те свечи из кэша, которые изменились после последней записи на диск,
+    и переносит в архив свечи, вышедшие за окно хранения."""
+    for key in list(candle_cache_dirty):
+        symbol, timeframe = key
+        with get_candle_cache_lock(symbol, timeframe):
+            dirty_since = candle_cache_dirty.pop(key, None)
+            if dirty_since is None:
+                continue
+            df = candle_cache[key]
+            new_rows = df.iloc[df.index.searchsorted(dirty_since):]
+            try:
+                with metrics.timer('signal_stage_seconds', stage='storage', symbol=symbol, timeframe=timeframe):
+                    append_candles(symbol, timeframe, new_rows)
+                    archive_candles(symbol, timeframe)
+                logger.info("💾 Записано %d свечей для %s на таймфрейме %s.", len(new_rows), symbol, timeframe, extra=log_fields('storage', symbol, timeframe))
+            except Exception as e:
+                candle_cache_dirty[key] = dirty_since
+                logger.error(f"❌ Ошибка при записи кэша свечей для {symbol} на таймфрейме {timeframe}: {e}")
+
 def get_crypto_data(df, symbol, timeframe):
     """Получает и обновляет данные о криптовалюте."""
     df = update_historical_data(df, symbol, timeframe)
-    logger.info(f"📈 Текущее количество записей для {symbol} на таймфрейме {timeframe}: {len(df)}")
+    logger.info("📈 Текущее количество записей для %s на таймфрейме %s: %d", symbol, timeframe, len(df), extra=log_fields('fetch', symbol, timeframe))
     return df
 
+# ======================= Построение старших таймфреймов =======================
+
+# Правила агрегации базовых свечей в свечи старшего таймфрейма
+RESAMPLE_AGGREGATION = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+    'quote_asset_volume': 'sum',
+    'number_of_trades': 'sum',
+    'taker_buy_base_asset_volume': 'sum',
+    'taker_buy_quote_asset_volume': 'sum',
+}
+
+def get_base_timeframe():
+    """Возвращает самый младший таймфрейм из TIMEFRAMES."""
+    return min(TIMEFRAMES, key=get_timeframe_delta)
+
+def is_derived_timeframe(timeframe):
+    """Проверяет, строится ли таймфрейм из свечей базового таймфрейма."""
+    return DERIVE_TIMEFRAMES and timeframe != get_base_timeframe()
+
+def resample_candles(df, timeframe):
+    """Агрегирует свечи в свечи таймфрейма timeframe (границы выровнены по UTC, как на Binance)."""
+    delta = get_timeframe_delta(timeframe)
+    resampled = df.resample(delta, origin='epoch', label='left', closed='left').agg(RESAMPLE_AGGREGATION)
+    resampled = resampled[resampled['open'].notna()]
+    resampled['close_time'] = (resampled.index + delta).as_unit('ms').asi8 - 1
+    return resampled
+
+def update_derived_candles(df, base_df, symbol, timeframe):
+    """Достраивает свечи старшего таймфрейма из базовых, начиная с последней свечи в кэше.
+
+    Если базовая история не покрывает последнюю свечу, данные догружаются с Binance напрямую.
+    """
+    last_timestamp = df.index[-1]
+    if base_df.empty or base_df.index[0] > last_timestamp:
+        return get_crypto_data(df, symbol, timeframe)
+    base_tail = base_df.iloc[base_df.index.searchsorted(last_timestamp):]
+    return merge_candles(df, resample_candles(base_tail, timeframe), symbol, timeframe)
+
+def apply_derived_updates(symbol, kline_event):
+    """Перестраивает старшие таймфреймы после обновления базовой свечи из потока.
+
+    Возвращает таймфреймы, свеча которых закрылась вместе с базовой.
+    """
+    closed_timeframes = []
+    base_df = candle_cache.get((symbol, get_base_timeframe()))
+    if base_df is None:
+        return closed_timeframes
+    for timeframe in TIMEFRAMES:
+        if not is_derived_timeframe(timeframe):
+            continue
+        with get_candle_cache_lock(symbol, timeframe):
+            df = load_historical_data(symbol, timeframe)
+            if df.empty:
+                continue
+            update_derived_candles(df, base_df, symbol, timeframe)
+        timeframe_ms = int(get_timeframe_delta(timeframe).total_seconds() * 1000)
+        if kline_event['x'] and (kline_event['T'] + 1) % timeframe_ms == 0:
+            closed_timeframes.append(timeframe)
+    return closed_timeframes
+
+def get_candle_cache_lock(symbol, timeframe):
+    """Возвращает блокировку кэша свечей для пары (symbol, timeframe)."""
+    return candle_cache_locks.setdefault((symbol, timeframe), threading.Lock())
+
+def fetch_candles(symbol, timeframe, refresh=True):
+    """Загружает и обновляет свечи пары; безопасно вызывать из нескольких потоков.
+
+    Одновременные запросы одной пары объединяются в один запрос к Binance, а результат
+    переиспользуется в течение FETCH_FRESHNESS_WINDOW секунд.
+    refresh=False — вернуть свечи из кэша без запроса новых данных к Binance.
+    """
+    if not refresh:
+        with get_candle_cache_lock(symbol, timeframe):
+            return load_historical_data(symbol, timeframe)
+
+    key = (symbol, timeframe)
+    with _fetch_lock:
+        fresh = _fetch_results.get(key)
+        if fresh is not None and time.monotonic() - fresh[0] < FETCH_FRESHNESS_WINDOW:
+            fetch_stats['hits'] += 1
+            return fresh[1]
+        future = _fetch_inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _fetch_inflight[key] = Future()
+            fetch_stats['derived' if is_derived_timeframe(timeframe) else 'upstream'] += 1
+        else:
+            fetch_stats['coalesced'] += 1
+
+    if not leader:
+        return future.result()
+
+    try:
+        if is_derived_timeframe(timeframe):
+            # Базовые свечи обновляются (и объединяются) отдельным запросом
+            base_df = fetch_candles(symbol, get_base_timeframe())
+        with get_candle_cache_lock(symbol, timeframe):
+            df = load_historical_data(symbol, timeframe)
+            if not df.empty:
+                if is_derived_timeframe(timeframe):
+                    df = update_derived_candles(df, base_df, symbol, timeframe)
+                else:
+                    df = get_crypto_data(df, symbol, timeframe)
+        with _fetch_lock:
+            _fetch_results[key] = (time.monotonic(), df)
+        future.set_result(df)
+        return df
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _fetch_lock:
+            _fetch_inflight.pop(key, None)
+
+def log_fetch_stats():
+    """Логирует счётчики запросов свечей и оценку израсходованного веса REST API Binance."""
+    logger.info(
+        f"🔁 Запросы свечей: к Binance — {fetch_stats['upstream']} (вес ≈ {fetch_stats['upstream'] * KLINES_REQUEST_WEIGHT}), "
+        f"построено из базового таймфрейма — {fetch_stats['derived']}, "
+        f"объединено с текущими — {fetch_stats['coalesced']}, из свежего результата — {fetch_stats['hits']}."
+    )
+
 # ======================= Функция для определения общего тренда =======================
 
-def get_market_trend(symbol):
-    """Определяет общий тренд рынка для заданного символа на высоком таймфрейме."""
-    timeframe = '1h'  # Можно изменить на '1d' для ещё более высокого таймфрейма
-    global market_trends
-
-    # Проверяем, нужно ли обновлять тренд
-    last_update = market_trends.get(symbol, {}).get('last_update')
-    if last_update:
-        now = datetime.now(timezone.utc)
-        time_since_update = now - last_update
-        interval_hours = int(timeframe.replace('h', ''))
-        if time_since_update < timedelta(hours=interval_hours):
-            # Тренд актуален, возвращаем сохранённый
-            return market_trends[symbol]['trend']
+# Таймфрейм общего тренда: тренд считается по его закрытым свечам и обновляется после закрытия каждой из них
+TREND_TIMEFRAME = '1h'
 
-    df = load_historical_data(symbol, timeframe)
-    df = get_crypto_data(df, symbol, timeframe)
-    
-    if df.empty or len(df) < 200:
-        logger.warning(f"⚠️ Недостаточно данных для определения тренда для {symbol} на таймфрейме {timeframe}.")
-        return None  # Не можем определить тренд
+def classify_trend_series(close):
+    """Общий тренд на каждой свече ряда закрытий: SMA50 выше SMA200 — 'uptrend', ниже — 'downtrend', иначе 'sideways'.
 
-    sma50 = SMAIndicator(close=df['close'], window=50).sma_indicator()
-    sma200 = SMAIndicator(close=df['close'], window=200).sma_indicator()
+    Одно определение для бота и бэктеста. Каждое окно средней считается отдельно (_rolling),
+    поэтому тренд свечи не зависит от того, сколько более ранних свечей передано.
+    """
+    close = np.asarray(close, dtype='float64')
+    sma50 = _rolling(close, 50, 'mean')
+    sma200 = _rolling(close, 200, 'mean')
+    return np.where(sma50 > sma200, 'uptrend', np.where(sma50 < sma200, 'downtrend', 'sideways')).astype(object)
 
-    if sma50.iloc[-1] > sma200.iloc[-1]:
-        trend = 'uptrend'  # Восходящий тренд
-        logger.info(f"📈 Общий тренд для {symbol} на таймфрейме {timeframe}: Восходящий.")
-    elif sma50.iloc[-1] < sma200.iloc[-1]:
-        trend = 'downtrend'  # Нисходящий тренд
-        logger.info(f"📉 Общий тренд для {symbol} на таймфрейме {timeframe}: Нисходящий.")
-    else:
-        trend = 'sideways'  # Боковой тренд
-        logger.info(f"➡️ Общий тренд для {symbol} на таймфрейме {timeframe}: Боковой.")
+def is_trend_fresh(symbol, now):
+    """Проверяет, что сохранённый тренд рассчитан по последней закрытой свече TREND_TIMEFRAME."""
+    candle_time = market_trends.get(symbol, {}).get('candle_time')
+    return candle_time is not None and now < candle_time + 2 * get_timeframe_delta(TREND_TIMEFRAME)
 
-    # Сохраняем тренд и время обновления
+def store_market_trend(symbol, df):
+    """Определяет тренд по закрытым свечам df и сохраняет его вместе со временем последней свечи."""
+    trend = str(classify_trend_series(df['close'].to_numpy())[-1])
     market_trends[symbol] = {
         'trend': trend,
-        'last_update': datetime.now(timezone.utc)
+        'last_update': datetime.now(timezone.utc),
+        'candle_time': df.index[-1],
     }
     return trend
 
-# ======================= Функция для анализа данных и генерации сигналов =======================
+def get_market_trend(symbol):
+    """Определяет общий тренд рынка для заданного символа по закрытым свечам TREND_TIMEFRAME.
 
-def analyze_data(df, symbol, timeframe, trend):
-    """Анализирует данные и генерирует торговые сигналы на основе технических индикаторов."""
-    if df.empty:
-        logger.info(f"❌ Нет данных для анализа для {symbol} на таймфрейме {timeframe}.")
-        return None
+    Тренд пересчитывается после закрытия каждой свечи TREND_TIMEFRAME, как в бэктесте (compute_trend_series).
+    """
+    timeframe = TREND_TIMEFRAME
+    if is_trend_fresh(symbol, datetime.now(timezone.utc)):
+        # Тренд актуален, возвращаем сохранённый
+        return market_trends[symbol]['trend']
 
-    # Инициализация индикаторов
-    try:
-        # Скользящие средние
-        sma5 = SMAIndicator(close=df['close'], window=5)
-        sma10 = SMAIndicator(close=df['close'], window=10)
-        df['SMA5'] = sma5.sma_indicator()
-        df['SMA10'] = sma10.sma_indicator()
-
-        # EMA для более быстрого реагирования на изменения цены
-        ema20 = EMAIndicator(close=df['close'], window=20)
-        df['EMA20'] = ema20.ema_indicator()
-
-        # Индекс относительной силы (RSI)
-        rsi = RSIIndicator(close=df['close'], window=14)
-        df['RSI'] = rsi.rsi()
-
-        # MACD
-        macd = MACD(close=df['close'])
-        df['MACD'] = macd.macd()
-        df['MACD_signal'] = macd.macd_signal()
-
-        # Полосы Боллинджера
-        bollinger = BollingerBands(close=df['close'], window=20, window_dev=2)
-        df['Bollinger_High'] = bollinger.bollinger_hband()
-        df['Bollinger_Low'] = bollinger.bollinger_lband()
+    # Формирующаяся свеча в тренд не входит: её закрытие ещё изменится
+    df = drop_forming_candle(fetch_candles(symbol, timeframe), timeframe)
+    
+    if len(df) < 200:
+        logger.warning(f"⚠️ Недостаточно данных для определения тренда для {symbol} на таймфрейме {timeframe}.")
+        return None  # Не можем определить тренд
+
+    trend = store_market_trend(symbol, df)
+    if trend == 'uptrend':
+        logger.info("📈 Общий тренд для %s на таймфрейме %s: Восходящий.", symbol, timeframe, extra=log_fields('trend', symbol, timeframe))
+    elif trend == 'downtrend':
+        logger.info("📉 Общий тренд для %s на таймфрейме %s: Нисходящий.", symbol, timeframe, extra=log_fields('trend', symbol, timeframe))
+    else:
+        logger.info("➡️ Общий тренд для %s на таймфрейме %s: Боковой.", symbol, timeframe, extra=log_fields('trend', symbol, timeframe))
+    return trend
+
+# ======================= Потоковый расчёт индикаторов =======================
+
+# Состояние индикаторов по закрытым свечам: (symbol, timeframe) -> StreamingIndicatorState
+indicator_states = {}
+
+# Последний проведённый анализ пары: (symbol, timeframe) -> (время открытия свечи, тренд)
+signal_evaluations = {}
+
+class StreamingIndicatorState:
+    """Накопленное состояние индикаторов analyze_data, обновляемое за O(1) на каждую новую свечу.
+
+    Формулы повторяют реализацию библиотеки ta (включая начальные значения ADX и ATR),
+    поэтому результат совпадает с ta с точностью до погрешности вычислений с плавающей точкой.
+    """
+
+    WINDOW = 14
+
+    def __init__(self):
+        self.count = 0
+        self.timestamp = None
+        self.closes = deque(maxlen=20)
+        self.highs = deque(maxlen=self.WINDOW)
+        self.lows = deque(maxlen=self.WINDOW)
+        self.prev_close = None
+        self.prev_high = None
+        self.prev_low = None
+        self.prev_typical_price = None
+        self.ema = {12: None, 20: None, 26: None}
+        self.macd_signal = None
+        self.macd_count = 0
+        self.rsi_up = None
+        self.rsi_down = None
+        self.atr = 0.0
+        self.atr_init = 0.0
+        self.trs = 0.0
+        self.dip = 0.0
+        self.din = 0.0
+        self.dx_init = 0.0
+        self.adx = 0.0
+        self.obv = 0.0
+        self.money_flow_pos = deque(maxlen=self.WINDOW)
+        self.money_flow_neg = deque(maxlen=self.WINDOW)
+
+    def copy(self):
+        """Возвращает независимую копию состояния."""
+        state = StreamingIndicatorState.__new__(StreamingIndicatorState)
+        state.__dict__.update(self.__dict__)
+        for name in ('closes', 'highs', 'lows', 'money_flow_pos', 'money_flow_neg'):
+            setattr(state, name, deque(getattr(self, name), maxlen=getattr(self, name).maxlen))
+        state.ema = dict(self.ema)
+        return state
+
+    def _ema(self, span, value):
+        alpha = 2 / (span + 1)
+        previous = self.ema[span]
+        self.ema[span] = value if previous is None else ((1 - alpha) * previous + alpha * value) / ((1 - alpha) + alpha)
+        return self.ema[span] if self.count + 1 >= span else np.nan
+
+    def advance(self, timestamp, open_price, high_price, low_price, close_price, volume):
+        """Добавляет свечу в состояние и возвращает значения индикаторов на ней."""
+        w = self.WINDOW
+        i = self.count
+        values = {'open': open_price, 'high': high_price, 'low': low_price, 'close': close_price, 'volume': volume}
+
+        # Скользящие средние и полосы Боллинджера
+        self.closes.append(close_price)
+        closes = list(self.closes)
+        values['SMA5'] = sum(closes[-5:]) / 5 if len(closes) >= 5 else np.nan
+        values['SMA10'] = sum(closes[-10:]) / 10 if len(closes) >= 10 else np.nan
+        if len(closes) == 20:
+            mean = sum(closes) / 20
+            std = math.sqrt(sum((x - mean) ** 2 for x in closes) / 20)
+            values['Bollinger_High'] = mean + 2 * std
+            values['Bollinger_Low'] = mean - 2 * std
+        else:
+            values['Bollinger_High'] = values['Bollinger_Low'] = np.nan
+
+        # EMA и MACD
+        values['EMA20'] = self._ema(20, close_price)
+        ema12 = self._ema(12, close_price)
+        ema26 = self._ema(26, close_price)
+        values['MACD'] = ema12 - ema26
+        if np.isnan(values['MACD']):
+            values['MACD_signal'] = np.nan
+        else:
+            alpha = 2 / (9 + 1)
+            self.macd_signal = values['MACD'] if self.macd_signal is None else (
+                ((1 - alpha) * self.macd_signal + alpha * values['MACD']) / ((1 - alpha) + alpha))
+            self.macd_count += 1
+            values['MACD_signal'] = self.macd_signal if self.macd_count >= 9 else np.nan
+
+        # RSI (сглаживание Уайлдера)
+        diff = 0.0 if self.prev_close is None else close_price - self.prev_close
+        up = diff if diff > 0 else 0.0
+        down = -diff if diff < 0 else 0.0
+        alpha = 1 / w
+        if self.rsi_up is None:
+            self.rsi_up, self.rsi_down = up, down
+        else:
+            self.rsi_up = ((1 - alpha) * self.rsi_up + alpha * up) / ((1 - alpha) + alpha)
+            self.rsi_down = ((1 - alpha) * self.rsi_down + alpha * down) / ((1 - alpha) + alpha)
+        if i + 1 < w:
+            values['RSI'] = np.nan
+        elif self.rsi_down == 0:
+            values['RSI'] = 100.0
+        else:
+            values['RSI'] = 100 - 100 / (1 + self.rsi_up / self.rsi_down)
 
         # Стохастик
-        stochastic = StochasticOscillator(
-            high=df['high'], low=df['low'], close=df['close'], window=14, smooth_window=3)
-        df['Stochastic'] = stochastic.stoch()
+        self.highs.append(high_price)
+        self.lows.append(low_price)
+        if len(self.highs) == w:
+            lowest = min(self.lows)
+            values['Stochastic'] = _safe_ratio(100 * (close_price - lowest), max(self.highs) - lowest)
+        else:
+            values['Stochastic'] = np.nan
+
+        # ATR
+        if self.prev_close is None:
+            true_range = high_price - low_price
+        else:
+            true_range = max(high_price - low_price, abs(high_price - self.prev_close), abs(low_price - self.prev_close))
+        if i < w - 1:
+            self.atr_init += true_range
+        elif i == w - 1:
+            self.atr = (self.atr_init + true_range) / w
+        else:
+            self.atr = (self.atr * (w - 1) + true_range) / w
+        values['ATR'] = self.atr if i >= w - 1 else 0.0
 
         # ADX
-        adx = ADXIndicator(high=df['high'], low=df['low'], close=df['close'], window=14)
-        df['ADX'] = adx.adx()
+        if self.prev_close is not None:
+            directional_range = max(high_price, self.prev_close) - min(low_price, self.prev_close)
+            diff_up = high_price - self.prev_high
+            diff_down = self.prev_low - low_price
+            pos = diff_up if diff_up > diff_down and diff_up > 0 else 0.0
+            neg = diff_down if diff_down > diff_up and diff_down > 0 else 0.0
+            if i <= w:
+                self.trs += directional_range
+                self.dip += pos
+                self.din += neg
+            else:
+                self.trs = self.trs - self.trs / w + directional_range
+                self.dip = self.dip - self.dip / w + pos
+                self.din = self.din - self.din / w + neg
+        if i >= w:
+            di_pos = 100 * (self.dip / self.trs) if self.trs != 0 else 0.0
+            di_neg = 100 * (self.din / self.trs) if self.trs != 0 else 0.0
+            dx = 100 * abs((di_pos - di_neg) / (di_pos + di_neg)) if di_pos + di_neg != 0 else 0.0
+            if i < 2 * w - 1:
+                self.dx_init += dx
+            elif i == 2 * w - 1:
+                self.adx = (self.dx_init + dx) / w
+            else:
+                self.adx = (self.adx * (w - 1) + dx) / w
+        values['ADX'] = self.adx if i >= 2 * w - 1 else 0.0
 
-        # ATR (Average True Range) для оценки волатильности
-        atr = AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14)
-        df['ATR'] = atr.average_true_range()
+        # OBV
+        if self.prev_close is not None and close_price < self.prev_close:
+            self.obv -= volume
+        else:
+            self.obv += volume
+        values['OBV'] = self.obv
 
-        # Индикаторы объема
-        obv = OnBalanceVolumeIndicator(close=df['close'], volume=df['volume'])
-        df['OBV'] = obv.on_balance_volume()
+        # MFI
+        typical_price = (high_price + low_price + close_price) / 3.0
+        if self.prev_typical_price is None or typical_price == self.prev_typical_price:
+            direction = 0
+        else:
+            direction = 1 if typical_price > self.prev_typical_price else -1
+        money_flow = typical_price * volume * direction
+        self.money_flow_pos.append(money_flow if money_flow >= 0 else 0.0)
+        self.money_flow_neg.append(money_flow if money_flow < 0 else 0.0)
+        if len(self.money_flow_pos) == w:
+            ratio = _safe_ratio(sum(self.money_flow_pos), abs(sum(self.money_flow_neg)))
+            values['MFI'] = 100 - _safe_ratio(100, 1 + ratio)
+        else:
+            values['MFI'] = np.nan
+
+        self.prev_close = close_price
+        self.prev_high = high_price
+        self.prev_low = low_price
+        self.prev_typical_price = typical_price
+        self.timestamp = timestamp
+        self.count += 1
+        return values
+
+def _safe_ratio(numerator, denominator):
+    """Делит числа по правилам NumPy: деление на ноль даёт inf или NaN вместо исключения."""
+    if denominator == 0:
+        if numerator == 0 or np.isnan(numerator):
+            return np.nan
+        return math.copysign(np.inf, numerator)
+    return numerator / denominator
+
+def build_indicator_state(timestamps, open_prices, high_prices, low_prices, close_prices, volumes):
+    """Строит состояние индикаторов по всем свечам, кроме последней (выполняется в пуле процессов)."""
+    state = StreamingIndicatorState()
+    previous_values = None
+    for position in range(len(timestamps) - 1):
+        previous_values = state.advance(
+            timestamps[position], float(open_prices[position]), float(high_prices[position]),
+            float(low_prices[position]), float(close_prices[position]), float(volumes[position]))
+    return state, previous_values
+
+async def warm_indicator_state(df, symbol, timeframe):
+    """При холодном старте строит состояние индикаторов по всей истории вне цикла событий."""
+    key = (symbol, timeframe)
+    if key in indicator_states or len(df) < 2:
+        return
+    columns = [df[col].to_numpy(dtype='float64') for col in ('open', 'high', 'low', 'close', 'volume')]
+    state, previous_values = await run_analysis(build_indicator_state, df.index, *columns)
+    indicator_states[key] = (state, df.index[-1], previous_values)
+
+def update_streaming_indicators(df, symbol, timeframe):
+    """Продвигает состояние индикаторов до конца DataFrame и возвращает значения для двух последних свечей.
+
+    Закрытые свечи фиксируются в состоянии, а последняя (ещё формирующаяся) свеча каждый раз
+    пересчитывается от зафиксированного состояния, поэтому её обновление не добавляет новую строку.
+    При холодном старте состояние строится по всей истории, дальше — за O(1) на каждую новую свечу.
+    """
+    key = (symbol, timeframe)
+    entry = indicator_states.get(key)
+    index = df.index
+    if entry is not None:
+        state, tentative_timestamp, previous_values = entry
+        start = index.searchsorted(tentative_timestamp)
+        # История не продолжает сохранённое состояние (например, данные перезагружены): считаем заново
+        if start >= len(index) or state.timestamp is not None and index[start - 1] != state.timestamp:
+            entry = None
+    if entry is None:
+        state, previous_values, start = StreamingIndicatorState(), None, 0
+
+    columns = [df[col].to_numpy(dtype='float64')[start:] for col in ('open', 'high', 'low', 'close', 'volume')]
+    timestamps = index[start:]
+    for position in range(len(timestamps) - 1):
+        previous_values = state.advance(timestamps[position], *(float(values[position]) for values in columns))
+
+    latest_values = state.copy().advance(timestamps[-1], *(float(values[-1]) for values in columns))
+    indicator_states[key] = (state, timestamps[-1], previous_values)
+
+    # Свечные паттерны нужны только для двух последних свечей
+    previous_values = dict(previous_values)
+    previous_values['Candlestick_Pattern'], latest_values['Candlestick_Pattern'] = detect_candlestick_patterns(df, tail=2)
+    return previous_values, latest_values
+
+# ======================= Векторный расчёт индикаторов =======================
+
+def _wilder_smooth(values, start, seed):
+    """Сглаживание Уайлдера x[t] = x[t-1] * (w-1)/w + values[t]/w, начиная с позиции start со значения seed.
+
+    Свечи идут по оси 0; для панели seed — массив начальных значений по символам.
+    """
+    sequence = values[start:].copy()
+    sequence[0] = seed
+    return _ewm_mean(sequence, 1 / StreamingIndicatorState.WINDOW)
+
+def _shift(values):
+    """Сдвигает массив на одну свечу по оси 0, первая свеча получает NaN."""
+    return np.concatenate((np.full((1,) + values.shape[1:], np.nan), values[:-1]))
+
+def _rolling(values, window, method, **kwargs):
+    """Скользящее окно по оси 0 для всех символов панели (как pandas rolling(window) с полным окном).
+
+    Каждое окно считается заново методом numpy (mean, std, min, max, sum), без накопительных сумм:
+    ошибка округления не переходит ни между свечами, ни от дорогого символа к дешёвому (например, от TON к PEPE).
+    """
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+        result[window - 1:] = getattr(windows, method)(axis=-1, **kwargs)
+    return result
+
+def _ewm_mean(values, alpha, min_periods=0):
+    """Экспоненциальное среднее, как pandas ewm(alpha, adjust=False).mean(), по оси 0 для всех символов панели.
+
+    На широкой панели цикл идёт по свечам, и каждый шаг считается сразу для всех символов;
+    на узкой и длинной (например, в бэктесте) быстрее расчёт pandas по столбцам.
+    Пропуски допускаются только в начале истории и одинаковые у всех символов.
+    """
+    n = len(values)
+    if n > 10 * values.shape[1]:
+        return pd.DataFrame(values).ewm(alpha=alpha, adjust=False, min_periods=min_periods).mean().to_numpy()
+    result = np.full(values.shape, np.nan)
+    observed = np.flatnonzero(~np.isnan(values).any(axis=1))
+    if not len(observed):
+        return result
+    start = observed[0]
+    decay = 1 - alpha
+    weighted = result[start] = values[start]
+    for position in range(start + 1, n):
+        weighted = result[position] = (decay * weighted + alpha * values[position]) / (decay + alpha)
+    result[:start + max(min_periods, 1) - 1] = np.nan
+    return result
+
+def compute_indicator_panel(candles):
+    """Рассчитывает индикаторы analyze_data и get_market_trend для панели символов за один векторный проход.
+
+    candles — массивы open, high, low, close, volume формы (символы × свечи) одинаковой длины.
+    Возвращает словарь массивов той же формы; строка каждого символа совпадает с compute_indicators
+    по его свечам. Формулы и начальные значения те же, что в StreamingIndicatorState.
+    """
+    w = StreamingIndicatorState.WINDOW
+    # Внутри свечи идут по оси 0, чтобы скользящие окна pandas считались по всем символам сразу
+    open_prices, high, low, close_values, volume = (
+        np.asarray(candles[col], dtype='float64').T for col in ('open', 'high', 'low', 'close', 'volume'))
+    n = len(close_values)
+    prev_close = _shift(close_values)
+    indicators = {'open': open_prices, 'high': high, 'low': low, 'close': close_values, 'volume': volume}
+
+    # Скользящие средние и полосы Боллинджера
+    for window in (5, 10, 50, 200):
+        indicators[f'SMA{window}'] = _rolling(close_values, window, 'mean')
+    mean20 = _rolling(close_values, 20, 'mean')
+    std20 = _rolling(close_values, 20, 'std', ddof=0)
+    indicators['Bollinger_High'] = mean20 + 2 * std20
+    indicators['Bollinger_Low'] = mean20 - 2 * std20
+
+    # EMA и MACD (span s соответствует alpha = 2 / (s + 1))
+    indicators['EMA20'] = _ewm_mean(close_values, 2 / 21, min_periods=20)
+    macd = _ewm_mean(close_values, 2 / 13, min_periods=12) - _ewm_mean(close_values, 2 / 27, min_periods=26)
+    indicators['MACD'] = macd
+    indicators['MACD_signal'] = _ewm_mean(macd, 2 / 10, min_periods=9)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # RSI
+        diff = close_values - prev_close
+        rsi_up = _ewm_mean(np.where(diff > 0, diff, 0.0), 1 / w, min_periods=w)
+        rsi_down = _ewm_mean(np.where(diff < 0, -diff, 0.0), 1 / w, min_periods=w)
+        indicators['RSI'] = np.where(rsi_down == 0, 100.0, 100 - 100 / (1 + rsi_up / rsi_down))
 
-        mfi = MFIIndicator(high=df['high'], low=df['low'], close=df['close'], volume=df['volume'], window=14)
-        df['MFI'] = mfi.money_flow_index()
+        # Стохастик
+        lowest = _rolling(low, w, 'min')
+        highest = _rolling(high, w, 'max')
+        indicators['Stochastic'] = 100 * (close_values - lowest) / (highest - lowest)
 
-        # Распознавание свечных паттернов
-        df['Candlestick_Pattern'] = df.apply(detect_candlestick_pattern, axis=1)
+        # ATR
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        indicators['ATR'] = np.zeros_like(close_values)
+        if n >= w:
+            indicators['ATR'][w - 1:] = _wilder_smooth(true_range, w - 1, true_range[:w].mean(axis=0))
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при расчёте индикаторов для {symbol} на таймфрейме {timeframe}: {e}")
+        # ADX
+        directional_range = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+        diff_up = high - _shift(high)
+        diff_down = _shift(low) - low
+        pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.0)
+        neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.0)
+        indicators['ADX'] = np.zeros_like(close_values)
+        if n > w:
+            trs, dip, din = (w * _wilder_smooth(values, w, values[1:w + 1].sum(axis=0) / w) for values in (directional_range, pos, neg))
+            di_pos = np.where(trs != 0, 100 * (dip / trs), 0.0)
+            di_neg = np.where(trs != 0, 100 * (din / trs), 0.0)
+            dx = np.where(di_pos + di_neg != 0, 100 * np.abs((di_pos - di_neg) / (di_pos + di_neg)), 0.0)
+            if n >= 2 * w:
+                indicators['ADX'][2 * w - 1:] = _wilder_smooth(dx, w - 1, dx[:w].mean(axis=0))
+
+        # OBV
+        indicators['OBV'] = np.cumsum(np.where(close_values < prev_close, -volume, volume), axis=0)
+
+        # MFI
+        typical_price = (high + low + close_values) / 3.0
+        prev_typical_price = _shift(typical_price)
+        direction = np.where(typical_price > prev_typical_price, 1, np.where(typical_price < prev_typical_price, -1, 0))
+        money_flow = typical_price * volume * direction
+        money_flow_pos = _rolling(np.where(money_flow >= 0, money_flow, 0.0), w, 'sum')
+        money_flow_neg = np.abs(_rolling(np.where(money_flow < 0, money_flow, 0.0), w, 'sum'))
+        indicators['MFI'] = 100 - 100 / (1 + money_flow_pos / money_flow_neg)
+
+    return {name: values.T for name, values in indicators.items()}
+
+def compute_indicators(df):
+    """Рассчитывает индикаторы analyze_data сразу для всех свечей DataFrame.
+
+    Векторный аналог StreamingIndicatorState (панель из одного символа): формулы и начальные значения те же,
+    значения совпадают с потоковым расчётом с точностью до погрешности вычислений с плавающей точкой.
+    """
+    panel = compute_indicator_panel({col: df[col].to_numpy(dtype='float64')[np.newaxis] for col in ('open', 'high', 'low', 'close', 'volume')})
+    result = pd.DataFrame({name: values[0] for name, values in panel.items()}, index=df.index)
+    result['Candlestick_Pattern'] = detect_candlestick_patterns(df)
+    return result
+
+# ======================= Функция для анализа данных и генерации сигналов =======================
+
+# Порог ADX, ниже которого тренд считается слабым и сигналы не генерируются
+ADX_TREND_THRESHOLD = 25
+
+# Минимальное количество согласных индикаторов для сигнала
+SIGNAL_VOTE_THRESHOLD = 3
+
+# Условия голосования индикаторов: (ключ, название, условие покупки, условие продажи).
+# Условия получают значения последней и предыдущей свечи — числа в analyze_data или массивы
+# по всей истории в бэктесте, поэтому записаны через &, а не and. Условие продажи учитывается,
+# только если не выполнено условие покупки.
+SIGNAL_RULES = [
+    ('SMA', 'Скользящие Средние (SMA)',
+     lambda l, p: (p['SMA5'] < p['SMA10']) & (l['SMA5'] >= l['SMA10']),
+     lambda l, p: (p['SMA5'] > p['SMA10']) & (l['SMA5'] <= l['SMA10'])),
+    ('RSI', 'Индекс Относительной Силы (RSI)',
+     lambda l, p: l['RSI'] < 30,
+     lambda l, p: l['RSI'] > 70),
+    ('MACD', 'MACD',
+     lambda l, p: (p['MACD'] < p['MACD_signal']) & (l['MACD'] >= l['MACD_signal']),
+     lambda l, p: (p['MACD'] > p['MACD_signal']) & (l['MACD'] <= l['MACD_signal'])),
+    ('Bollinger', 'Полосы Боллинджера',
+     lambda l, p: l['close'] > l['Bollinger_High'],
+     lambda l, p: l['close'] < l['Bollinger_Low']),
+    ('Stochastic', 'Стохастик',
+     lambda l, p: l['Stochastic'] < 20,
+     lambda l, p: l['Stochastic'] > 80),
+    ('OBV', 'On-Balance Volume (OBV)',
+     lambda l, p: l['OBV'] > p['OBV'],
+     lambda l, p: l['OBV'] < p['OBV']),
+    ('MFI', 'Индекс Денежного Потока (MFI)',
+     lambda l, p: l['MFI'] < 20,
+     lambda l, p: l['MFI'] > 80),
+    ('Candlestick', 'Свечной Паттерн ({pattern})',
+     lambda l, p: np.isin(l['Candlestick_Pattern'], ['Bullish Engulfing', 'Hammer', 'Doji']),
+     lambda l, p: np.isin(l['Candlestick_Pattern'], ['Bearish Engulfing', 'Shooting Star', 'Doji'])),
+]
+
+def make_signal(symbol, timeframe, direction, indicators, candle_time):
+    """Собирает словарь сигнала: направление ('long' или 'short'), согласные индикаторы, время открытия свечи и текст."""
+    if direction == 'long':
+        title = f"📈 **ЛОНГ сигнал для {symbol} на таймфрейме {timeframe}!**"
+    else:
+        title = f"📉 **ШОРТ сигнал для {symbol} на таймфрейме {timeframe}!**"
+    text = f"{title} {len(indicators)} индикаторов согласны.\nИндикаторы: {', '.join(indicators)}"
+    return {'direction': direction, 'indicators': indicators, 'candle_time': candle_time, 'text': text}
+
+def analyze_data(df, symbol, timeframe, trend):
+    """Анализирует данные и генерирует торговый сигнал на основе технических индикаторов.
+
+    Возвращает словарь сигнала (см. make_signal) или None.
+    """
+    if df.empty:
+        logger.info("❌ Нет данных для анализа для %s на таймфрейме %s.", symbol, timeframe, extra=log_fields('analysis', symbol, timeframe))
         return None
 
     # Проверка наличия достаточных данных
-    if df.empty or len(df) < 2:
-        logger.info(f"❌ Недостаточно данных для анализа для {symbol} на таймфрейме {timeframe}.")
+    if len(df) < 2:
+        logger.info("❌ Недостаточно данных для анализа для %s на таймфрейме %s.", symbol, timeframe, extra=log_fields('analysis', symbol, timeframe))
         return None
 
+    # Потоковый расчёт индикаторов: пересчитываются только новые свечи
     try:
-        latest = df.iloc[-1]
-        previous = df.iloc[-2]
-    except IndexError as e:
-        logger.error(f"❌ Недостаточно данных для анализа для {symbol} на таймфрейме {timeframe}: {e}")
+        with metrics.timer('signal_stage_seconds', stage='indicators', symbol=symbol, timeframe=timeframe):
+            previous, latest = update_streaming_indicators(df, symbol, timeframe)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при расчёте индикаторов для {symbol} на таймфрейме {timeframe}: {e}")
         return None
 
-    # Логирование значений индикаторов
+    # Логирование значений индикаторов (строка собирается, только если запись прошла выборку)
     logger.info(
-        f"📊 Проверка сигналов для {symbol} на таймфрейме {timeframe}: "
-        f"SMA5={latest['SMA5']}, SMA10={latest['SMA10']}, RSI={latest['RSI']}, "
-        f"MACD={latest['MACD']}, MACD_signal={latest['MACD_signal']}, "
-        f"OBV={latest['OBV']}, MFI={latest['MFI']}, "
-        f"Candlestick_Pattern={latest['Candlestick_Pattern']}"
+        "📊 Проверка сигналов для %s на таймфрейме %s: SMA5=%s, SMA10=%s, RSI=%s, MACD=%s, MACD_signal=%s, "
+        "OBV=%s, MFI=%s, Candlestick_Pattern=%s",
+        symbol, timeframe, latest['SMA5'], latest['SMA10'], latest['RSI'], latest['MACD'], latest['MACD_signal'],
+        latest['OBV'], latest['MFI'], latest['Candlestick_Pattern'],
+        extra=log_fields('analysis', symbol, timeframe),
     )
 
     # Используем ADX как фильтр для тренда
-    if latest['ADX'] < 25:
-        logger.info(f"⚠️ Тренд не является сильным для {symbol} на таймфрейме {timeframe} (ADX < 25). Сигналы не генерируются.")
+    if latest['ADX'] < ADX_TREND_THRESHOLD:
+        logger.info(
+            "⚠️ Тренд не является сильным для %s на таймфрейме %s (ADX < %s). Сигналы не генерируются.",
+            symbol, timeframe, ADX_TREND_THRESHOLD, extra=log_fields('analysis', symbol, timeframe))
         return None
 
-    # Словарь для хранения названий индикаторов
-    indicator_names = {
-        'SMA': 'Скользящие Средние (SMA)',
-        'RSI': 'Индекс Относительной Силы (RSI)',
-        'MACD': 'MACD',
-        'Bollinger': 'Полосы Боллинджера',
-        'Stochastic': 'Стохастик',
-        'OBV': 'On-Balance Volume (OBV)',
-        'MFI': 'Индекс Денежного Потока (MFI)',
-        'Candlestick': f"Свечной Паттерн ({latest['Candlestick_Pattern']})"
-    }
-
     # Создание списков сигналов с названиями индикаторов
     buy_signals = []
     sell_signals = []
 
     # Проверяем условия для каждого индикатора и добавляем названия индикаторов в списки
-
-    # Исправленные условия для скользящих средних
-    if previous['SMA5'] < previous['SMA10'] and latest['SMA5'] >= latest['SMA10']:
-        buy_signals.append(indicator_names['SMA'])
-    elif previous['SMA5'] > previous['SMA10'] and latest['SMA5'] <= latest['SMA10']:
-        sell_signals.append(indicator_names['SMA'])
-
-    # RSI
-    if latest['RSI'] < 30:
-        buy_signals.append(indicator_names['RSI'])
-    elif latest['RSI'] > 70:
-        sell_signals.append(indicator_names['RSI'])
-
-    # MACD
-    if previous['MACD'] < previous['MACD_signal'] and latest['MACD'] >= latest['MACD_signal']:
-        buy_signals.append(indicator_names['MACD'])
-    elif previous['MACD'] > previous['MACD_signal'] and latest['MACD'] <= latest['MACD_signal']:
-        sell_signals.append(indicator_names['MACD'])
-
-    # Исправленные условия для полос Боллинджера
-    if latest['close'] > latest['Bollinger_High']:
-        buy_signals.append(indicator_names['Bollinger'])
-    elif latest['close'] < latest['Bollinger_Low']:
-        sell_signals.append(indicator_names['Bollinger'])
-
-    # Стохастик
-    if latest['Stochastic'] < 20:
-        buy_signals.append(indicator_names['Stochastic'])
-    elif latest['Stochastic'] > 80:
-        sell_signals.append(indicator_names['Stochastic'])
-
-    # Индикаторы объема
-    if latest['OBV'] > previous['OBV']:
-        buy_signals.append(indicator_names['OBV'])
-    elif latest['OBV'] < previous['OBV']:
-        sell_signals.append(indicator_names['OBV'])
-
-    if latest['MFI'] < 20:
-        buy_signals.append(indicator_names['MFI'])
-    elif latest['MFI'] > 80:
-        sell_signals.append(indicator_names['MFI'])
-
-    # Свечные паттерны
-    if latest['Candlestick_Pattern'] in ['Bullish Engulfing', 'Hammer', 'Doji']:
-        buy_signals.append(indicator_names['Candlestick'])
-    elif latest['Candlestick_Pattern'] in ['Bearish Engulfing', 'Shooting Star', 'Doji']:
-        sell_signals.append(indicator_names['Candlestick'])
+    with metrics.timer('signal_stage_seconds', stage='evaluate', symbol=symbol, timeframe=timeframe):
+        for _, name, buy_condition, sell_condition in SIGNAL_RULES:
+            if buy_condition(latest, previous):
+                buy_signals.append(name.format(pattern=latest['Candlestick_Pattern']))
+            elif sell_condition(latest, previous):
+                sell_signals.append(name.format(pattern=latest['Candlestick_Pattern']))
 
     # Подсчёт количества положительных сигналов
     buy_signals_count = len(buy_signals)
     sell_signals_count = len(sell_signals)
 
     # Порог для мажоритарного правила (минимум 3 из индикаторов)
-    threshold = 3
+    threshold = SIGNAL_VOTE_THRESHOLD
 
     # Фильтрация сигналов на основе общего тренда
     if trend == 'uptrend':
         # Принимаем только ЛОНГ сигналы
         if buy_signals_count >= threshold:
-            signal = (
-                f"📈 **ЛОНГ сигнал для {symbol} на таймфрейме {timeframe}!** {buy_signals_count} индикаторов согласны.\n"
-                f"Индикаторы: {', '.join(buy_signals)}"
-            )
-            logger.info(f"✅ Сгенерирован ЛОНГ сигнал для {symbol} на таймфрейме {timeframe} с индикаторами: {', '.join(buy_signals)}")
-            return signal
+            logger.info("✅ Сгенерирован ЛОНГ сигнал для %s на таймфрейме %s с индикаторами: %s", symbol, timeframe, ', '.join(buy_signals), extra=log_fields('analysis', symbol, timeframe))
+            return make_signal(symbol, timeframe, 'long', buy_signals, df.index[-1])
         else:
-            logger.info(f"🔕 ЛОНГ сигнал не был сгенерирован для {symbol} на таймфрейме {timeframe}.")
+            logger.info("🔕 ЛОНГ сигнал не был сгенерирован для %s на таймфрейме %s.", symbol, timeframe, extra=log_fields('analysis', symbol, timeframe))
             return None
     elif trend == 'downtrend':
         # Принимаем только ШОРТ сигналы
         if sell_signals_count >= threshold:
-            signal = (
-                f"📉 **ШОРТ сигнал для {symbol} на таймфрейме {timeframe}!** {sell_signals_count} индикаторов согласны.\n"
-                f"Индикаторы: {', '.join(sell_signals)}"
-            )
-            logger.info(f"✅ Сгенерирован ШОРТ сигнал для {symbol} на таймфрейме {timeframe} с индикаторами: {', '.join(sell_signals)}")
-            return signal
+            logger.info("✅ Сгенерирован ШОРТ сигнал для %s на таймфрейме %s с индикаторами: %s", symbol, timeframe, ', '.join(sell_signals), extra=log_fields('analysis', symbol, timeframe))
+            return make_signal(symbol, timeframe, 'short', sell_signals, df.index[-1])
         else:
-            logger.info(f"🔕 ШОРТ сигнал не был сгенерирован для {symbol} на таймфрейме {timeframe}.")
+            logger.info("🔕 ШОРТ сигнал не был сгенерирован для %s на таймфрейме %s.", symbol, timeframe, extra=log_fields('analysis', symbol, timeframe))
             return None
     else:
         # Боковой тренд, можем пропустить или принимать оба типа сигналов
-        logger.info(f"➡️ Боковой тренд для {symbol}. Сигналы не генерируются.")
+        logger.info("➡️ Боковой тренд для %s. Сигналы не генерируются.", symbol, extra=log_fields('analysis', symbol, timeframe))
         return None
 
+# ======================= Панельный анализ символов =======================
+
+def analyze_panel(symbols, timeframe, candles, candle_times, trends):
+    """Анализирует последнюю свечу всех символов панели сразу и возвращает список сигналов (или None) по символам.
+
+    candles — массивы цен и объёмов формы (символы × свечи), candle_times — время открытия последней свечи,
+    trends — общий тренд каждого символа. Правила голосования те же, что в analyze_data.
+    """
+    indicators = compute_indicator_panel(candles)
+    latest = {name: values[:, -1] for name, values in indicators.items()}
+    previous = {name: values[:, -2] for name, values in indicators.items()}
+    # Для паттерна последней свечи нужна ещё предыдущая
+    patterns = classify_candles(*(np.asarray(candles[col][:, -3:], dtype='float64') for col in ('open', 'high', 'low', 'close')))
+    previous['Candlestick_Pattern'], latest['Candlestick_Pattern'] = patterns[:, -2], patterns[:, -1]
+
+    buy_votes, sell_votes = [], []
+    with np.errstate(invalid='ignore'):
+        for _, _, buy_condition, sell_condition in SIGNAL_RULES:
+            buy = np.asarray(buy_condition(latest, previous), dtype=bool)
+            buy_votes.append(buy)
+            sell_votes.append(np.asarray(sell_condition(latest, previous), dtype=bool) & ~buy)
+    buy_votes, sell_votes = np.array(buy_votes), np.array(sell_votes)
+
+    trends = np.asarray(trends, dtype=object)
+    strong_trend = ~(latest['ADX'] < ADX_TREND_THRESHOLD)
+    is_long = strong_trend & (trends == 'uptrend') & (buy_votes.sum(axis=0) >= SIGNAL_VOTE_THRESHOLD)
+    is_short = strong_trend & (trends == 'downtrend') & (sell_votes.sum(axis=0) >= SIGNAL_VOTE_THRESHOLD)
+
+    signals = [None] * len(symbols)
+    for position in np.flatnonzero(is_long | is_short):
+        voted = buy_votes if is_long[position] else sell_votes
+        names = [name.format(pattern=latest['Candlestick_Pattern'][position])
+                 for rule, (_, name, _, _) in enumerate(SIGNAL_RULES) if voted[rule, position]]
+        signals[position] = make_signal(symbols[position], timeframe, 'long' if is_long[position] else 'short', names, candle_times[position])
+    return signals
+
+def stack_panel(frames):
+    """Складывает свечи символов одинаковой длины в массивы (символы × свечи)."""
+    return {col: np.stack([df[col].to_numpy(dtype='float64') for df in frames]) for col in ('open', 'high', 'low', 'close', 'volume')}
+
+def group_panel_frames(frames):
+    """Группирует {symbol: DataFrame} по длине последних PANEL_HISTORY_BARS свечей: {длина: [(symbol, DataFrame), ...]}.
+
+    Индикаторы зависят от всей истории символа, поэтому в одну панель попадают только истории одной длины;
+    в установившемся режиме истории всех символов длиннее окна и панель одна.
+    """
+    groups = {}
+    for symbol, df in frames.items():
+        df = df.iloc[-PANEL_HISTORY_BARS:]
+        groups.setdefault(len(df), []).append((symbol, df))
+    return groups
+
+async def update_market_trends(symbols, limiter):
+    """Обновляет устаревшие тренды символов и возвращает {symbol: trend}.
+
+    Аналог get_market_trend для многих символов: свечи загружаются параллельно, тренд — тот же
+    classify_trend_series по закрытым свечам TREND_TIMEFRAME.
+    """
+    timeframe = TREND_TIMEFRAME
+    now = datetime.now(timezone.utc)
+    stale = [symbol for symbol in symbols if not is_trend_fresh(symbol, now)]
+
+    async def load(symbol):
+        async with limiter:
+            return await run_fetch(fetch_candles, symbol, timeframe)
+
+    updated = 0
+    for symbol, df in zip(stale, await asyncio.gather(*(load(symbol) for symbol in stale))):
+        df = drop_forming_candle(df, timeframe)
+        if len(df) < 200:
+            logger.warning(f"⚠️ Недостаточно данных для определения тренда для {symbol} на таймфрейме {timeframe}.")
+            continue
+        store_market_trend(symbol, df)
+        updated += 1
+    if stale:
+        logger.info(f"📈 Обновлены тренды {updated} из {len(stale)} символов на таймфрейме {timeframe}.")
+    return {symbol: market_trends[symbol]['trend'] for symbol in symbols if symbol in market_trends}
+
+async def analyze_symbols_panel(pairs, on_signal):
+    """Анализирует пары панелями: все символы одного таймфрейма считаются одним векторным проходом.
+
+    pairs — {symbol: [timeframe, ...]}; по каждой паре вызывается on_signal(symbol, timeframe, signal).
+    """
+    limiter = asyncio.Semaphore(TICK_CONCURRENCY)
+    trends = await update_market_trends(list(pairs), limiter)
+    symbols_by_timeframe = {}
+    for symbol, timeframes in pairs.items():
+        if symbol not in trends:
+            logger.warning(f"⚠️ Не удалось определить тренд для {symbol}. Пропускаем.")
+            continue
+        for timeframe in timeframes:
+            symbols_by_timeframe.setdefault(timeframe, []).append(symbol)
+
+    async def analyze_timeframe(timeframe, symbols):
+        async def load(symbol):
+            async with limiter:
+                return await run_fetch(fetch_candles, symbol, timeframe)
+
+        frames = {}
+        evaluations = {}
+        for symbol, df in zip(symbols, await asyncio.gather(*(load(symbol) for symbol in symbols))):
+            df = drop_forming_candle(df, timeframe)
+            if len(df) < 2:
+                logger.error(f"❌ Недостаточно исторических данных для {symbol} на таймфрейме {timeframe}. Сигналы не будут отправлены.")
+                on_signal(symbol, timeframe, None)
+                continue
+            # Та же свеча при том же тренде уже оценена: новых данных нет, результат не изменится
+            evaluation = (df.index[-1], trends[symbol])
+            if signal_evaluations.get((symbol, timeframe)) == evaluation:
+                metrics.inc('signal_evaluations_skipped_total')
+                on_signal(symbol, timeframe, None)
+                continue
+            evaluations[symbol] = evaluation
+            frames[symbol] = df
+
+        for members in group_panel_frames(frames).values():
+            symbols = [symbol for symbol, _ in members]
+            with metrics.timer('signal_stage_seconds', stage='indicators', symbol='*', timeframe=timeframe):
+                signals = await run_analysis(
+                    analyze_panel, symbols, timeframe, stack_panel([df for _, df in members]),
+                    [df.index[-1] for _, df in members], [trends[symbol] for symbol in symbols])
+            logger.info(f"📊 Панель {timeframe}: {len(symbols)} символов, {len(members[0][1])} свечей, сигналов: {sum(1 for signal in signals if signal)}.")
+            # Оценка запоминается только после расчёта: пара, не досчитанная до дедлайна или из-за ошибки,
+            # не считается оценённой и не будет пропущена при следующем анализе
+            for symbol, signal in zip(symbols, signals):
+                signal_evaluations[(symbol, timeframe)] = evaluations[symbol]
+                on_signal(symbol, timeframe, signal)
+
+    await asyncio.gather(*(analyze_timeframe(timeframe, symbols) for timeframe, symbols in symbols_by_timeframe.items()))
+
 # ======================= Функция для распознавания свечных паттернов =======================
 
+# Свечные паттерны в порядке приоритета: проверяются сверху вниз, побеждает первый совпавший.
+# Каждое условие получает словарь массивов свечи (open, high, low, close, body, upper_shadow,
+# lower_shadow) и тех же значений предыдущей свечи с префиксом prev_, поэтому сюда можно добавлять
+# и многосвечные паттерны без построчных вычислений.
+CANDLESTICK_PATTERNS = [
+    ('Doji', lambda c: c['body'] < (c['upper_shadow'] + c['lower_shadow']) * 0.1),
+    ('Bullish Engulfing', lambda c: (c['body'] > (c['upper_shadow'] + c['lower_shadow']) * 2) & (c['close'] > c['open'])),
+    ('Bearish Engulfing', lambda c: (c['body'] > (c['upper_shadow'] + c['lower_shadow']) * 2) & (c['close'] < c['open'])),
+    ('Hammer', lambda c: (c['lower_shadow'] > c['body'] * 2) & (c['close'] > c['open'])),
+    ('Shooting Star', lambda c: (c['upper_shadow'] > c['body'] * 2) & (c['close'] < c['open'])),
+]
+
+def detect_candlestick_patterns(df, tail=None):
+    """Распознаёт свечные паттерны сразу для всех свечей DataFrame.
+
+    tail — классифицировать только последние N свечей (предыдущая свеча всё равно учитывается
+    для многосвечных паттернов). Возвращает массив названий паттернов.
+    """
+    if tail is not None:
+        df = df.iloc[-(tail + 1):]
+
+    patterns = classify_candles(*(df[col].to_numpy(dtype='float64') for col in ('open', 'high', 'low', 'close')))
+
+    if tail is not None:
+        patterns = patterns[-tail:]
+    return patterns
+
+def classify_candles(open_prices, high, low, close):
+    """Распознаёт свечные паттерны по массивам цен; свечи идут по последней оси, поэтому подходит и панель символов."""
+    candles = {'open': open_prices, 'high': high, 'low': low, 'close': close}
+    candles['body'] = np.abs(candles['close'] - candles['open'])
+    candles['upper_shadow'] = candles['high'] - np.maximum(candles['close'], candles['open'])
+    candles['lower_shadow'] = np.minimum(candles['close'], candles['open']) - candles['low']
+    for name in list(candles):
+        values = candles[name]
+        candles[f'prev_{name}'] = np.concatenate((np.full(values.shape[:-1] + (1,), np.nan), values[..., :-1]), axis=-1)
+
+    with np.errstate(invalid='ignore'):
+        conditions = [condition(candles) for _, condition in CANDLESTICK_PATTERNS]
+    return np.select(conditions, [name for name, _ in CANDLESTICK_PATTERNS], default='No Pattern').astype(object)
+
 def detect_candlestick_pattern(row):
-    """Распознаёт простые свечные паттерны."""
-    open_price = row['open']
-    high_price = row['high']
-    low_price = row['low']
-    close_price = row['close']
-
-    body = abs(close_price - open_price)
-    upper_shadow = high_price - max(close_price, open_price)
-    lower_shadow = min(close_price, open_price) - low_price
-
-    if body < (upper_shadow + lower_shadow) * 0.1:
-        return 'Doji'
-    elif body > (upper_shadow + lower_shadow) * 2 and close_price > open_price:
-        return 'Bullish Engulfing'
-    elif body > (upper_shadow + lower_shadow) * 2 and close_price < open_price:
-        return 'Bearish Engulfing'
-    elif lower_shadow > body * 2 and close_price > open_price:
-        return 'Hammer'
-    elif upper_shadow > body * 2 and close_price < open_price:
-        return 'Shooting Star'
-    else:
-        return 'No Pattern'
+    """Распознаёт простые свечные паттерны для одной свечи."""
+    return detect_candlestick_patterns(pd.DataFrame([row]))[0]
 
 # ======================= Команды Бота =======================
 
+def parse_subscription_filters(args):
+    """Разбирает аргументы /start и /stop — символы и таймфреймы в любом порядке.
+
+    Возвращает (фильтры, нераспознанные аргументы). Без символов или без таймфреймов
+    фильтр подходит для любого символа или таймфрейма.
+    """
+    symbols, timeframes, unknown = [], [], []
+    for arg in args or []:
+        if arg in TIMEFRAMES:
+            timeframes.append(arg)
+        elif arg.upper() in CRYPTO_SYMBOLS:
+            symbols.append(arg.upper())
+        else:
+            unknown.append(arg)
+    wildcard = [SUBSCRIPTION_WILDCARD]
+    return [(symbol, timeframe) for symbol in symbols or wildcard for timeframe in timeframes or wildcard], unknown
+
+def format_subscription_filters(filters):
+    """Описание фильтров подписки для сообщений пользователю."""
+    def describe(symbol, timeframe):
+        if symbol == SUBSCRIPTION_WILDCARD and timeframe == SUBSCRIPTION_WILDCARD:
+            return 'все сигналы'
+        if symbol == SUBSCRIPTION_WILDCARD:
+            return f'все символы на {timeframe}'
+        if timeframe == SUBSCRIPTION_WILDCARD:
+            return f'{symbol} на всех таймфреймах'
+        return f'{symbol} на {timeframe}'
+    return ', '.join(describe(symbol, timeframe) for symbol, timeframe in sorted(filters))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start для подписки на сигналы."""
+    """Обработчик команды /start для подписки на все сигналы или на выбранные символы и таймфреймы."""
     chat_id = update.effective_chat.id
-    subscribers = load_subscribers()
-    if chat_id not in subscribers:
-        subscribers.add(chat_id)
-        save_subscribers(subscribers)
-        await update.message.reply_text('✅ Вы подписались на торговые сигналы!')
-        logger.info(f"👤 Пользователь {chat_id} подписался на сигналы.")
+    filters, unknown = parse_subscription_filters(context.args)
+    if unknown:
+        await update.message.reply_text(f"❌ Неизвестные символы или таймфреймы: {', '.join(unknown)}.")
+        logger.info(f"👤 Пользователь {chat_id} указал неизвестные фильтры подписки: {', '.join(unknown)}.")
+        return
+    added = add_subscriber(chat_id, filters)
+    if added:
+        await update.message.reply_text(f'✅ Вы подписались на торговые сигналы: {format_subscription_filters(added)}!')
+        logger.info(f"👤 Пользователь {chat_id} подписался на сигналы: {format_subscription_filters(added)}.")
     else:
-        await update.message.reply_text('ℹ️ Вы уже подписаны на торговые сигналы.')
+        await update.message.reply_text('ℹ️ Вы уже подписаны на эти торговые сигналы.')
         logger.info(f"👤 Пользователь {chat_id} попытался подписаться повторно.")
 
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /stop для отписки от сигналов."""
+    """Обработчик команды /stop для отписки от всех сигналов или от выбранных символов и таймфреймов."""
     chat_id = update.effective_chat.id
-    subscribers = load_subscribers()
-    if chat_id in subscribers:
-        subscribers.remove(chat_id)
-        save_subscribers(subscribers)
+    filters, unknown = parse_subscription_filters(context.args)
+    if unknown:
+        await update.message.reply_text(f"❌ Неизвестные символы или таймфреймы: {', '.join(unknown)}.")
+        logger.info(f"👤 Пользователь {chat_id} указал неизвестные фильтры подписки: {', '.join(unknown)}.")
+        return
+    removed = remove_subscriber(chat_id, filters if context.args else None)
+    if removed and chat_id not in load_subscribers():
         await update.message.reply_text('🛑 Вы отписались от торговых сигналов.')
         logger.info(f"👤 Пользователь {chat_id} отписался от сигналов.")
+    elif removed:
+        await update.message.reply_text(f'🛑 Вы отписались от сигналов: {format_subscription_filters(removed)}. Остальные подписки: /subscriptions')
+        logger.info(f"👤 Пользователь {chat_id} отписался от сигналов: {format_subscription_filters(removed)}.")
     else:
-        await update.message.reply_text('ℹ️ Вы не были подписаны на сигналы.')
+        await update.message.reply_text('ℹ️ Вы не были подписаны на эти сигналы. Текущие подписки: /subscriptions')
         logger.info(f"👤 Пользователь {chat_id} попытался отписаться, но не был подписан.")
 
+async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /subscriptions: показывает фильтры подписки чата."""
+    chat_id = update.effective_chat.id
+    refresh_subscribers()
+    filters = get_subscription_index().filters.get(chat_id)
+    if filters:
+        await update.message.reply_text(f'📋 Ваши подписки: {format_subscription_filters(filters)}.')
+    else:
+        await update.message.reply_text('ℹ️ Вы не подписаны на сигналы.')
+    logger.info(f"👤 Пользователь {chat_id} запросил список подписок.")
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help для отображения справки."""
     help_text = (
         "ℹ️ **Доступные команды:**\n\n"
         "/start - **Подписаться** на торговые сигналы\n"
+        "/start BTCUSDT ETHUSDT 1h - **Подписаться** только на выбранные символы и таймфреймы\n"
         "/stop - **Отписаться** от торговых сигналов\n"
+        "/stop BTCUSDT 1h - **Отписаться** от выбранных символов и таймфреймов\n"
+        "/subscriptions - **Показать** ваши подписки\n"
         "/help - **Получить** справку"
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
     logger.info(f"👤 Пользователь {update.effective_chat.id} запросил справку.")
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats: сводка метрик для администраторов."""
+    chat_id = update.effective_chat.id
+    if chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text('⛔ Команда доступна только администраторам.')
+        logger.info(f"👤 Пользователь {chat_id} запросил статистику без прав администратора.")
+        return
+    await update.message.reply_text(format_stats())
+    logger.info(f"👤 Администратор {chat_id} запросил статистику.")
+
 # ======================= Обработчик Ошибок =======================
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок."""
     logger.error(msg="❌ Exception while handling an update:", exc_info=context.error)
 
+# ======================= Рассылка сигналов =======================
+
+class TokenBucket:
+    """Ограничитель частоты: не более rate событий в секунду с запасом capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Приостанавливает выдачу токенов (например, после RetryAfter от Telegram)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        """Ждёт, пока освободится токен, и забирает его."""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class SignalDispatcher:
+    """Рассылает сигналы подписчикам с учётом лимитов Telegram.
+
+    Сигналы, накопленные за тик, объединяются в одно сообщение на чат; отправка идёт
+    ограниченным пулом воркеров через общий токен-бакет и минимальный интервал на чат,
+    а при RetryAfter повторяется после указанной сервером паузы.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self.chat_next_send = {}
+        self.lock = asyncio.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_latencies = []
+        self.flush_task = None
+
+    def queue_signal(self, text, chat_ids):
+        """Добавляет сигнал в очередь рассылки для указанных чатов."""
+        queued_at = time.monotonic()
+        for chat_id in chat_ids:
+            self.pending.setdefault(chat_id, []).append((queued_at, text))
+
+    async def _wait_chat_slot(self, chat_id):
+        """Соблюдает минимальный интервал между сообщениями в один чат."""
+        now = time.monotonic()
+        next_send = self.chat_next_send.get(chat_id, 0.0)
+        self.chat_next_send[chat_id] = max(now, next_send) + 1 / TELEGRAM_PER_CHAT_RATE
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+
+    async def _send(self, bot, chat_id, text):
+        """Отправляет одно сообщение с повторами; возвращает None при успехе или исключение последней попытки.
+
+        Ошибки по отдельным чатам пишутся на уровне DEBUG, а в итог рассылки попадает их сводка.
+        """
+        for attempt in range(TELEGRAM_SEND_RETRIES + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.global_bucket.acquire()
+            try:
+                with metrics.timer('telegram_send_seconds'):
+                    await bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
+                return None
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self.global_bucket.pause(retry_after)
+                error = e
+            except (TimedOut, NetworkError) as e:
+                await asyncio.sleep(2 ** attempt)
+                error = e
+            except Exception as e:
+                logger.debug("❌ Не удалось отправить сообщение пользователю %s: %s", chat_id, e, extra=log_fields('delivery'))
+                return e
+            if attempt < TELEGRAM_SEND_RETRIES:
+                self.retries += 1
+        logger.debug(
+            "❌ Не удалось отправить сообщение пользователю %s после %d повторов: %s",
+            chat_id, TELEGRAM_SEND_RETRIES, error, extra=log_fields('delivery'))
+        return error
+
+    @staticmethod
+    def _build_messages(signals):
+        """Объединяет сигналы в сообщения, не превышающие лимит длины Telegram."""
+        messages, current = [], ''
+        for _, text in signals:
+            if current and len(current) + 2 + len(text) > TELEGRAM_MESSAGE_LIMIT:
+                messages.append(current)
+                current = ''
+            current = f"{current}\n\n{text}" if current else text
+        messages.append(current)
+        return messages
+
+    async def flush(self, bot):
+        """Отправляет накопленные сигналы: по одному объединённому сообщению на чат."""
+        async with self.lock:
+            pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            queue = iter(pending.items())
+            latencies = []
+            errors = {}
+            sent = failed = 0
+
+            async def worker():
+                nonlocal sent, failed
+                for chat_id, signals in queue:
+                    for message in self._build_messages(signals):
+                        error = await self._send(bot, chat_id, message)
+                        if error is None:
+                            sent += 1
+                            latencies.append(time.monotonic() - signals[0][0])
+                            metrics.observe('signal_delivery_seconds', latencies[-1])
+                        else:
+                            failed += 1
+                            reason = str(error) or type(error).__name__
+                            errors[reason] = errors.get(reason, 0) + 1
+
+            await asyncio.gather(*(worker() for _ in range(min(TELEGRAM_SEND_CONCURRENCY, len(pending)))))
+            self.sent += sent
+            self.failed += failed
+            self.last_latencies = latencies
+            if latencies:
+                p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+                logger.info(
+                    f"📩 Рассылка завершена: {sent} сообщений в {len(pending)} чатов, ошибок: {failed}. "
+                    f"Задержка доставки p50={p50:.2f} с, p90={p90:.2f} с, p99={p99:.2f} с."
+                )
+            elif failed:
+                logger.error(f"❌ Рассылка завершилась без доставленных сообщений, ошибок: {failed}.")
+            if errors:
+                reasons = sorted(errors.items(), key=lambda item: -item[1])
+                logger.error(
+                    "❌ Не доставлено %d сообщений: %s.", failed,
+                    '; '.join(f"{reason} — {count}" for reason, count in reasons[:5]), extra=log_fields('delivery'))
+
+    def schedule_flush(self, bot, delay=TELEGRAM_COALESCE_DELAY):
+        """Откладывает рассылку на delay секунд, чтобы объединить сигналы, пришедшие почти одновременно."""
+        if self.flush_task is None or self.flush_task.done():
+            async def delayed_flush():
+                await asyncio.sleep(delay)
+                await self.flush(bot)
+            self.flush_task = asyncio.create_task(delayed_flush())
+
+signal_dispatcher = SignalDispatcher()
+
 # ======================= Функция для Отправки Сигналов =======================
 
+def get_schedule_step():
+    """Шаг планировщика в секундах: наибольший общий делитель длительностей свечей всех таймфреймов."""
+    return functools.reduce(math.gcd, (int(get_timeframe_delta(timeframe).total_seconds()) for timeframe in TIMEFRAMES))
+
+def get_due_timeframes(moment):
+    """Возвращает таймфреймы, свеча которых закрылась на последней границе планировщика перед moment."""
+    step = get_schedule_step()
+    boundary = int(moment.timestamp()) // step * step
+    return [timeframe for timeframe in TIMEFRAMES if boundary % int(get_timeframe_delta(timeframe).total_seconds()) == 0]
+
+def get_next_schedule_time():
+    """Возвращает момент первого запуска анализа: ближайшая граница свечей плюс пауза на финализацию."""
+    step = get_schedule_step()
+    next_boundary = (int(datetime.now(timezone.utc).timestamp()) // step + 1) * step
+    return datetime.fromtimestamp(next_boundary + SIGNAL_GRACE_DELAY, timezone.utc)
+
+# Количество выполняющихся тиков (больше одного — тики накладываются друг на друга)
+_ticks_running = 0
+
 async def send_signal(context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет торговые сигналы всем подписчикам для каждой криптовалюты."""
+    """Отправляет торговые сигналы подписчикам пар по таймфреймам, свеча которых только что закрылась."""
+    refresh_subscribers()
     subscribers = load_subscribers()
     if not subscribers:
         logger.info("🔕 Нет подписчиков для отправки сигналов.")
         return  # Нет подписчиков
 
-    tasks = []
-    for symbol in CRYPTO_SYMBOLS:
-        trend = get_market_trend(symbol)
-        if trend is None:
-            logger.warning(f"⚠️ Не удалось определить тренд для {symbol}. Пропускаем.")
-            continue
-        for timeframe in TIMEFRAMES:
-            tasks.append(process_symbol(context, symbol, timeframe, subscribers, trend))
-    await asyncio.gather(*tasks)
-
-async def process_symbol(context: ContextTypes.DEFAULT_TYPE, symbol: str, timeframe: str, subscribers: set, trend: str):
-    """Обрабатывает данные и отправляет сигнал для одной криптовалюты на определенном таймфрейме."""
-    # Загрузка и обновление исторических данных
-    df = load_historical_data(symbol, timeframe)
-    if df.empty:
-        logger.error(f"❌ Не удалось загрузить исторические данные для {symbol} на таймфрейме {timeframe}. Сигналы не будут отправлены.")
+    timeframes = get_due_timeframes(datetime.now(timezone.utc) - timedelta(seconds=SIGNAL_GRACE_DELAY))
+    if not timeframes:
+        return
+    # Пары, на которые никто не подписан, не загружаются и не анализируются
+    pairs = get_wanted_pairs(CRYPTO_SYMBOLS, timeframes)
+    if not pairs:
+        logger.info(f"🔕 Нет подписчиков на таймфреймы {', '.join(timeframes)}.")
         return
+    logger.info(
+        f"⏰ Закрылись свечи таймфреймов {', '.join(timeframes)}. Запускаю анализ "
+        f"{sum(len(wanted) for wanted in pairs.values())} из {len(CRYPTO_SYMBOLS) * len(timeframes)} пар."
+    )
 
-    df = get_crypto_data(df, symbol, timeframe)
-    if df.empty:
-        logger.error(f"❌ DataFrame пуст после обновления данных для {symbol} на таймфрейме {timeframe}. Сигналы не будут отправлены.")
+    global _ticks_running
+    if _ticks_running:
+        metrics.inc('tick_overlaps_total')
+        logger.warning("⚠️ Новый тик начался до завершения предыдущего.")
+    _ticks_running += 1
+    started = time.perf_counter()
+    # Итоги тика по парам пишутся одной строкой вместо строки на каждую пару без сигнала
+    summary = {}
+    on_signal = functools.partial(queue_symbol_signal, summary=summary)
+    try:
+        try:
+            # Символы анализируются в шардах, если они запущены, иначе — в этом процессе
+            if shard_pool is not None:
+                tick = shard_pool.run_tick(pairs, on_signal)
+            else:
+                tick = analyze_symbols(pairs, on_signal)
+            await asyncio.wait_for(tick, timeout=TICK_DEADLINE)
+        except asyncio.TimeoutError:
+            metrics.inc('tick_overruns_total')
+            logger.warning(
+                f"⏱️ Тик не уложился в {TICK_DEADLINE} с. Сигналы незавершённых пар по закрывшейся свече пропущены, "
+                f"пары будут проанализированы при закрытии следующей свечи своего таймфрейма."
+            )
+
+        log_fetch_stats()
+        logger.info(
+            "🧾 Итоги тика: пар %d, сигналов в очереди %d, повторов подавлено %d, без подписчиков %d, без сигнала %d.",
+            sum(summary.values()), summary.get('sent', 0), summary.get('suppressed', 0),
+            summary.get('unrouted', 0), summary.get('none', 0), extra=log_fields('tick'),
+        )
+
+        # Все сигналы тика уходят одним сообщением на чат
+        await signal_dispatcher.flush(context.bot)
+        record_startup_milestone('startup_first_tick_seconds')
+    finally:
+        _ticks_running -= 1
+        metrics.observe('tick_duration_seconds', time.perf_counter() - started)
+
+async def analyze_symbols(pairs, on_signal):
+    """Определяет тренд и анализирует таймфреймы каждого символа из pairs ({symbol: [timeframe, ...]}).
+
+    По каждой паре вызывает on_signal(symbol, timeframe, signal).
+    """
+    if ANALYSIS_ENGINE == 'panel':
+        await analyze_symbols_panel(pairs, on_signal)
         return
 
-    # Анализ данных и генерация сигнала
-    signal = analyze_data(df, symbol, timeframe, trend)
+    # Ограничиваем число пар, которые одновременно загружаются и анализируются
+    limiter = asyncio.Semaphore(TICK_CONCURRENCY)
+
+    async def process_crypto(symbol, timeframes):
+        async with limiter:
+            trend = await run_fetch(get_market_trend, symbol)
+        if trend is None:
+            logger.warning(f"⚠️ Не удалось определить тренд для {symbol}. Пропускаем.")
+            return
+
+        async def process_timeframe(timeframe):
+            on_signal(symbol, timeframe, await analyze_symbol(symbol, timeframe, trend, limiter))
+
+        await asyncio.gather(*(process_timeframe(timeframe) for timeframe in timeframes))
+
+    await asyncio.gather(*(process_crypto(symbol, timeframes) for symbol, timeframes in pairs.items()))
+
+async def analyze_symbol(symbol: str, timeframe: str, trend: str, limiter: asyncio.Semaphore = None, refresh: bool = True):
+    """Загружает данные одной криптовалюты на таймфрейме и возвращает сигнал по последней закрытой свече (или None)."""
+    async with limiter or asyncio.Semaphore():
+        # Загрузка и обновление исторических данных в пуле потоков
+        df = await run_fetch(fetch_candles, symbol, timeframe, refresh)
+        if df.empty:
+            logger.error(f"❌ Не удалось загрузить исторические данные для {symbol} на таймфрейме {timeframe}. Сигналы не будут отправлены.")
+            return None
+
+        # Анализ данных и генерация сигнала по последней закрытой свече
+        df = drop_forming_candle(df, timeframe)
+        # Та же свеча при том же тренде уже оценена: новых данных нет, результат не изменится
+        evaluation = (df.index[-1], trend) if not df.empty else None
+        if evaluation is not None and signal_evaluations.get((symbol, timeframe)) == evaluation:
+            metrics.inc('signal_evaluations_skipped_total')
+            logger.info("⏭️ Новых свечей для %s на таймфрейме %s нет. Анализ пропущен.", symbol, timeframe, extra=log_fields('analysis', symbol, timeframe))
+            return None
+        await warm_indicator_state(df, symbol, timeframe)
+        signal = analyze_data(df, symbol, timeframe, trend)
+        signal_evaluations[(symbol, timeframe)] = evaluation
+        return signal
+
+# Последний разосланный сигнал: (symbol, timeframe, direction) -> (время открытия свечи, индикаторы).
+# Вместе с ключом время свечи идентифицирует сигнал: (symbol, timeframe, direction, candle open time)
+sent_signals = {}
+
+def is_repeated_signal(symbol, timeframe, signal):
+    """Проверяет, повторяет ли сигнал уже разосланный, и запоминает его, если нет.
+
+    Повтором считается сигнал той же или более ранней свечи, а также сигнал в пределах
+    SIGNAL_COOLDOWN_BARS свечей от предыдущей отправки, не добавивший новых индикаторов.
+    """
+    key = (symbol, timeframe, signal['direction'])
+    indicators = frozenset(signal['indicators'])
+    previous = sent_signals.get(key)
+    if previous is not None:
+        sent_time, sent_indicators = previous
+        elapsed = signal['candle_time'] - sent_time
+        cooldown = get_timeframe_delta(timeframe) * SIGNAL_COOLDOWN_BARS
+        if indicators <= sent_indicators and (elapsed <= timedelta(0) or elapsed < cooldown):
+            return True
+    sent_signals[key] = (signal['candle_time'], indicators)
+    return False
+
+def queue_symbol_signal(symbol, timeframe, signal, summary=None):
+    """Ставит сигнал пары в очередь рассылки подписанным на неё чатам, если он не повторяет уже разосланный.
+
+    summary — словарь итогов тика: к нему прибавляется результат пары (sent, suppressed, unrouted, none).
+    """
+    subscribers = get_subscription_index().match(symbol, timeframe) if signal else None
+    fields = log_fields('signal', symbol, timeframe)
+    if signal and not subscribers:
+        outcome = 'unrouted'
+        logger.info("🔕 На %s на таймфрейме %s больше никто не подписан. Сигнал не отправлен.", symbol, timeframe, extra=fields)
+    elif signal and is_repeated_signal(symbol, timeframe, signal):
+        outcome = 'suppressed'
+        metrics.inc('signals_total', result='suppressed')
+        logger.info("🔁 Сигнал для %s на таймфрейме %s уже разослан. Повтор подавлен.", symbol, timeframe, extra=fields)
+    elif signal:
+        outcome = 'sent'
+        metrics.inc('signals_total', result='sent')
+        signal_dispatcher.queue_signal(f"🔔 **Сигнал для {symbol} на таймфрейме {timeframe}:**\n{signal['text']}", subscribers)
+        logger.info("📩 Сигнал для %s на таймфрейме %s поставлен в очередь для %d подписчиков.", symbol, timeframe, len(subscribers), extra=fields)
+    else:
+        outcome = 'none'
+        logger.debug("🔕 Сигнал не был сгенерирован для %s на таймфрейме %s.", symbol, timeframe, extra=fields)
+    if summary is not None:
+        summary[outcome] = summary.get(outcome, 0) + 1
+
+async def process_symbol(context: ContextTypes.DEFAULT_TYPE, symbol: str, timeframe: str, trend: str, limiter: asyncio.Semaphore = None, refresh: bool = True):
+    """Обрабатывает данные и отправляет сигнал для одной криптовалюты на определенном таймфрейме подписанным на неё чатам."""
+    signal = await analyze_symbol(symbol, timeframe, trend, limiter, refresh)
+    queue_symbol_signal(symbol, timeframe, signal)
+
+# ======================= Вселенная символов и шардирование =======================
+
+def load_universe():
+    """Возвращает список символов для анализа согласно UNIVERSE_SOURCE.
+
+    'static' — CRYPTO_SYMBOLS, 'file' — символы из UNIVERSE_FILE (по одному в строке, # — комментарий),
+    'exchange' — торгуемые спотовые пары к UNIVERSE_QUOTE_ASSET с суточным объёмом не ниже
+    UNIVERSE_MIN_QUOTE_VOLUME, от самых ликвидных. При ошибке остаётся CRYPTO_SYMBOLS.
+    """
+    try:
+        if UNIVERSE_SOURCE == 'file':
+            with open(UNIVERSE_FILE) as f:
+                symbols = [line.split('#')[0].strip().upper() for line in f]
+            symbols = list(dict.fromkeys(symbol for symbol in symbols if symbol))
+        elif UNIVERSE_SOURCE == 'exchange':
+            exchange_info = binance_request('get_exchange_info')
+            tradable = {
+                info['symbol'] for info in exchange_info['symbols']
+                if info['status'] == 'TRADING' and info['quoteAsset'] == UNIVERSE_QUOTE_ASSET
+                and info.get('isSpotTradingAllowed', True)
+            }
+            volumes = {ticker['symbol']: float(ticker['quoteVolume']) for ticker in binance_request('get_ticker') if ticker['symbol'] in tradable}
+            symbols = sorted((symbol for symbol, volume in volumes.items() if volume >= UNIVERSE_MIN_QUOTE_VOLUME),
+                             key=volumes.get, reverse=True)
+            if UNIVERSE_MAX_SYMBOLS:
+                symbols = symbols[:UNIVERSE_MAX_SYMBOLS]
+        else:
+            symbols = list(CRYPTO_SYMBOLS)
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить список символов ({UNIVERSE_SOURCE}): {e}. Используется CRYPTO_SYMBOLS.")
+        return list(CRYPTO_SYMBOLS)
+
+    if not symbols:
+        logger.warning(f"⚠️ Список символов ({UNIVERSE_SOURCE}) пуст. Используется CRYPTO_SYMBOLS.")
+        return list(CRYPTO_SYMBOLS)
+    logger.info(f"🌐 Загружен список из {len(symbols)} символов ({UNIVERSE_SOURCE}).")
+    return symbols
+
+def _ring_hash(key):
+    """Стабильный между процессами и запусками хеш строки."""
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования: при изменении числа шардов переезжает лишь малая часть символов."""
+
+    def __init__(self, nodes, virtual_nodes=SHARD_VIRTUAL_NODES):
+        self.ring = sorted((_ring_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(virtual_nodes))
+        self.keys = [key for key, _ in self.ring]
+
+    def get_node(self, key):
+        """Возвращает узел, которому принадлежит ключ."""
+        return self.ring[bisect.bisect(self.keys, _ring_hash(key)) % len(self.ring)][1]
+
+def run_shard_worker(shard_id, symbols, task_queue, result_queue, log_format=None):
+    """Точка входа процесса шарда: загружает историю своих символов и выполняет тики по командам фронтенда.
+
+    Каждый символ принадлежит ровно одному шарду, поэтому кэш и хранилище свечей шарды не делят.
+    Процесс запускается через spawn и заново импортирует модуль, поэтому формат журнала из командной строки передаётся явно.
+    """
+    global ANALYSIS_WORKERS
+    # Свой клиент Binance: цикл событий и соединения родительского процесса в шард не переходят
+    reset_binance_client()
+    # Процесс шарда сам служит воркером: индикаторы считаются в нём без вложенного пула процессов
+    ANALYSIS_WORKERS = 0
+
+    setup_logging(log_format)
+    logger.info(f"🧩 Шард {shard_id} запущен: {len(symbols)} символов.")
+    loop = asyncio.new_event_loop()
+    last_flush = time.monotonic()
+    try:
+        restore_snapshot(get_snapshot_file(shard_id), symbols)
+        backfill_universe(symbols, TIMEFRAMES)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            tick_id, pairs = task
+
+            def on_signal(symbol, timeframe, signal):
+                result_queue.put(('signal', tick_id, shard_id, (symbol, timeframe, signal)))
 
-    if signal:
-        for chat_id in subscribers:
             try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"🔔 **Сигнал для {symbol} на таймфрейме {timeframe}:**\n{signal}",
-                    parse_mode='Markdown'
-                )
-                logger.info(f"📩 Сигнал для {symbol} на таймфрейме {timeframe} отправлен пользователю {chat_id}.")
-                await asyncio.sleep(0.1)  # Небольшая задержка, чтобы избежать превышения лимитов
+                loop.run_until_complete(asyncio.wait_for(analyze_symbols(pairs, on_signal), timeout=TICK_DEADLINE))
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ Шард {shard_id} не уложился в {TICK_DEADLINE} с.")
             except Exception as e:
-                logger.error(f"❌ Не удалось отправить сообщение пользователю {chat_id}: {e}")
-    else:
-        logger.info(f"🔕 Сигнал не был сгенерирован для {symbol} на таймфрейме {timeframe}.")
+                logger.error(f"❌ Ошибка тика в шарде {shard_id}: {e}")
+            result_queue.put(('done', tick_id, shard_id, None))
+
+            if time.monotonic() - last_flush >= CANDLE_CACHE_FLUSH_INTERVAL:
+                flush_candle_cache()
+                save_snapshot(get_snapshot_file(shard_id))
+                last_flush = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush_candle_cache()
+        save_snapshot(get_snapshot_file(shard_id))
+        shutdown_executors()
+        close_binance_client()
+        loop.close()
+        logger.info(f"🧩 Шард {shard_id} остановлен.")
+        stop_logging()
+
+class ShardPool:
+    """Процессы-воркеры, между которыми символы распределены консистентным хешированием.
+
+    Фронтенд (процесс с Telegram) рассылает шардам команды тика, а шарды возвращают
+    результаты анализа через общую локальную очередь. Её читает один поток пула и передаёт сообщения
+    в очередь того тика, которому они принадлежат, поэтому отменённый тик не оставляет ожидающих чтений.
+    Процессы шардов запускаются через spawn: фронтенд к моменту перезапуска упавшего шарда уже многопоточный.
+    """
+
+    def __init__(self, symbols, workers):
+        ring = ConsistentHashRing(range(workers))
+        self.assignments = {}
+        for symbol in symbols:
+            self.assignments.setdefault(ring.get_node(symbol), []).append(symbol)
+        self.context = multiprocessing.get_context('spawn')
+        self.result_queue = self.context.Queue()
+        self.task_queues = {}
+        self.processes = {}
+        self.tick_id = 0
+        self.ticks = {}  # tick_id -> (цикл событий, очередь результатов тика)
+        self.reader = None
+
+    def _start_worker(self, shard_id):
+        self.task_queues[shard_id] = self.context.Queue()
+        process = self.context.Process(
+            target=run_shard_worker,
+            args=(shard_id, self.assignments[shard_id], self.task_queues[shard_id], self.result_queue, LOG_FORMAT),
+            name=f'shard-{shard_id}',
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard_id] = process
+
+    def _read_results(self):
+        """Поток чтения результатов шардов: сообщения завершённых или отменённых тиков отбрасываются."""
+        while True:
+            message = self.result_queue.get()
+            if message is None:
+                return
+            tick = self.ticks.get(message[1])
+            if tick is not None:
+                loop, results = tick
+                loop.call_soon_threadsafe(results.put_nowait, message)
+
+    def start(self):
+        """Запускает процессы шардов и поток чтения их результатов."""
+        for shard_id in sorted(self.assignments):
+            self._start_worker(shard_id)
+        self.reader = threading.Thread(target=self._read_results, name='shard-results', daemon=True)
+        self.reader.start()
+        sizes = ', '.join(str(len(self.assignments[shard_id])) for shard_id in sorted(self.assignments))
+        logger.info(f"🧩 Запущено {len(self.processes)} шардов, символов в шардах: {sizes}.")
+
+    async def run_tick(self, pairs, on_signal):
+        """Запускает тик по парам pairs ({symbol: [timeframe, ...]}) в шардах этих символов.
+
+        on_signal(symbol, timeframe, signal) вызывается по мере прихода результатов.
+        """
+        self.tick_id += 1
+        tick_id = self.tick_id
+        results = asyncio.Queue()
+        self.ticks[tick_id] = (asyncio.get_running_loop(), results)
+        try:
+            pending = set()
+            for shard_id, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logger.error(f"❌ Шард {shard_id} завершился (код {process.exitcode}). Перезапускаю.")
+                    self._start_worker(shard_id)
+                shard_pairs = {symbol: pairs[symbol] for symbol in self.assignments[shard_id] if symbol in pairs}
+                if shard_pairs:
+                    self.task_queues[shard_id].put((tick_id, shard_pairs))
+                    pending.add(shard_id)
+
+            while pending:
+                kind, _, shard_id, payload = await results.get()
+                if kind == 'signal':
+                    on_signal(*payload)
+                else:
+                    pending.discard(shard_id)
+        finally:
+            # Результаты тика, не уложившегося в дедлайн, поток чтения дальше отбрасывает
+            del self.ticks[tick_id]
+
+    def stop(self):
+        """Останавливает шарды, давая им записать кэш свечей на диск."""
+        for task_queue in self.task_queues.values():
+            task_queue.put(None)
+        for process in self.processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.processes.clear()
+        if self.reader is not None:
+            self.result_queue.put(None)
+            self.reader.join()
+            self.reader = None
+
+shard_pool = None
+
+# ======================= Выбор ведущей реплики =======================
+
+class LeaderLease:
+    """Аренда ведущей реплики в общей базе SQLite.
+
+    Реплика становится ведущей, если аренды нет, она истекла или уже принадлежит ей, и продлевает её
+    каждые LEADER_RENEW_INTERVAL секунд. Если ведущая реплика упала, аренду через LEADER_LEASE_TTL
+    секунд забирает другая. Время хранится в секундах эпохи, поэтому часы реплик должны быть синхронизированы.
+    """
+
+    def __init__(self, path, holder, ttl):
+        self.path = path
+        self.holder = holder
+        self.ttl = ttl
+        self.expires = 0.0
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=ttl / 2)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS leader_lease (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL)')
+
+    @property
+    def held(self):
+        """Реплика — ведущая, пока не истекла её последняя успешно продлённая аренда."""
+        return time.time() < self.expires
+
+    def renew(self):
+        """Захватывает или продлевает аренду; возвращает True, если реплика ведущая."""
+        now = time.time()
+        try:
+            # BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому проверка и захват не разделяются другой репликой
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute("SELECT holder, expires FROM leader_lease WHERE name = 'leader'").fetchone()
+                if row is None or row[0] == self.holder or row[1] <= now:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO leader_lease (name, holder, expires) VALUES ('leader', ?, ?)",
+                        (self.holder, now + self.ttl),
+                    )
+                    self.expires = now + self.ttl
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"❌ Не удалось продлить аренду ведущей реплики: {e}")
+        return self.held
+
+    def release(self):
+        """Освобождает аренду, чтобы другая реплика стала ведущей, не дожидаясь её истечения."""
+        if self.held:
+            self.db.execute("DELETE FROM leader_lease WHERE name = 'leader' AND holder = ?", (self.holder,))
+        self.expires = 0.0
+        self.db.close()
+
+def is_leader():
+    """Проверяет, выполняет ли этот процесс задачи по расписанию (без выбора ведущей реплики — всегда)."""
+    return leader_lease is None or leader_lease.held
+
+def leader_only(callback):
+    """Оборачивает задачу по расписанию так, чтобы она выполнялась только на ведущей реплике."""
+    @functools.wraps(callback)
+    async def wrapper(context):
+        if is_leader():
+            await callback(context)
+    return wrapper
+
+async def renew_leader_lease_job(context: ContextTypes.DEFAULT_TYPE):
+    """Продлевает аренду; ставшая ведущей реплика прогревает кэши, потерявшая аренду — останавливает поток свечей."""
+    global _kline_stream_task, _leader_active
+    leader = await asyncio.to_thread(leader_lease.renew)
+    was_leader, _leader_active = _leader_active, leader
+    if leader and not was_leader:
+        logger.info(f"👑 Реплика {leader_lease.holder} стала ведущей.")
+        context.application.create_task(warm_start(context.application))
+    elif was_leader and not leader:
+        logger.warning(f"⚠️ Реплика {leader_lease.holder} потеряла аренду ведущей реплики.")
+        if _kline_stream_task is not None:
+            _kline_stream_task.cancel()
+            _kline_stream_task = None
+
+leader_lease = None
+_leader_active = False
+
+# ======================= Снимок состояния для быстрого перезапуска =======================
+
+def get_snapshot_file(shard_id=None):
+    """Возвращает путь к снимку состояния процесса (у каждого шарда свой снимок)."""
+    if shard_id is None:
+        return SNAPSHOT_FILE
+    base, ext = os.path.splitext(SNAPSHOT_FILE)
+    return f"{base}.shard{shard_id}{ext}"
+
+def serialize_snapshot():
+    """Сериализует кэш свечей, тренды, состояние индикаторов и разосланные сигналы.
+
+    Вызывается в цикле событий (или между тиками шарда), где меняется состояние индикаторов,
+    поэтому оно не меняется во время сериализации; записи кэша свечей потоки загрузки только заменяют.
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'storage_version': CANDLE_STORAGE_VERSION,
+        'created': datetime.now(timezone.utc),
+        'candle_cache': dict(candle_cache),
+        'candle_cache_dirty': dict(candle_cache_dirty),
+        'market_trends': dict(market_trends),
+        'indicator_states': dict(indicator_states),
+        'signal_evaluations': dict(signal_evaluations),
+        'sent_signals': dict(sent_signals),
+    }
+    return pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+
+def write_snapshot(path, data):
+    """Атомарно записывает сериализованный снимок на диск."""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    logger.info(f"📸 Снимок состояния записан в {path} ({len(data) / 1e6:.1f} МБ).")
+
+def save_snapshot(path):
+    """Сериализует и записывает снимок состояния процесса."""
+    try:
+        write_snapshot(path, serialize_snapshot())
+    except Exception as e:
+        logger.error(f"❌ Ошибка при записи снимка состояния {path}: {e}")
+
+def check_snapshot_candles(symbol, timeframe, df):
+    """Сверяет свечи снимка с хранилищем.
+
+    Возвращает (совпадает ли последняя свеча хранилища со свечой снимка,
+    время последней записанной свечи, если в снимке есть свечи новее неё, иначе None).
+    """
+    if not candle_store_exists(symbol, timeframe):
+        return False, None
+    stored = read_candles(symbol, timeframe, last_n=1)
+    if stored.empty:
+        return False, None
+    last_stored = stored.index[-1]
+    position = df.index.searchsorted(last_stored)
+    # Цена открытия не меняется, пока свеча формируется, поэтому по ней сверяется и незакрытая свеча
+    if position >= len(df) or df.index[position] != last_stored or df['open'].iloc[position] != stored['open'].iloc[-1]:
+        return False, None
+    return True, (last_stored if position < len(df) - 1 else None)
+
+def restore_snapshot(path, symbols):
+    """Восстанавливает состояние из снимка для символов symbols; возвращает количество восстановленных пар.
+
+    Свечи снимка сверяются с хранилищем: разошедшиеся пары загружаются из хранилища заново,
+    а свечи новее снимка догружаются обычным обновлением — запрашивается только разница.
+    """
+    if not os.path.exists(path):
+        return 0
+    started = time.monotonic()
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        logger.error(f"❌ Не удалось прочитать снимок состояния {path}: {e}")
+        return 0
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('storage_version') != CANDLE_STORAGE_VERSION:
+        logger.warning(f"⚠️ Снимок состояния {path} записан в другом формате. Пропускаю.")
+        return 0
+
+    symbols = set(symbols)
+    restored = 0
+    for key, df in snapshot['candle_cache'].items():
+        symbol, timeframe = key
+        if symbol not in symbols or timeframe not in TIMEFRAMES:
+            continue
+        with get_candle_cache_lock(symbol, timeframe):
+            # Пара уже загружена тиком, начавшимся раньше восстановления
+            if key in candle_cache:
+                continue
+            matches, unsaved_since = check_snapshot_candles(symbol, timeframe, df)
+            if not matches:
+                logger.warning(f"⚠️ Свечи {symbol} на таймфрейме {timeframe} в снимке расходятся с хранилищем. Загружаю из хранилища.")
+                continue
+            candle_cache[key] = df
+            dirty_since = [moment for moment in (snapshot['candle_cache_dirty'].get(key), unsaved_since) if moment is not None]
+            if dirty_since:
+                candle_cache_dirty[key] = min(dirty_since)
+            if key in snapshot['indicator_states']:
+                indicator_states[key] = snapshot['indicator_states'][key]
+            if key in snapshot['signal_evaluations']:
+                signal_evaluations[key] = snapshot['signal_evaluations'][key]
+        restored += 1
+
+    for symbol, trend in snapshot['market_trends'].items():
+        if symbol in symbols:
+            market_trends.setdefault(symbol, trend)
+    for key, sent in snapshot['sent_signals'].items():
+        if key[0] in symbols:
+            sent_signals.setdefault(key, sent)
+    age = datetime.now(timezone.utc) - snapshot['created']
+    logger.info(
+        f"♻️ Из снимка {path} (возраст {age.total_seconds():.0f} с) восстановлено {restored} пар "
+        f"и {len(market_trends)} трендов за {time.monotonic() - started:.2f} с."
+    )
+    return restored
+
+def record_startup_milestone(name):
+    """Запоминает время от запуска процесса до первого наступления события (первый ответ, первый тик)."""
+    if name in _startup_milestones:
+        return
+    elapsed = time.monotonic() - PROCESS_STARTED
+    _startup_milestones.add(name)
+    metrics.set(name, elapsed)
+    logger.info(f"⏱️ {METRIC_DEFINITIONS[name][1]}: {elapsed:.2f} с.")
+
+_startup_milestones = set()
+
+async def record_first_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмечает первый ответ на команду; выполняется после обработчика команды."""
+    record_startup_milestone('startup_first_reply_seconds')
+
+async def save_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача записи снимка: сериализация — в цикле событий, запись на диск — в отдельном потоке."""
+    try:
+        await asyncio.to_thread(write_snapshot, get_snapshot_file(), serialize_snapshot())
+    except Exception as e:
+        logger.error(f"❌ Ошибка при записи снимка состояния: {e}")
+
+# ======================= Поток свечей Binance (WebSocket) =======================
+
+# Фоновая задача чтения потока свечей и задачи анализа, запущенные из него
+_kline_stream_task = None
+_kline_analysis_tasks = set()
+
+def kline_event_to_kline(event):
+    """Преобразует свечу из события потока Binance в формат REST-ответа get_klines."""
+    k = event['k']
+    return [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T'], k['q'], k['n'], k['V'], k['Q'], k['B']]
+
+def apply_kline_update(symbol, timeframe, kline):
+    """Записывает обновление свечи из потока в кэш свечей."""
+    with get_candle_cache_lock(symbol, timeframe):
+        df = load_historical_data(symbol, timeframe)
+        if df.empty:
+            return
+        merge_candles(df, klines_to_dataframe([kline]), symbol, timeframe)
+
+def gap_fill_candles():
+    """Догружает через REST свечи, пропущенные, пока поток был отключён."""
+    backfill_universe(CRYPTO_SYMBOLS, TIMEFRAMES)
+
+async def analyze_closed_candle(application, symbol, timeframe):
+    """Анализирует пару после закрытия свечи и рассылает сигнал, если на пару кто-то подписан."""
+    refresh_subscribers()
+    if not get_subscription_index().wants(symbol, timeframe):
+        return
+    trend = await run_fetch(get_market_trend, symbol)
+    if trend is None:
+        logger.warning(f"⚠️ Не удалось определить тренд для {symbol}. Пропускаем.")
+        return
+    await process_symbol(application, symbol, timeframe, trend, refresh=False)
+    signal_dispatcher.schedule_flush(application.bot)
+    record_startup_milestone('startup_first_tick_seconds')
+
+async def handle_kline_message(application, message):
+    """Обрабатывает сообщение комбинированного потока: обновляет кэш и запускает анализ при закрытии свечи."""
+    event = message.get('data', message)
+    if event.get('e') != 'kline':
+        return
+    symbol, timeframe = event['s'], event['k']['i']
+    # Сообщения применяются по очереди, чтобы более старое обновление свечи не перезаписало новое
+    await run_fetch(apply_kline_update, symbol, timeframe, kline_event_to_kline(event))
+    closed_timeframes = [timeframe] if event['k']['x'] else []
+    if DERIVE_TIMEFRAMES and timeframe == get_base_timeframe():
+        closed_timeframes += await run_fetch(apply_derived_updates, symbol, event['k'])
+    for closed_timeframe in closed_timeframes:
+        task = asyncio.create_task(analyze_closed_candle(application, symbol, closed_timeframe))
+        _kline_analysis_tasks.add(task)
+        task.add_done_callback(_kline_analysis_tasks.discard)
+
+async def run_kline_stream(application):
+    """Читает комбинированный поток свечей Binance по всем CRYPTO_SYMBOLS и TIMEFRAMES, переподключаясь при обрыве.
+
+    Если старшие таймфреймы строятся из базового, подписка оформляется только на базовый таймфрейм.
+    """
+    timeframes = [get_base_timeframe()] if DERIVE_TIMEFRAMES else TIMEFRAMES
+    streams = [f"{symbol.lower()}@kline_{timeframe}" for symbol in CRYPTO_SYMBOLS for timeframe in timeframes]
+    url = f"{BINANCE_WS_URL}?streams={'/'.join(streams)}"
+    delay = 1
+    while True:
+        try:
+            async with websockets.connect(url, ping_interval=20) as websocket:
+                logger.info(f"🔌 Подключились к потоку свечей Binance ({len(streams)} потоков).")
+                delay = 1
+                # Поток уже подключён, поэтому после догрузки пропусков новых свечей не потеряем
+                await run_fetch(gap_fill_candles)
+                async for message in websocket:
+                    await handle_kline_message(application, json.loads(message))
+            logger.warning("⚠️ Поток свечей Binance закрыт сервером.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка потока свечей Binance: {e}")
+        logger.info(f"🔌 Переподключение к потоку свечей через {delay} с.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+
+async def flush_candle_cache_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача записи кэша свечей на диск."""
+    await asyncio.to_thread(flush_candle_cache)
+
+async def warm_start(application):
+    """Восстанавливает состояние из снимка, затем догружает историю или запускает чтение потока свечей."""
+    global _kline_stream_task
+    await run_fetch(restore_snapshot, get_snapshot_file(), CRYPTO_SYMBOLS)
+    if INGESTION_MODE == 'websocket':
+        # История загружается при подключении к потоку
+        _kline_stream_task = asyncio.create_task(run_kline_stream(application))
+    elif shard_pool is None:
+        # Шарды загружают историю своих символов сами
+        await run_fetch(backfill_universe, CRYPTO_SYMBOLS, TIMEFRAMES)
+
+async def on_startup(application):
+    """Запускает сервер метрик и прогрев в фоне, чтобы бот сразу отвечал на команды.
+
+    При выборе ведущей реплики прогрев запускает реплика, получившая аренду.
+    """
+    start_metrics_server()
+    if leader_lease is None:
+        application.create_task(warm_start(application))
+
+async def on_shutdown(application):
+    """Сохраняет несохранённые свечи и останавливает шарды и пулы выполнения при остановке бота."""
+    if _kline_stream_task is not None:
+        _kline_stream_task.cancel()
+    if shard_pool is not None:
+        shard_pool.stop()
+    flush_candle_cache()
+    # Снимок ведомой реплики пуст и не должен затирать снимок ведущей
+    if is_leader():
+        save_snapshot(get_snapshot_file())
+    shutdown_executors()
+    close_binance_client()
+    close_subscribers_db()
+    stop_metrics_server()
+    if leader_lease is not None:
+        leader_lease.release()
+    stop_logging()
+
+# ======================= Бэктест сигналов =======================
+
+# Горизонты форвардной доходности сигналов в бэктесте (в свечах таймфрейма)
+BACKTEST_HORIZONS = [1, 4, 12, 24]
+BACKTEST_OUTPUT = 'backtest_signals.csv'  # Файл со всеми историческими сигналами
+BACKTEST_WORKERS = os.cpu_count() or 1  # Количество процессов бэктеста (параллельно по символам)
+
+def load_backtest_candles(symbol, timeframe):
+    """Читает закрытые свечи пары из хранилища и архива; старший таймфрейм без своего хранилища строится из базового."""
+    df = read_full_history(symbol, timeframe)
+    if df.empty and is_derived_timeframe(timeframe):
+        base_df = read_full_history(symbol, get_base_timeframe())
+        if not base_df.empty:
+            df = resample_candles(base_df, timeframe)
+    return drop_forming_candle(df, timeframe)
+
+def compute_trend_series(trend_df, timestamps, timeframe):
+    """Определяет общий тренд (как get_market_trend) на момент закрытия каждой свечи timestamps.
+
+    trend_df — закрытые свечи TREND_TIMEFRAME; используется последняя из них, закрытая к этому моменту.
+    """
+    trend = classify_trend_series(trend_df['close'].to_numpy())
+
+    # Свеча тренда становится известной после закрытия, анализ свечи — после её закрытия
+    trend_available = (trend_df.index + get_timeframe_delta(TREND_TIMEFRAME)).as_unit('ms').asi8
+    evaluation_time = (timestamps + get_timeframe_delta(timeframe)).as_unit('ms').asi8
+    positions = np.searchsorted(trend_available, evaluation_time, side='right') - 1
+    return np.where(positions >= 0, trend[np.maximum(positions, 0)], 'sideways').astype(object)
+
+def backtest_signals(df, trend, symbol, timeframe):
+    """Вычисляет сигналы analyze_data для каждой свечи истории за один векторный проход.
+
+    trend — массив общего тренда на момент закрытия каждой свечи. Возвращает DataFrame сигналов
+    с доходностью в направлении сигнала на горизонтах BACKTEST_HORIZONS.
+    """
+    if len(df) < 2:
+        return pd.DataFrame()
+
+    latest = compute_indicators(df)
+    previous = latest.shift(1)
+    buy_votes, sell_votes = {}, {}
+    with np.errstate(invalid='ignore'):
+        for key, _, buy_condition, sell_condition in SIGNAL_RULES:
+            buy_votes[key] = np.asarray(buy_condition(latest, previous), dtype=bool)
+            sell_votes[key] = np.asarray(sell_condition(latest, previous), dtype=bool) & ~buy_votes[key]
+    buy_count = np.sum(list(buy_votes.values()), axis=0)
+    sell_count = np.sum(list(sell_votes.values()), axis=0)
+
+    # Первая свеча не анализируется: для неё нет предыдущей
+    strong_trend = ~(latest['ADX'].to_numpy() < ADX_TREND_THRESHOLD)
+    strong_trend[0] = False
+    is_long = strong_trend & (trend == 'uptrend') & (buy_count >= SIGNAL_VOTE_THRESHOLD)
+    is_short = strong_trend & (trend == 'downtrend') & (sell_count >= SIGNAL_VOTE_THRESHOLD)
+    positions = np.flatnonzero(is_long | is_short)
+
+    votes = np.where(is_long, buy_count, sell_count)[positions]
+    direction = np.where(is_long[positions], 'LONG', 'SHORT')
+    patterns = latest['Candlestick_Pattern'].to_numpy()[positions]
+    indicators = []
+    for row, position in enumerate(positions):
+        voted = buy_votes if is_long[position] else sell_votes
+        indicators.append(', '.join(
+            name.format(pattern=patterns[row]) for key, name, _, _ in SIGNAL_RULES if voted[key][position]))
+
+    signals = pd.DataFrame({
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'direction': direction,
+        'votes': votes,
+        'indicators': indicators,
+        'close': latest['close'].to_numpy()[positions],
+    }, index=df.index[positions])
+
+    # Доходность в направлении сигнала (для ШОРТ — с обратным знаком)
+    close = latest['close'].to_numpy()
+    sign = np.where(direction == 'LONG', 1.0, -1.0)
+    for horizon in BACKTEST_HORIZONS:
+        future = np.full(len(positions), np.nan)
+        available = positions + horizon < len(close)
+        future[available] = close[positions[available] + horizon]
+        signals[f'return_{horizon}'] = sign * (future / close[positions] - 1)
+    return signals
+
+def backtest_symbol(symbol, timeframes):
+    """Бэктест одного символа по всем таймфреймам (выполняется в отдельном процессе)."""
+    trend_df = load_backtest_candles(symbol, TREND_TIMEFRAME)
+    results = []
+    bars = 0
+    for timeframe in timeframes:
+        df = load_backtest_candles(symbol, timeframe)
+        bars += len(df)
+        if len(df) < 2 or len(trend_df) < 200:
+            continue
+        trend = compute_trend_series(trend_df, df.index, timeframe)
+        results.append(backtest_signals(df, trend, symbol, timeframe))
+    results = [signals for signals in results if not signals.empty]
+    return (pd.concat(results) if results else pd.DataFrame()), bars
+
+def summarize_backtest(signals):
+    """Сводная статистика сигналов: количество, средняя доходность и доля прибыльных на каждом горизонте."""
+    aggregations = {'signals': ('votes', 'size')}
+    for horizon in BACKTEST_HORIZONS:
+        column = f'return_{horizon}'
+        aggregations[f'mean_{horizon}'] = (column, 'mean')
+        aggregations[f'hit_rate_{horizon}'] = (column, lambda returns: (returns.dropna() > 0).mean())
+    return signals.groupby(['symbol', 'timeframe', 'direction']).agg(**aggregations)
+
+def run_backtest(symbols=None, timeframes=None, output=BACKTEST_OUTPUT):
+    """Прогоняет логику сигналов по всей сохранённой истории и записывает сигналы в CSV."""
+    symbols = symbols or CRYPTO_SYMBOLS
+    timeframes = timeframes or TIMEFRAMES
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max(1, min(BACKTEST_WORKERS, len(symbols)))) as executor:
+        results = list(executor.map(backtest_symbol, symbols, [timeframes] * len(symbols)))
+    elapsed = time.monotonic() - started
+
+    bars = sum(symbol_bars for _, symbol_bars in results)
+    frames = [signals for signals, _ in results if not signals.empty]
+    if not frames:
+        logger.warning(f"⚠️ Бэктест: сигналов нет ({bars} свечей за {elapsed:.2f} с).")
+        return pd.DataFrame()
+    signals = pd.concat(frames)
+    signals.to_csv(output, index_label='timestamp')
+    logger.info(
+        f"🧪 Бэктест: {len(signals)} сигналов по {bars} свечам за {elapsed:.2f} с "
+        f"({bars / max(elapsed, 1e-9):.0f} свечей/с), сигналы записаны в {output}.")
+    logger.info(f"🧪 Статистика сигналов:\n{summarize_backtest(signals).to_string()}")
+    return signals
 
 # ======================= Основная Функция =======================
 
 def main():
     """Основная функция для запуска бота."""
+    global CRYPTO_SYMBOLS, shard_pool, leader_lease
+    # Переносим CSV-файлы, оставшиеся от прежнего формата хранения, и обновляем формат хранилищ
+    migrate_csv_storage()
+    migrate_candle_storage()
+
+    CRYPTO_SYMBOLS = load_universe()
+
+    # Шарды запускаются через spawn, поэтому потоки фронтенда в их процессы не копируются
+    if SHARD_WORKERS > 0 and INGESTION_MODE != 'websocket':
+        shard_pool = ShardPool(CRYPTO_SYMBOLS, SHARD_WORKERS)
+        shard_pool.start()
+
+    # Журнал пишется фоновым потоком через очередь
+    setup_logging()
+
+    if LEADER_ELECTION:
+        leader_lease = LeaderLease(LEADER_LEASE_DB, REPLICA_ID, LEADER_LEASE_TTL)
+
     # Создание приложения Telegram
-    application = ApplicationBuilder().token(API_TOKEN).build()
+    application = ApplicationBuilder().token(API_TOKEN).base_url(TELEGRAM_API_URL).post_init(on_startup).post_shutdown(on_shutdown).build()
 
     # Добавление обработчиков команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("stop", stop))
+    application.add_handler(CommandHandler("subscriptions", subscriptions_command))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+
+    # Отметка первого ответа: группа 1 обрабатывается после команд из группы 0
+    application.add_handler(MessageHandler(filters.COMMAND, record_first_reply), group=1)
 
     # Добавление обработчика ошибок
     application.add_error_handler(error_handler)
 
-    # Настройка задачи, которая выполняется каждую минуту
+    # Анализ запускается после закрытия свечей (в режиме WebSocket — событием закрытия свечи из потока)
+    # Задачи по расписанию есть на всех репликах, но выполняются только на ведущей
     job_queue = application.job_queue
-    job_queue.run_repeating(send_signal, interval=60, first=10)  # Период: 60 секунд, запуск через 10 секунд
+    if INGESTION_MODE != 'websocket':
+        job_queue.run_repeating(leader_only(send_signal), interval=get_schedule_step(), first=get_next_schedule_time())
+    job_queue.run_repeating(leader_only(flush_candle_cache_job), interval=CANDLE_CACHE_FLUSH_INTERVAL, first=CANDLE_CACHE_FLUSH_INTERVAL)
+    job_queue.run_repeating(leader_only(save_snapshot_job), interval=SNAPSHOT_INTERVAL, first=SNAPSHOT_INTERVAL)
+    if leader_lease is not None:
+        job_queue.run_repeating(renew_leader_lease_job, interval=LEADER_RENEW_INTERVAL, first=0)
 
     # Запуск бота
-    logger.info("🚀 Бот запущен и готов к работе.")
-    application.run_polling()
+    logger.info(f"🚀 Бот запущен и готов к работе (приём обновлений: {UPDATE_MODE}).")
+    if UPDATE_MODE == 'webhook':
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL or None,
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+        )
+    else:
+        application.run_polling()
 
 # ======================= Запуск Бота =======================
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Телеграм-бот торговых сигналов по криптовалютам.')
+    parser.add_argument('--update-mode', choices=['polling', 'webhook'], default=UPDATE_MODE, help='Способ приёма обновлений Telegram')
+    parser.add_argument('--webhook-port', type=int, default=WEBHOOK_PORT, help='Порт HTTP-сервера вебхука')
+    parser.add_argument('--leader-election', action='store_true', default=LEADER_ELECTION, help='Выполнять задачи по расписанию только на ведущей реплике')
+    parser.add_argument('--log-format', choices=['text', 'json'], default=LOG_FORMAT, help='Формат журнала')
+    subparsers = parser.add_subparsers(dest='command')
+    backtest_parser = subparsers.add_parser('backtest', help='Прогнать сигналы по сохранённой истории')
+    backtest_parser.add_argument('--symbols', nargs='+', help='Символы (по умолчанию CRYPTO_SYMBOLS)')
+    backtest_parser.add_argument('--timeframes', nargs='+', help='Таймфреймы (по умолчанию TIMEFRAMES)')
+    backtest_parser.add_argument('--output', default=BACKTEST_OUTPUT, help='CSV-файл для сигналов')
+    args = parser.parse_args()
+
+    if args.command == 'backtest':
+        run_backtest(args.symbols, args.timeframes, args.output)
+    else:
+        UPDATE_MODE, WEBHOOK_PORT, LEADER_ELECTION = args.update_mode, args.webhook_port, args.leader_election
+        LOG_FORMAT = args.log_format
+        main()
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""Общие настройки проверок.
+
+Бот при импорте создаёт директорию хранилища, а при работе — базы подписчиков и снимки,
+поэтому проверки выполняются во временной директории. Заглушки Binance и свечи берутся из benchmark.py.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix='bot-tests-'))
@@ -0,0 +1,45 @@
+"""Реплика бота для проверки выбора ведущей реплики (запускается отдельным процессом из test_leader_election.py).
+
+    python leader_replica.py TELEGRAM_URL BINANCE_URL WEBHOOK_PORT MARKER_FILE
+
+Бот принимает обновления вебхуком и планирует send_signal каждую секунду; каждый запуск
+send_signal дописывает в MARKER_FILE строку «REPLICA_ID время».
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+
+
+def main():
+    telegram_url, binance_url, port, marker_file = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4]
+    bot.TELEGRAM_API_URL = telegram_url
+    bot.BINANCE_API_URL = binance_url
+    bot.CRYPTO_SYMBOLS = ['BTCUSDT']
+    bot.METRICS_PORT = 0
+    bot.ANALYSIS_WORKERS = 0
+    bot.UPDATE_MODE = 'webhook'
+    bot.WEBHOOK_LISTEN = '127.0.0.1'
+    bot.WEBHOOK_PORT = port
+    bot.LEADER_ELECTION = True
+    bot.REPLICA_ID = f'replica-{port}'
+    # Тик каждую секунду вместо закрытия свечей
+    bot.SIGNAL_GRACE_DELAY = 0
+    bot.get_schedule_step = lambda: 1
+    send_signal = bot.send_signal
+
+    async def marked_send_signal(context):
+        with open(marker_file, 'a', encoding='utf-8') as f:
+            f.write(f'{bot.REPLICA_ID} {time.time()}\n')
+        await send_signal(context)
+
+    bot.send_signal = marked_send_signal
+    bot.main()
+
+
+if __name__ == '__main__':
+    main()
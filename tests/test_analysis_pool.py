@@ -0,0 +1,27 @@
+"""Пул процессов расчёта: рабочие процессы не копируют многопоточный процесс бота."""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import bot
+from benchmark import synthetic_candles
+
+
+@pytest.fixture
+def analysis_pool(monkeypatch):
+    monkeypatch.setattr(bot, 'ANALYSIS_WORKERS', 1)
+    monkeypatch.setattr(bot, '_analysis_executor', None)
+    yield
+    bot._analysis_executor.shutdown()
+
+
+def test_workers_do_not_fork_and_compute_like_main_process(analysis_pool):
+    df = synthetic_candles('BTCUSDT', '15m', 1_600_000_000_000 // 900_000 * 900_000, 500)
+    args = (df.index, *(df[col].to_numpy(dtype='float64') for col in ('open', 'high', 'low', 'close', 'volume')))
+    _, remote = asyncio.run(bot.run_analysis(bot.build_indicator_state, *args))
+    assert bot.get_analysis_executor()._mp_context.get_start_method() != 'fork'
+    _, local = bot.build_indicator_state(*args)
+    assert remote.keys() == local.keys()
+    np.testing.assert_array_equal(np.array(list(remote.values()), dtype=float), np.array(list(local.values()), dtype=float))
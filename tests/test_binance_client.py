@@ -0,0 +1,102 @@
+"""BinanceRestClient против мока REST API с ошибками, Retry-After и заголовком веса."""
+
+import asyncio
+import time
+
+import pytest
+
+import bot
+from benchmark import FakeBinanceHandler, FakeBinanceServer
+
+BASE_DELAY = 0.05
+RETRY_AFTER = 1
+TOLERANCE = 0.02  # Погрешность таймеров (в секундах)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeBinanceServer()
+    monkeypatch.setattr(bot, 'BINANCE_RETRY_BASE_DELAY', BASE_DELAY)
+    monkeypatch.setattr(bot, 'BINANCE_MAX_RETRIES', 3)
+    # Верхняя граница случайного разброса, чтобы паузы были предсказуемы
+    monkeypatch.setattr(bot.random, 'uniform', lambda low, high: high)
+    yield server
+    server.close()
+
+
+def get_klines(server, client=None):
+    """Запрашивает свечи новым (или переданным) клиентом; возвращает (клиент, результат или исключение)."""
+    client = client or bot.BinanceRestClient(server.url)
+
+    async def run():
+        try:
+            return await client.get_klines('BTCUSDT', '1h', limit=5)
+        except bot.BinanceRequestError as e:
+            return e
+        finally:
+            await client.close()
+
+    return client, asyncio.run(run())
+
+
+def gaps(server):
+    times = server.request_times
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_server_errors_are_retried_with_exponential_backoff(server):
+    server.inject(500)
+    server.inject(502)
+    server.inject(503)
+    retries = bot.metrics.get('binance_retries_total')
+    _, klines = get_klines(server)
+    assert len(klines) == 5
+    assert bot.metrics.get('binance_retries_total') - retries == 3
+    for gap, delay in zip(gaps(server), [BASE_DELAY, 2 * BASE_DELAY, 4 * BASE_DELAY]):
+        assert gap >= delay - TOLERANCE
+
+
+def test_gives_up_after_max_retries(server):
+    for _ in range(bot.BINANCE_MAX_RETRIES + 1):
+        server.inject(500)
+    _, error = get_klines(server)
+    assert isinstance(error, bot.BinanceRequestError)
+    assert len(server.request_times) == bot.BINANCE_MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried(server):
+    server.inject(400, {'code': -1121, 'msg': 'Invalid symbol.'})
+    _, error = get_klines(server)
+    assert isinstance(error, bot.BinanceRequestError)
+    assert (error.status, error.code) == (400, -1121)
+    assert len(server.request_times) == 1
+
+
+@pytest.mark.parametrize('status', [429, 418])
+def test_rate_limit_pauses_for_retry_after(server, status):
+    server.inject(status, Retry_After=RETRY_AFTER)
+    started = time.time()
+    client, klines = get_klines(server)
+    assert len(klines) == 5
+    gap, = gaps(server)
+    assert gap >= RETRY_AFTER - TOLERANCE
+    # Пауза записана в ограничитель веса: её соблюдают и другие запросы того же клиента
+    assert started + RETRY_AFTER - TOLERANCE <= client.limiter.paused_until <= time.time()
+
+
+def test_limiter_follows_used_weight_header(server, monkeypatch):
+    monkeypatch.setattr(bot, 'BINANCE_WEIGHT_PER_MINUTE', 100)
+    # Вес, сообщённый биржей, включает запросы других процессов с того же IP
+    FakeBinanceHandler.used_weight = 95
+    if 60 - time.time() % 60 < 2:
+        time.sleep(60 - time.time() % 60)
+    client, _ = get_klines(server)
+    assert client.limiter.used == 95
+    assert bot.metrics.get('binance_used_weight') == 95
+
+    async def acquire():
+        await asyncio.wait_for(client.limiter.acquire(bot.KLINES_REQUEST_WEIGHT * 5), 0.5)
+
+    # До конца минуты бюджета не хватает: запрос ждёт следующей минуты
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(acquire())
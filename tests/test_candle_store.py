@@ -0,0 +1,47 @@
+"""Колоночное хранилище свечей: перезапись хвоста при живых отображениях файлов в память."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bot
+from benchmark import interval_ms, synthetic_candles
+
+SYMBOL, TIMEFRAME = 'BTCUSDT', '1h'
+FIRST_OPEN = 1_600_000_000_000 // interval_ms(TIMEFRAME) * interval_ms(TIMEFRAME)
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'DATA_DIR', str(tmp_path / 'historical_data'))
+    monkeypatch.setattr(bot, 'candle_cache', {})
+    bot.append_candles(SYMBOL, TIMEFRAME, synthetic_candles(SYMBOL, TIMEFRAME, FIRST_OPEN, 100))
+
+
+def shifted_tail(start, count):
+    """Свечи с номера start, отличающиеся от уже записанных."""
+    df = synthetic_candles(SYMBOL, TIMEFRAME, FIRST_OPEN + start * interval_ms(TIMEFRAME), count)
+    df['close'] *= 2
+    return df
+
+
+def test_shorter_overwrite_does_not_break_mapped_reader():
+    mapped = bot.read_candles(SYMBOL, TIMEFRAME)
+    before = mapped['close'].to_numpy().copy()
+    # Хвост из 10 свечей заменяется тремя: файлы колонок становятся короче
+    bot.append_candles(SYMBOL, TIMEFRAME, shifted_tail(90, 3))
+    # Прежнее отображение читается целиком (при обрезке файла на месте здесь был бы SIGBUS)
+    np.testing.assert_array_equal(mapped['close'].to_numpy(), before)
+    stored = bot.read_candles(SYMBOL, TIMEFRAME)
+    assert len(stored) == 93
+    np.testing.assert_array_equal(stored['close'].to_numpy()[:90], before[:90])
+    np.testing.assert_array_equal(stored['close'].to_numpy()[90:], shifted_tail(90, 3)['close'].to_numpy())
+
+
+def test_cached_candles_do_not_change_when_store_is_rewritten():
+    cached = bot.load_historical_data(SYMBOL, TIMEFRAME)
+    before = cached.copy()
+    bot.append_candles(SYMBOL, TIMEFRAME, shifted_tail(95, 10))
+    bot.append_candles(SYMBOL, TIMEFRAME, shifted_tail(80, 2))
+    pd.testing.assert_frame_equal(bot.candle_cache[(SYMBOL, TIMEFRAME)], before)
+    assert len(bot.read_candles(SYMBOL, TIMEFRAME)) == 82
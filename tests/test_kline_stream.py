@@ -0,0 +1,115 @@
+"""Режим WebSocket: run_kline_stream против локального потока свечей, воспроизводящего записанные события."""
+
+import asyncio
+import types
+
+import pandas as pd
+import pytest
+
+import bot
+from benchmark import (FakeBinanceServer, FakeBinanceStream, FakeBot, candles_to_kline_events, interval_ms,
+                       synthetic_candles)
+
+SYMBOL = 'BTCUSDT'
+BASE, DERIVED = '15m', '1h'
+DROPPED = 4  # Сколько последних свечей «теряется» во время обрыва и должно вернуться после переподключения
+
+
+@pytest.fixture
+def stream_bot(tmp_path, monkeypatch):
+    """Бот в режиме WebSocket с пустыми кэшами, хранилищем во временной директории и моком REST API."""
+    server = FakeBinanceServer()
+    bot.close_binance_client()
+    monkeypatch.setattr(bot, 'BINANCE_API_URL', server.url)
+    monkeypatch.setattr(bot, 'DATA_DIR', str(tmp_path / 'historical_data'))
+    monkeypatch.setattr(bot, 'CANDLE_ARCHIVE_DIR', str(tmp_path / 'historical_data_archive'))
+    monkeypatch.setattr(bot, 'SUBSCRIBERS_DB', str(tmp_path / 'subscribers.db'))
+    monkeypatch.setattr(bot, 'CRYPTO_SYMBOLS', [SYMBOL])
+    monkeypatch.setattr(bot, 'TIMEFRAMES', [BASE, DERIVED])
+    monkeypatch.setattr(bot, 'DERIVE_TIMEFRAMES', True)
+    # Переподключение происходит сразу, поэтому догрузка не должна брать результат предыдущего запроса
+    monkeypatch.setattr(bot, 'FETCH_FRESHNESS_WINDOW', 0)
+    for name in ('candle_cache', 'candle_cache_dirty', 'candle_cache_locks', '_fetch_inflight', '_fetch_results',
+                 'market_trends', 'indicator_states', 'signal_evaluations'):
+        monkeypatch.setattr(bot, name, {})
+    for name in ('_subscribers', '_subscription_index', '_subscribers_db', '_subscribers_version'):
+        monkeypatch.setattr(bot, name, None)
+    analyzed = []
+
+    async def analyze_closed_candle(application, symbol, timeframe):
+        analyzed.append((symbol, timeframe, bot.candle_cache[(symbol, timeframe)].index))
+        await original(application, symbol, timeframe)
+
+    original = bot.analyze_closed_candle
+    monkeypatch.setattr(bot, 'analyze_closed_candle', analyze_closed_candle)
+    yield analyzed
+    bot.close_subscribers_db()
+    bot.close_binance_client()
+    server.close()
+
+
+async def wait_until(condition, timeout=30):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'не дождались'
+        await asyncio.sleep(0.05)
+
+
+def test_stream_updates_cache_analyzes_closes_and_gap_fills(stream_bot, monkeypatch):
+    analyzed = stream_bot
+    base_ms, derived_ms = interval_ms(BASE), interval_ms(DERIVED)
+    forming_open = int(pd.Timestamp.now(tz='UTC').timestamp() * 1000) // base_ms * base_ms
+    hour_open = forming_open // derived_ms * derived_ms
+    # Базовые свечи от текущей до закрывающей час: последняя закрывает и свечу старшего таймфрейма
+    closing = synthetic_candles(SYMBOL, BASE, forming_open, (hour_open + derived_ms - forming_open) // base_ms)
+    forming = closing.iloc[:1].copy()
+    forming['close'] *= 1.01
+    key = (SYMBOL, BASE)
+    forming_time = closing.index[0]
+    dropped = []
+
+    async def on_disconnect(number):
+        # Первая сессия обновила формирующуюся свечу; перед обрывом «теряем» последние свечи кэша
+        await wait_until(lambda: key in bot.candle_cache and bot.candle_cache[key]['close'].iloc[-1] == forming['close'].iloc[0])
+        assert bot.candle_cache[key].index[-1] == forming_time
+        with bot.get_candle_cache_lock(*key):
+            dropped.extend(bot.candle_cache[key].index[-DROPPED:])
+            bot.candle_cache[key] = bot.candle_cache[key].iloc[:-DROPPED]
+
+    async def scenario():
+        stream = await FakeBinanceStream(
+            [candles_to_kline_events(forming, SYMBOL, BASE, closed=False),
+             candles_to_kline_events(closing, SYMBOL, BASE, closed=True)],
+            on_disconnect=on_disconnect,
+        ).start()
+        monkeypatch.setattr(bot, 'BINANCE_WS_URL', stream.url)
+        task = asyncio.create_task(bot.run_kline_stream(types.SimpleNamespace(bot=FakeBot())))
+        try:
+            await asyncio.wait_for(stream.replayed.wait(), 60)
+            await wait_until(lambda: len(analyzed) == len(closing) + 1)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await stream.close()
+        return stream
+
+    stream = asyncio.run(scenario())
+
+    # Подписка только на базовый таймфрейм, после обрыва — повторное подключение
+    assert stream.connections == [[f'{SYMBOL.lower()}@kline_{BASE}']] * 2
+    # Закрытие каждой базовой свечи запускает анализ, закрытие часа — ещё и анализ старшего таймфрейма
+    hour_time = pd.Timestamp(hour_open, unit='ms', tz='UTC')
+    assert [(symbol, timeframe) for symbol, timeframe, _ in analyzed] == [(SYMBOL, BASE)] * len(closing) + [(SYMBOL, DERIVED)]
+    # К началу анализа закрытая свеча уже в кэше (задачи анализа идут параллельно с приёмом следующих событий)
+    for (_, _, index), timestamp in zip(analyzed, [*closing.index, hour_time]):
+        assert timestamp in index
+    base_df = bot.candle_cache[key]
+    # Потерянные свечи догружены через REST, записанные из потока совпадают с событиями
+    assert set(dropped) <= set(base_df.index)
+    reference = synthetic_candles(SYMBOL, BASE, int(dropped[0].timestamp() * 1000), DROPPED - 1 + len(closing))
+    pd.testing.assert_series_equal(base_df['close'].loc[reference.index], reference['close'], check_freq=False)
+    hour = bot.resample_candles(reference.loc[reference.index >= hour_time], DERIVED)
+    derived_df = bot.candle_cache[(SYMBOL, DERIVED)]
+    assert derived_df.index[-1] == hour_time
+    for column in ('open', 'high', 'low', 'close', 'volume'):
+        assert derived_df[column].iloc[-1] == pytest.approx(hour[column].iloc[-1])
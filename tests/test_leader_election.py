@@ -0,0 +1,188 @@
+"""Выбор ведущей реплики: две реплики с общей арендой SQLite в отдельных процессах."""
+
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import bot
+from benchmark import FakeBinanceServer, FakeTelegramServer
+
+REPLICA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leader_replica.py')
+STARTUP_TIMEOUT = 30
+SCHEDULE_STEP = 1  # Интервал send_signal в leader_replica.py
+# Аренда упавшей реплики истекает не позже чем через LEADER_LEASE_TTL, а другая реплика замечает это при очередном продлении
+TAKEOVER_LIMIT = bot.LEADER_LEASE_TTL + bot.LEADER_RENEW_INTERVAL
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Replicas:
+    """Процессы реплик в рабочей директории и чтение их общих следов: аренды и журнала запусков send_signal."""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.telegram = FakeTelegramServer()
+        self.binance = FakeBinanceServer()
+        self.marker_file = workdir / 'send_signal.log'
+        self.processes = {}
+        self.update_id = 0
+
+    def start(self):
+        port = free_port()
+        log = open(self.workdir / f'replica-{port}.log', 'w')
+        self.processes[f'replica-{port}'] = subprocess.Popen(
+            [sys.executable, REPLICA, self.telegram.url, self.binance.url, str(port), str(self.marker_file)],
+            cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT,
+        )
+        return f'replica-{port}'
+
+    def command(self, replica, chat_id, text):
+        """Отправляет команду чата в вебхук реплики и возвращает ответ бота."""
+        self.update_id += 1
+        replies = len(self.replies(chat_id))
+        update = {'update_id': self.update_id, 'message': {
+            'message_id': self.update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+        }}
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{replica.rsplit('-', 1)[1]}/{bot.WEBHOOK_PATH}",
+            data=json.dumps(update).encode(), headers={'Content-Type': 'application/json'},
+        )
+        self.wait_for(lambda: self._post(request), STARTUP_TIMEOUT, f'вебхук {replica}')
+        return self.wait_for(lambda: self.replies(chat_id)[replies:], 10, f'ответ на {text}')[0]
+
+    @staticmethod
+    def _post(request):
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status == 200
+        except (urllib.error.URLError, ConnectionError):
+            return False
+
+    def replies(self, chat_id):
+        return [text for _, chat, text in self.telegram.sent if chat == chat_id]
+
+    def subscriptions(self, chat_id):
+        db = sqlite3.connect(self.workdir / bot.SUBSCRIBERS_DB)
+        try:
+            return db.execute('SELECT symbol, timeframe FROM subscriptions WHERE chat_id = ?', (chat_id,)).fetchall()
+        finally:
+            db.close()
+
+    def lease_holder(self):
+        """Реплика, последней захватившая аренду, или None."""
+        try:
+            db = sqlite3.connect(self.workdir / 'leader.db')
+            try:
+                row = db.execute("SELECT holder FROM leader_lease WHERE name = 'leader'").fetchone()
+            finally:
+                db.close()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row is not None else None
+
+    def send_signal_runs(self, since=0.0):
+        """Запуски send_signal после момента since: список (реплика, время)."""
+        if not self.marker_file.exists():
+            return []
+        runs = [line.split() for line in self.marker_file.read_text(encoding='utf-8').splitlines() if line]
+        return [(replica, float(at)) for replica, at in runs if float(at) >= since]
+
+    def wait_for(self, condition, timeout, what):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            result = condition()
+            if result:
+                return result
+            time.sleep(0.1)
+        pytest.fail(f"Не дождались: {what}\n{self.logs()}")
+
+    def logs(self):
+        return '\n'.join(f"--- {path.name}\n{path.read_text(errors='replace')[-3000:]}"
+                         for path in sorted(self.workdir.glob('replica-*.log')))
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        self.telegram.close()
+        self.binance.close()
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    replicas = Replicas(tmp_path)
+    replicas.start()
+    replicas.start()
+    yield replicas
+    replicas.stop()
+
+
+def wait_for_single_leader(replicas):
+    """Дожидается ведущей реплики и проверяет, что send_signal выполняет только она."""
+    leader = replicas.wait_for(replicas.lease_holder, STARTUP_TIMEOUT, 'ведущая реплика')
+    replicas.wait_for(lambda: len(replicas.send_signal_runs()) >= 3, STARTUP_TIMEOUT, 'запуски send_signal')
+    time.sleep(2 * SCHEDULE_STEP)
+    assert replicas.lease_holder() == leader
+    assert {replica for replica, _ in replicas.send_signal_runs()} == {leader}, replicas.logs()
+    follower, = set(replicas.processes) - {leader}
+    return leader, follower
+
+
+def assert_takeover(replicas, leader, follower, stopped_at):
+    """Проверяет, что ведомая реплика забрала аренду за TAKEOVER_LIMIT и send_signal выполняет только она."""
+    replicas.wait_for(lambda: replicas.lease_holder() == follower, TAKEOVER_LIMIT + 5, 'передача аренды')
+    takeover = time.time() - stopped_at
+    assert takeover <= TAKEOVER_LIMIT, f"Аренда перешла через {takeover:.1f} с"
+    first_run = replicas.wait_for(
+        lambda: [at for replica, at in replicas.send_signal_runs(stopped_at) if replica == follower],
+        SCHEDULE_STEP + 5, 'send_signal на новой ведущей реплике')[0]
+    assert first_run - stopped_at <= TAKEOVER_LIMIT + SCHEDULE_STEP
+    time.sleep(2 * SCHEDULE_STEP)
+    assert [at for replica, at in replicas.send_signal_runs(first_run) if replica != follower] == []
+
+
+def test_follower_takes_over_after_kill(replicas):
+    leader, follower = wait_for_single_leader(replicas)
+    stopped_at = time.time()
+    replicas.processes[leader].send_signal(signal.SIGKILL)
+    replicas.processes[leader].wait()
+    assert_takeover(replicas, leader, follower, stopped_at)
+
+
+def test_follower_takes_over_after_sigterm(replicas):
+    leader, follower = wait_for_single_leader(replicas)
+    stopped_at = time.time()
+    replicas.processes[leader].send_signal(signal.SIGTERM)
+    assert_takeover(replicas, leader, follower, stopped_at)
+    assert replicas.processes[leader].wait(timeout=10) == 0
+
+
+def test_commands_see_subscriptions_changed_on_other_replica(replicas):
+    """/stop на реплике, которая не обрабатывала /start, отписывает чат (вебхуки приходят на любую реплику)."""
+    leader, follower = wait_for_single_leader(replicas)
+    chat_id = 42
+    # Ведомая реплика загружает подписки до /start и сама send_signal не запускает
+    assert 'не подписаны' in replicas.command(follower, chat_id, '/subscriptions')
+    assert 'подписались' in replicas.command(leader, chat_id, '/start')
+    assert replicas.subscriptions(chat_id) == [('*', '*')]
+    assert 'отписались' in replicas.command(follower, chat_id, '/stop')
+    assert replicas.subscriptions(chat_id) == []
+    assert 'не подписаны' in replicas.command(leader, chat_id, '/subscriptions')
+    assert 'подписались' in replicas.command(follower, chat_id, '/start BTCUSDT')
+    assert 'BTCUSDT' in replicas.command(leader, chat_id, '/subscriptions')
@@ -0,0 +1,87 @@
+"""Пул шардов: процессы запускаются через spawn, результаты отменённого тика не достаются следующему."""
+
+import asyncio
+import queue
+
+import pytest
+
+import bot
+
+
+class FakeShard:
+    """Процесс шарда, которым управляет тест: задачи тиков остаются в его очереди."""
+
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        self.alive = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    started = []
+
+    def start_worker(self, shard_id):
+        self.task_queues[shard_id] = queue.Queue()
+        self.processes[shard_id] = FakeShard()
+        started.append(shard_id)
+
+    monkeypatch.setattr(bot.ShardPool, '_start_worker', start_worker)
+    pool = bot.ShardPool(['BTCUSDT'], 1)
+    pool.started = started
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+async def next_task(pool):
+    # Перезапуск шарда заменяет его очередь задач, поэтому она берётся из пула на каждой проверке
+    while pool.task_queues[0].empty():
+        await asyncio.sleep(0.01)
+    return pool.task_queues[0].get()
+
+
+def test_shards_are_spawned(pool):
+    assert pool.context.get_start_method() == 'spawn'
+
+
+def test_cancelled_tick_does_not_swallow_next_tick_results(pool):
+    signals = []
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.run_tick({'BTCUSDT': ['15m']}, lambda *signal: signals.append(signal)), 0.1)
+        # Отменённый тик не должен оставить чтения, которое заберёт результаты следующего
+        tick = asyncio.create_task(pool.run_tick({'BTCUSDT': ['15m']}, lambda *signal: signals.append(signal)))
+        assert (await next_task(pool))[0] == 1
+        assert (await next_task(pool))[0] == 2
+        pool.result_queue.put(('signal', 2, 0, ('BTCUSDT', '15m', 'fresh')))
+        pool.result_queue.put(('done', 2, 0, None))
+        await asyncio.wait_for(tick, 5)
+        # Опоздавшие результаты отменённого тика отбрасываются
+        pool.result_queue.put(('signal', 1, 0, ('BTCUSDT', '15m', 'stale')))
+        pool.result_queue.put(('done', 1, 0, None))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert signals == [('BTCUSDT', '15m', 'fresh')]
+    assert pool.ticks == {}
+
+
+def test_dead_shard_is_restarted_before_tick(pool):
+    pool.processes[0].alive = False
+
+    async def scenario():
+        tick = asyncio.create_task(pool.run_tick({'BTCUSDT': ['1h']}, None))
+        assert await next_task(pool) == (1, {'BTCUSDT': ['1h']})
+        pool.result_queue.put(('done', 1, 0, None))
+        await asyncio.wait_for(tick, 5)
+
+    asyncio.run(scenario())
+    assert pool.started == [0, 0]
+    assert pool.processes[0].is_alive()
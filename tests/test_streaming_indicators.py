@@ -0,0 +1,94 @@
+"""Потоковые индикаторы (StreamingIndicatorState) против эталонной реализации ta."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from ta.momentum import RSIIndicator, StochasticOscillator
+from ta.trend import ADXIndicator, EMAIndicator, MACD, SMAIndicator
+from ta.volatility import AverageTrueRange, BollingerBands
+from ta.volume import MFIIndicator, OnBalanceVolumeIndicator
+
+import bot
+from benchmark import interval_ms, synthetic_candles
+
+TIMEFRAME = '15m'
+CANDLES = 3000
+WARMUP = 300  # Первые свечи не сравниваются: у ta и потокового расчёта разные значения до заполнения окон
+STREAMED = 400  # Сколько последних свечей подаются по одной, как в работающем боте
+COLUMNS = ['SMA5', 'SMA10', 'EMA20', 'RSI', 'MACD', 'MACD_signal', 'Bollinger_High', 'Bollinger_Low',
+           'Stochastic', 'ADX', 'ATR', 'OBV', 'MFI']
+RTOL = 1e-9
+
+
+def ta_indicators(df):
+    """Индикаторы analyze_data в том виде, в каком их считал ta до потокового расчёта."""
+    close, high, low, volume = df['close'], df['high'], df['low'], df['volume']
+    macd = MACD(close=close)
+    bollinger = BollingerBands(close=close, window=20, window_dev=2)
+    return pd.DataFrame({
+        'SMA5': SMAIndicator(close=close, window=5).sma_indicator(),
+        'SMA10': SMAIndicator(close=close, window=10).sma_indicator(),
+        'EMA20': EMAIndicator(close=close, window=20).ema_indicator(),
+        'RSI': RSIIndicator(close=close, window=14).rsi(),
+        'MACD': macd.macd(),
+        'MACD_signal': macd.macd_signal(),
+        'Bollinger_High': bollinger.bollinger_hband(),
+        'Bollinger_Low': bollinger.bollinger_lband(),
+        'Stochastic': StochasticOscillator(high=high, low=low, close=close, window=14, smooth_window=3).stoch(),
+        'ADX': ADXIndicator(high=high, low=low, close=close, window=14).adx(),
+        'ATR': AverageTrueRange(high=high, low=low, close=close, window=14).average_true_range(),
+        'OBV': OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume(),
+        'MFI': MFIIndicator(high=high, low=low, close=close, volume=volume, window=14).money_flow_index(),
+    }, index=df.index)
+
+
+def assert_matches(values, reference, where):
+    for column in COLUMNS:
+        assert values[column] == pytest.approx(reference[column], rel=RTOL), f"{column} на {where}"
+
+
+@pytest.fixture(params=[1e-5, 65_000], ids=['pepe', 'btc'])
+def candles(request):
+    step = interval_ms(TIMEFRAME)
+    df = synthetic_candles('PARITYUSDT', TIMEFRAME, 1_600_000_000_000 // step * step, CANDLES)
+    for column in ('open', 'high', 'low', 'close'):
+        df[column] *= request.param / 500
+    return df
+
+
+def test_streaming_matches_ta_candle_by_candle(candles):
+    """Каждая новая свеча продвигает состояние, а значения совпадают с пересчётом ta по всей истории."""
+    bot.indicator_states.clear()
+    reference = ta_indicators(candles)
+    symbol = 'PARITYUSDT'
+    for end in range(CANDLES - STREAMED, CANDLES + 1):
+        previous, latest = bot.update_streaming_indicators(candles.iloc[:end], symbol, TIMEFRAME)
+        if end - 2 >= WARMUP:
+            assert_matches(latest, reference.iloc[end - 1], f"свече {end - 1}")
+            assert_matches(previous, reference.iloc[end - 2], f"свече {end - 2}")
+
+
+def test_forming_candle_is_updated_in_place(candles):
+    """Обновление незакрытой свечи пересчитывает её от зафиксированного состояния, не добавляя строку."""
+    bot.indicator_states.clear()
+    symbol = 'FORMINGUSDT'
+    history = candles.iloc[:-1]
+    final = candles.iloc[-1]
+    bot.update_streaming_indicators(history, symbol, TIMEFRAME)
+
+    # Та же свеча приходит несколько раз, пока формируется: цена ходит, объём растёт
+    for fraction in (0.2, 0.6, 1.0):
+        forming = final.copy()
+        forming['close'] = final['open'] + (final['close'] - final['open']) * fraction * 1.7
+        forming['high'] = max(final['high'], forming['close'])
+        forming['low'] = min(final['low'], forming['close'])
+        forming['volume'] = final['volume'] * fraction
+        df = pd.concat([history, forming.to_frame().T.astype(history.dtypes)])
+        previous, latest = bot.update_streaming_indicators(df, symbol, TIMEFRAME)
+        reference = ta_indicators(df)
+        assert_matches(latest, reference.iloc[-1], f"формирующейся свече ({fraction:.0%})")
+        assert_matches(previous, reference.iloc[-2], "предыдущей свече")
+
+    # Закрытая свеча после всех обновлений даёт тот же результат, что и при однократной подаче
+    _, latest = bot.update_streaming_indicators(candles, symbol, TIMEFRAME)
+    assert_matches(latest, ta_indicators(candles).iloc[-1], "закрытой свече")
@@ -0,0 +1,63 @@
+"""Отписка от части пар при подписке с '*'."""
+
+import pytest
+
+import bot
+
+SYMBOLS = ['BTCUSDT', 'PEPEUSDT', 'TONUSDT']
+TIMEFRAMES = ['15m', '1h', '4h']
+CHAT = 1
+
+
+@pytest.fixture(autouse=True)
+def subscribers(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'SUBSCRIBERS_DB', str(tmp_path / 'subscribers.db'))
+    monkeypatch.setattr(bot, 'SUBSCRIBERS_FILE', str(tmp_path / 'subscribers.json'))
+    monkeypatch.setattr(bot, 'CRYPTO_SYMBOLS', SYMBOLS)
+    monkeypatch.setattr(bot, 'TIMEFRAMES', TIMEFRAMES)
+    for name in ('_subscribers', '_subscription_index', '_subscribers_db', '_subscribers_version'):
+        monkeypatch.setattr(bot, name, None)
+    yield
+    bot.close_subscribers_db()
+
+
+def routed_pairs(chat_id=CHAT):
+    """Пары, сигналы которых дойдут до чата."""
+    index = bot.get_subscription_index()
+    return {(symbol, timeframe) for symbol in SYMBOLS for timeframe in TIMEFRAMES if chat_id in index.match(symbol, timeframe)}
+
+
+def reload():
+    """Сбрасывает кэш подписчиков, чтобы следующий вызов прочитал базу."""
+    bot.close_subscribers_db()
+    bot._subscribers = bot._subscription_index = None
+
+
+def test_stop_symbol_under_wildcard():
+    bot.add_subscriber(CHAT)
+    assert bot.remove_subscriber(CHAT, [('PEPEUSDT', '*')]) == [('PEPEUSDT', '*')]
+    expected = {(symbol, timeframe) for symbol in ('BTCUSDT', 'TONUSDT') for timeframe in TIMEFRAMES}
+    assert routed_pairs() == expected
+    reload()
+    assert routed_pairs() == expected
+
+
+def test_stop_pair_under_symbol_and_timeframe_wildcards():
+    bot.add_subscriber(CHAT, [('PEPEUSDT', '*'), ('*', '1h')])
+    bot.remove_subscriber(CHAT, [('PEPEUSDT', '1h')])
+    assert routed_pairs() == {('PEPEUSDT', '15m'), ('PEPEUSDT', '4h'), ('BTCUSDT', '1h'), ('TONUSDT', '1h')}
+
+
+def test_stop_wildcard_removes_narrower_filters():
+    bot.add_subscriber(CHAT, [('PEPEUSDT', '1h'), ('BTCUSDT', '1h')])
+    assert bot.remove_subscriber(CHAT, [('PEPEUSDT', '*')]) == [('PEPEUSDT', '*')]
+    assert routed_pairs() == {('BTCUSDT', '1h')}
+    bot.remove_subscriber(CHAT, [('*', '1h')])
+    assert routed_pairs() == set()
+    assert CHAT not in bot.load_subscribers()
+
+
+def test_stop_unrelated_pair_changes_nothing():
+    bot.add_subscriber(CHAT, [('BTCUSDT', '*')])
+    assert bot.remove_subscriber(CHAT, [('PEPEUSDT', '*')]) == []
+    assert bot.get_subscription_index().filters[CHAT] == {('BTCUSDT', '*')}
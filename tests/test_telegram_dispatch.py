@@ -0,0 +1,71 @@
+"""Рассылка SignalDispatcher через настоящий клиент Bot API к локальной заглушке с ответами 429."""
+
+import asyncio
+from collections import Counter
+
+import pytest
+from telegram.ext import ApplicationBuilder
+
+import bot
+from benchmark import FakeTelegramServer
+
+CHATS = 600
+SIGNALS_PER_CHAT = 2
+RATE_LIMIT_EVERY = 100
+# Больше интервала между сообщениями в один чат: повтор не может уложиться в задержку сервера случайно
+RETRY_AFTER = 2
+GLOBAL_RATE = 300
+TOLERANCE = 0.05  # Погрешность часов заглушки и бота (в секундах)
+IN_FLIGHT = 0.5  # За это время доходят запросы, отправленные до получения ответа 429 (в секундах)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeTelegramServer(rate_limit_every=RATE_LIMIT_EVERY, retry_after=RETRY_AFTER)
+    monkeypatch.setattr(bot, 'TELEGRAM_API_URL', server.url)
+    monkeypatch.setattr(bot, 'TELEGRAM_GLOBAL_RATE', GLOBAL_RATE)
+    yield server
+    server.close()
+
+
+async def dispatch(chat_ids):
+    dispatcher = bot.SignalDispatcher()
+    for number in range(SIGNALS_PER_CHAT):
+        dispatcher.queue_signal(f'Сигнал {number}', chat_ids)
+    # Клиент Bot API собирается так же, как в main, с тем же пулом соединений
+    application = ApplicationBuilder().token(bot.API_TOKEN).base_url(bot.TELEGRAM_API_URL).build()
+    async with application.bot as tg_bot:
+        await dispatcher.flush(tg_bot)
+    return dispatcher
+
+
+def test_one_message_per_chat_and_retry_after_is_respected(server):
+    chat_ids = list(range(1, CHATS + 1))
+    dispatcher = asyncio.run(dispatch(chat_ids))
+
+    delivered = Counter(chat_id for _, chat_id, _ in server.sent)
+    assert delivered == Counter(chat_ids)
+    assert all(text == 'Сигнал 0\n\nСигнал 1' for _, _, text in server.sent)
+    assert dispatcher.sent == CHATS and dispatcher.failed == 0
+
+    limited = dict((chat_id, at) for at, chat_id in server.limited)
+    assert len(limited) == CHATS // RATE_LIMIT_EVERY
+    assert dispatcher.retries == len(limited)
+    delivered_at = {chat_id: at for at, chat_id, _ in server.sent}
+    for chat_id, limited_at in limited.items():
+        assert delivered_at[chat_id] - limited_at >= RETRY_AFTER - TOLERANCE, chat_id
+    # После 429 пауза общая: когда дойдут запросы, отправленные до получения ответа, сервер ничего не получает до её конца
+    first_limited = min(limited.values())
+    pause = (first_limited + IN_FLIGHT, first_limited + RETRY_AFTER - TOLERANCE)
+    assert not [at for at, _, _ in server.sent if pause[0] < at < pause[1]]
+
+
+def test_global_rate_is_respected(server):
+    server.server.rate_limit_every = 0
+    asyncio.run(dispatch(list(range(1, CHATS + 1))))
+
+    times = sorted(at for at, _, _ in server.sent)
+    assert len(times) == CHATS
+    # Токен-бакет пропускает запас в GLOBAL_RATE сообщений и далее не больше GLOBAL_RATE в секунду
+    window_max = max(sum(1 for at in times[i:i + 3 * GLOBAL_RATE] if at < start + 1) for i, start in enumerate(times))
+    assert window_max <= 2 * GLOBAL_RATE